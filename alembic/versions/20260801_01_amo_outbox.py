@@ -0,0 +1,38 @@
+"""add amoCRM write outbox
+
+Revision ID: 20260801_01
+Revises: 20260716_01
+Create Date: 2026-08-01 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260801_01"
+down_revision = "20260716_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "amo_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("kind", sa.String(length=32), nullable=False),
+        sa.Column("entity_id", sa.BigInteger(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_amo_outbox_status_id", "amo_outbox", ["status", "id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_amo_outbox_status_id", table_name="amo_outbox")
+    op.drop_table("amo_outbox")
@@ -0,0 +1,33 @@
+"""add persistent fsm storage
+
+Revision ID: 20260805_01
+Revises: 20260801_01
+Create Date: 2026-08-05 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260805_01"
+down_revision = "20260801_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "fsm_storage",
+        sa.Column("key", sa.String(length=512), primary_key=True),
+        sa.Column("state", sa.String(length=255), nullable=True),
+        sa.Column("data", sa.Text(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_fsm_storage_updated_at", "fsm_storage", ["updated_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fsm_storage_updated_at", table_name="fsm_storage")
+    op.drop_table("fsm_storage")
@@ -0,0 +1,25 @@
+"""add cached Telegram file_id to broadcasts
+
+Revision ID: 20260812_01
+Revises: 20260805_01
+Create Date: 2026-08-12 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260812_01"
+down_revision = "20260805_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("broadcasts", sa.Column("telegram_file_id", sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("broadcasts", "telegram_file_id")
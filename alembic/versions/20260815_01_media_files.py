@@ -0,0 +1,34 @@
+"""add telegram media file_id registry
+
+Revision ID: 20260815_01
+Revises: 20260812_01
+Create Date: 2026-08-15 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260815_01"
+down_revision = "20260812_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "media_files",
+        sa.Column("source", sa.String(length=1024), nullable=False),
+        sa.Column("content_type", sa.String(length=32), nullable=False),
+        sa.Column("mtime", sa.Float(), nullable=True),
+        sa.Column("file_id", sa.String(length=255), nullable=False),
+        sa.Column("file_unique_id", sa.String(length=255), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("source", "content_type"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("media_files")
@@ -0,0 +1,48 @@
+"""users: add last_activity_at with backfill
+
+Revision ID: 20260820_01
+Revises: 20260815_01
+Create Date: 2026-08-20 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260820_01"
+down_revision = "20260815_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("last_activity_at", sa.DateTime(), nullable=True))
+    # Та же логика, что раньше считалась на каждом проходе: последний урок, иначе дата регистрации
+    op.execute(
+        """
+        UPDATE users AS u
+        SET last_activity_at = COALESCE(
+            (
+                SELECT COALESCE(r.completed_at, r.started_at)
+                FROM lesson_results AS r
+                WHERE r.user_id = u.id
+                ORDER BY r.started_at DESC NULLS LAST, r.id DESC
+                LIMIT 1
+            ),
+            u.created_at
+        )
+        """
+    )
+    op.create_index(
+        "ix_users_last_activity_at_notification_stage",
+        "users",
+        ["last_activity_at", "notification_stage"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_last_activity_at_notification_stage", table_name="users")
+    op.drop_column("users", "last_activity_at")
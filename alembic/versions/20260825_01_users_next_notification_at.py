@@ -0,0 +1,40 @@
+"""users: add next_notification_at for the notification scheduler
+
+Revision ID: 20260825_01
+Revises: 20260820_01
+Create Date: 2026-08-25 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260825_01"
+down_revision = "20260820_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("next_notification_at", sa.DateTime(), nullable=True))
+    # Всех, кто ещё может получить напоминание, планировщик пересмотрит при первом запуске
+    op.execute(
+        """
+        UPDATE users AS u
+        SET next_notification_at = timezone('utc', now())
+        WHERE u.tg_user_id IS NOT NULL
+          AND COALESCE(u.notification_stage, 0) < 4
+          AND NOT EXISTS (
+              SELECT 1 FROM lesson_results AS r
+              WHERE r.user_id = u.id AND r.lesson_key = 'exam' AND r.compleat IS TRUE
+          )
+        """
+    )
+    op.create_index("ix_users_next_notification_at", "users", ["next_notification_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_next_notification_at", table_name="users")
+    op.drop_column("users", "next_notification_at")
@@ -0,0 +1,43 @@
+"""add user_progress bitmask of completed lessons
+
+Revision ID: 20260901_01
+Revises: 20260825_01
+Create Date: 2026-09-01 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260901_01"
+down_revision = "20260825_01"
+branch_labels = None
+depends_on = None
+
+# Порядок уроков на момент миграции (service.questions_lexicon.lessons)
+LESSON_KEYS = ("lesson_1", "lesson_2", "lesson_3", "lesson_4", "lesson_5", "lesson_6", "lesson_7", "exam")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_progress",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("completed_mask", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("timezone('utc', now())")),
+    )
+    bits = " ".join(f"WHEN '{key}' THEN {1 << index}" for index, key in enumerate(LESSON_KEYS))
+    op.execute(
+        f"""
+        INSERT INTO user_progress (user_id, completed_mask)
+        SELECT user_id, bit_or(CASE lesson_key {bits} ELSE 0 END)
+        FROM lesson_results
+        WHERE compleat IS TRUE
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_progress")
@@ -0,0 +1,58 @@
+"""lesson_results: composite and partial indexes for hot lookups
+
+Revision ID: 20260905_01
+Revises: 20260901_01
+Create Date: 2026-09-05 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20260905_01"
+down_revision = "20260901_01"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_lesson_results_user_key_compleat", ["user_id", "lesson_key", "compleat"], None),
+    ("ix_lesson_results_exam_passed", ["user_id"], "lesson_key = 'exam' AND compleat IS TRUE"),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись результатов уроков на время построения
+    with op.get_context().autocommit_block():
+        for name, columns, where in INDEXES:
+            op.create_index(
+                name,
+                "lesson_results",
+                columns,
+                unique=False,
+                postgresql_where=sa.text(where) if where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        # Покрывается ix_lesson_results_user_key_compleat
+        op.drop_index(
+            "ix_lesson_results_user_id",
+            table_name="lesson_results",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_lesson_results_user_id",
+            "lesson_results",
+            ["user_id"],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        for name, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name="lesson_results", postgresql_concurrently=True, if_exists=True)
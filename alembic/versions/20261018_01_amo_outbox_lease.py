@@ -0,0 +1,27 @@
+"""amo_outbox: lease timestamp for rows being sent
+
+Revision ID: 20261018_01
+Revises: 20260905_01
+Create Date: 2026-10-18 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261018_01"
+down_revision = "20260905_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("amo_outbox", sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    # Записи, застрявшие в отправке, возвращаются в очередь
+    op.execute("UPDATE amo_outbox SET status = 'pending' WHERE status = 'sending'")
+    op.drop_column("amo_outbox", "locked_until")
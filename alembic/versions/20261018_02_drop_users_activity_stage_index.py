@@ -0,0 +1,39 @@
+"""users: drop unused last_activity_at/notification_stage index
+
+Revision ID: 20261018_02
+Revises: 20261018_01
+Create Date: 2026-10-18 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+
+revision = "20261018_02"
+down_revision = "20261018_01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Напоминания выбираются по next_notification_at, этот индекс только замедляет запись активности
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_users_last_activity_at_notification_stage",
+            table_name="users",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_users_last_activity_at_notification_stage",
+            "users",
+            ["last_activity_at", "notification_stage"],
+            unique=False,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
@@ -0,0 +1,48 @@
+"""users, lesson_results: updated_at watermark for the report cache
+
+Revision ID: 20261018_03
+Revises: 20261018_02
+Create Date: 2026-10-18 00:00:00
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261018_03"
+down_revision = "20261018_02"
+branch_labels = None
+depends_on = None
+
+TABLES = ("users", "lesson_results")
+
+
+def upgrade() -> None:
+    # Без бэкфилла: NULL не влияет на max(updated_at), а любая новая запись его поднимет
+    for table in TABLES:
+        op.add_column(table, sa.Column("updated_at", sa.DateTime(), nullable=True))
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.create_index(
+                f"ix_{table}_updated_at",
+                table,
+                ["updated_at"],
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.drop_index(
+                f"ix_{table}_updated_at",
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+    for table in TABLES:
+        op.drop_column(table, "updated_at")
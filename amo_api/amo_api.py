@@ -1,15 +1,18 @@
-from pprint import pprint
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Optional, Any
-import dotenv
-import jwt
-import requests
-from datetime import datetime
+import aiohttp
 import logging
 
-from pydantic import json
-from requests.exceptions import JSONDecodeError
-
+from amo_api.lead_index import LeadStageIndex
+from amo_api.tokens import AmoTokenManager
 from db import User
+from service.rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
@@ -154,6 +157,40 @@ class Customer:
         return f'{next_status}, {self.partner_status_dct.get(next_status)[0]}'
 
 
+class AmoApiError(RuntimeError):
+    pass
+
+
+@dataclass(slots=True)
+class AmoApiMetrics:
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    server_errors: int = 0
+    network_errors: int = 0
+    failed: int = 0
+    limiter_wait: float = 0.0
+
+    def snapshot(self) -> dict[str, float]:
+        return asdict(self)
+
+
+# Ответы, после которых запрос можно безопасно повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# POST не идемпотентен: повторяем только если amoCRM точно не принял запрос
+POST_RETRY_STATUSES = {429, 503}
+
+
+@dataclass(slots=True)
+class AmoResponse:
+    status_code: int
+    text: str
+    url: str
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
 class AmoCRMWrapper:
     def __init__(self,
                  path: str,
@@ -163,55 +200,89 @@ class AmoCRMWrapper:
                  amocrm_redirect_url: str,
                  amocrm_access_token: str | None,
                  amocrm_refresh_token: str | None,
-                 amocrm_secret_code: str
+                 amocrm_secret_code: str,
+                 *,
+                 base_url: str | None = None,
+                 request_timeout: float = 15,
+                 connect_timeout: float = 5,
+                 pool_size: int = 20,
+                 lead_index_refresh_interval: float = 300,
+                 rate_limit: float = 6,
+                 max_retries: int = 4,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 30,
+                 metrics_log_interval: float = 300,
                  ):
         self.path_to_env = path
         self.amocrm_subdomain = amocrm_subdomain
         self.amocrm_client_id = amocrm_client_id
         self.amocrm_client_secret = amocrm_client_secret
         self.amocrm_redirect_url = amocrm_redirect_url
-        self.amocrm_access_token = amocrm_access_token
-        self.amocrm_refresh_token = amocrm_refresh_token
         self.amocrm_secret_code = amocrm_secret_code
+        self.base_url = (base_url or "https://{}.amocrm.ru".format(amocrm_subdomain)).rstrip("/")
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.lead_index_refresh_interval = lead_index_refresh_interval
+        self._session: aiohttp.ClientSession | None = None
+        self._lead_indexes: dict[tuple[int, int], LeadStageIndex] = {}
+        # amoCRM ограничивает интеграцию ~7 запросами в секунду: все вызовы идут через общий лимитер
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = AmoApiMetrics()
+        self.metrics_log_interval = metrics_log_interval
+        self._metrics_logged_at = time.monotonic()
+        self._metrics_logged_requests = 0
+        self.tokens = AmoTokenManager(
+            path_to_env=path,
+            access_token=amocrm_access_token,
+            refresh_token=amocrm_refresh_token,
+            fetch_tokens=self._fetch_refreshed_tokens,
+        )
 
+    @property
+    def amocrm_access_token(self) -> str | None:
+        return self.tokens.access_token
 
-    @staticmethod
-    def _is_expire(token: str):
-        token_data = jwt.decode(token, options={"verify_signature": False})
-        exp = datetime.utcfromtimestamp(token_data["exp"])
-        now = datetime.utcnow()
-
-        return now >= exp
-
-    def _save_tokens(self, access_token: str, refresh_token: str):
-        dotenv.set_key(self.path_to_env, "AMOCRM_ACCESS_TOKEN", access_token)
-        dotenv.set_key(self.path_to_env, "AMOCRM_REFRESH_TOKEN", refresh_token)
-        self.amocrm_access_token = access_token
-        self.amocrm_refresh_token = refresh_token
-
-    def _get_access_token(self):
-        return self.amocrm_access_token
+    @property
+    def amocrm_refresh_token(self) -> str | None:
+        return self.tokens.refresh_token
 
-    def _get_new_tokens(self):
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Одна сессия на весь процесс: пул соединений к amoCRM переиспользуется всеми хендлерами
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout, connect=self.connect_timeout),
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        for index in self._lead_indexes.values():
+            await index.close()
+        await self.tokens.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request_tokens(self, data: dict) -> dict:
+        session = await self._get_session()
+        async with session.post(f"{self.base_url}/oauth2/access_token", json=data) as response:
+            return await response.json(content_type=None)
+
+    async def _fetch_refreshed_tokens(self, refresh_token: str | None) -> dict:
         data = {
             "client_id": self.amocrm_client_id,
             "client_secret": self.amocrm_client_secret,
             "grant_type": "refresh_token",
-            "refresh_token": self.amocrm_refresh_token,
+            "refresh_token": refresh_token,
             "redirect_uri": self.amocrm_redirect_url
         }
-        response = requests.post("https://{}.amocrm.ru/oauth2/access_token".format(self.amocrm_subdomain),
-                                 json=data).json()
-        try:
-            access_token = response["access_token"]
-            refresh_token = response["refresh_token"]
-        except KeyError as error:
-            logger.error("Ошибка обновления токенов")
-            return False
+        return await self._request_tokens(data)
 
-        self._save_tokens(access_token, refresh_token)
-
-    def init_oauth2(self):
+    async def init_oauth2(self):
         data = {
             "client_id": self.amocrm_client_id,
             "client_secret": self.amocrm_client_secret,
@@ -220,51 +291,137 @@ class AmoCRMWrapper:
             "redirect_uri": self.amocrm_redirect_url
         }
 
-        response = requests.post("https://{}.amocrm.ru/oauth2/access_token".format(self.amocrm_subdomain),
-                                 json=data).json()
+        response = await self._request_tokens(data)
 
         access_token = response["access_token"]
         refresh_token = response["refresh_token"]
 
-        self._save_tokens(access_token, refresh_token)
-
-    def _base_request(self, **kwargs) -> json:
-        if self._is_expire(self._get_access_token()):
-            self._get_new_tokens()
+        await self.tokens.set_tokens(access_token, refresh_token)
 
-        access_token = "Bearer " + self._get_access_token()
-
-        headers = {"Authorization": access_token}
+    async def _base_request(self, **kwargs) -> AmoResponse:
         req_type = kwargs.get("type")
-        response = ""
-        if req_type == "get":
-            response = requests.get("https://{}.amocrm.ru{}".format(
-                self.amocrm_subdomain, kwargs.get("endpoint")), headers=headers)
+        url = "{}{}".format(self.base_url, kwargs.get("endpoint"))
+        request_kwargs: dict[str, Any] = {}
+        if kwargs.get("timeout") is not None:
+            request_kwargs["timeout"] = aiohttp.ClientTimeout(total=kwargs["timeout"], connect=self.connect_timeout)
 
+        if req_type == "get":
+            method = "GET"
         elif req_type == "get_param":
-            url = "https://{}.amocrm.ru{}?{}".format(
-                self.amocrm_subdomain,
-                kwargs.get("endpoint"), kwargs.get("parameters"))
-            response = requests.get(str(url), headers=headers)
-
+            method = "GET"
+            parameters = kwargs.get("parameters")
+            if isinstance(parameters, dict):
+                request_kwargs["params"] = parameters
+            else:
+                url = "{}?{}".format(url, parameters)
         elif req_type == "post":
-            response = requests.post("https://{}.amocrm.ru{}".format(
-                self.amocrm_subdomain,
-                kwargs.get("endpoint")), headers=headers, json=kwargs.get("data"))
-
+            method = "POST"
+            request_kwargs["json"] = kwargs.get("data")
         elif req_type == 'patch':
-            response = requests.patch("https://{}.amocrm.ru{}".format(
-                self.amocrm_subdomain,
-                kwargs.get("endpoint")), headers=headers, json=kwargs.get("data"))
-        return response
+            method = "PATCH"
+            request_kwargs["json"] = kwargs.get("data")
+        else:
+            raise ValueError(f"Unsupported amoCRM request type: {req_type}")
+        retry_statuses = POST_RETRY_STATUSES if method == "POST" else RETRY_STATUSES
 
-    def get_contact_by_phone(self, phone_number) -> tuple[bool, dict|str]:
+        session = await self._get_session()
+        token_refreshed = False
+        attempt = 0
+        while True:
+            self.metrics.limiter_wait += await self.rate_limiter.acquire()
+            access_token = await self.tokens.get_access_token()
+            request_kwargs["headers"] = {"Authorization": "Bearer " + str(access_token)}
+            self.metrics.requests += 1
+            try:
+                async with session.request(method, url, **request_kwargs) as response:
+                    text = await response.text()
+                    result = AmoResponse(status_code=response.status, text=text, url=str(response.url))
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                self.metrics.network_errors += 1
+                if attempt >= self.max_retries:
+                    self.metrics.failed += 1
+                    raise AmoApiError(f"amoCRM недоступен: {method} {url}: {error!r}") from error
+                delay = self._backoff_delay(attempt)
+                reason = repr(error)
+            else:
+                if result.status_code == 401 and not token_refreshed:
+                    # Токен мог быть отозван раньше срока: обновляем один раз и повторяем
+                    token_refreshed = True
+                    if await self.tokens.refresh():
+                        continue
+                if result.status_code not in retry_statuses:
+                    self._maybe_log_metrics()
+                    return result
+                if result.status_code == 429:
+                    self.metrics.throttled += 1
+                else:
+                    self.metrics.server_errors += 1
+                if attempt >= self.max_retries:
+                    self.metrics.failed += 1
+                    logger.error("amoCRM вернул %s на %s %s после %s попыток",
+                                 result.status_code, method, url, attempt + 1)
+                    self._maybe_log_metrics()
+                    return result
+                delay = self._retry_after_delay(retry_after)
+                if delay is None:
+                    delay = self._backoff_delay(attempt)
+                if result.status_code == 429:
+                    # Лимит общий для интеграции: притормаживаем все запросы, а не только этот
+                    self.rate_limiter.pause(delay)
+                reason = f"HTTP {result.status_code}"
+
+            attempt += 1
+            self.metrics.retries += 1
+            logger.warning("Повтор запроса к amoCRM %s %s через %.1f с (%s), попытка %s",
+                           method, url, delay, reason, attempt + 1)
+            await asyncio.sleep(delay)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1)
+
+    def _retry_after_delay(self, value: str | None) -> float | None:
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0.0), self.backoff_max)
+
+    def _maybe_log_metrics(self) -> None:
+        now = time.monotonic()
+        if now - self._metrics_logged_at < self.metrics_log_interval:
+            return
+        self._metrics_logged_at = now
+        if self.metrics.requests == self._metrics_logged_requests:
+            return
+        self._metrics_logged_requests = self.metrics.requests
+        logger.info("Метрики amoCRM API: %s", self.metrics_snapshot())
+
+    def metrics_snapshot(self) -> dict[str, float]:
+        """Счётчики запросов, повторов и ожидания лимитера вместе с его настройками."""
+        return {
+            **self.metrics.snapshot(),
+            "rate_limit": self.rate_limiter.rate,
+            "max_retries": self.max_retries,
+            "backoff_max": self.backoff_max,
+        }
+
+    async def get_contact_by_phone(self, phone_number) -> tuple[bool, dict|str]:
 
         logger.info(f'Получен телефон клиента: {[phone_number]}')
 
         url = '/api/v4/contacts'
         query = str(f'query={phone_number}')
-        contact = self._base_request(endpoint=url, type="get_param", parameters=query)
+        contact = await self._base_request(endpoint=url, type="get_param", parameters=query)
 
         if contact.status_code == 200:
             contacts_list = contact.json()['_embedded']['contacts']
@@ -276,7 +433,7 @@ class AmoCRMWrapper:
             logger.info(f"Пробуем найти номер {phone_number}")
 
             query = str(f'query={phone_number}')
-            contact = self._base_request(endpoint=url, type="get_param", parameters=query)
+            contact = await self._base_request(endpoint=url, type="get_param", parameters=query)
             if contact.status_code == 200:
                 contacts_list = contact.json()['_embedded']['contacts']
                 return True, contacts_list[0]
@@ -284,20 +441,20 @@ class AmoCRMWrapper:
                 return False, 'Контакт не найден'
 
         else:
-            logger.error('Нет авторизации в AMO_API')
+            logger.error(f'Ошибка поиска контакта в AMO_API: {contact.status_code} {contact.text[:300]}')
             return False, 'Произошла ошибка на сервере!'
 
 
 
 
-    def get_customer_by_id(self, customer_id, with_contacts=False) -> tuple:
+    async def get_customer_by_id(self, customer_id, with_contacts=False) -> tuple:
         url = f'/api/v4/customers/{customer_id}'
         try:
             if with_contacts:
                 query = str(f'with=contacts')
-                customer = self._base_request(endpoint=url, type='get_param', parameters=query)
+                customer = await self._base_request(endpoint=url, type='get_param', parameters=query)
             else:
-                customer = self._base_request(endpoint=url, type='get')
+                customer = await self._base_request(endpoint=url, type='get')
         except Exception:
             return False, "Произошла ошибка на сервере"
         if customer.status_code == 200:
@@ -305,10 +462,10 @@ class AmoCRMWrapper:
         elif customer.status_code == 204:
             return False, 'Партнёр не найден!'
         else:
-            logger.error('Нет авторизации в AMO_API')
+            logger.error(f'Ошибка получения покупателя в AMO_API: {customer.status_code} {customer.text[:300]}')
             return False, 'Произошла ошибка на сервере!'
 
-    def add_new_task(self, contact_id, descr, url_materials, time, user_id):
+    async def add_new_task(self, contact_id, descr, url_materials, time, user_id):
         url = '/api/v4/tasks'
         data = [{
             'text': f'Обращение по ошибке чат-бота:\n{descr} {url_materials}',
@@ -318,14 +475,14 @@ class AmoCRMWrapper:
             'responsible_user_id': user_id
         }
         ]
-        response = self._base_request(type='post', endpoint=url, data=data)
+        response = await self._base_request(type='post', endpoint=url, data=data)
         return response
 
-    def get_customer_by_tg_id(self, tg_id: int) -> dict:  # Нужно убрать все id полей амо в конфиг
+    async def get_customer_by_tg_id(self, tg_id: int) -> dict:  # Нужно убрать все id полей амо в конфиг
         url = '/api/v4/customers'
         field_id = '1104992'
         query = str(f'filter[custom_fields_values][{field_id}][]={tg_id}')
-        response = self._base_request(endpoint=url, type='get_param', parameters=query)
+        response = await self._base_request(endpoint=url, type='get_param', parameters=query)
 
         if response.status_code == 200:
             customer_list = response.json()['_embedded']['customers']
@@ -353,11 +510,11 @@ class AmoCRMWrapper:
                     'response': 'Произошла ошибка на сервере'
                     }
 
-    def get_contact_by_tg_id(self, tg_id: int, fields_id: dict) -> dict:  # Нужно убрать все id полей амо в конфиг
+    async def get_contact_by_tg_id(self, tg_id: int, fields_id: dict) -> dict:  # Нужно убрать все id полей амо в конфиг
         url = '/api/v4/contacts'
         field_id = fields_id.get('tg_id_field')
         query = str(f'filter[custom_fields_values][{field_id}][]={tg_id}')
-        response = self._base_request(endpoint=url, type='get_param', parameters=query)
+        response = await self._base_request(endpoint=url, type='get_param', parameters=query)
         if response.status_code == 200:
             contacts_list = response.json()['_embedded']['contacts']
 
@@ -384,7 +541,7 @@ class AmoCRMWrapper:
                     'response': 'Произошла ошибка на сервере'
                     }
 
-    def put_data_in_lead(self):
+    async def put_data_in_lead(self):
         url = f'/api/v4/leads/32049218'
         data = {"custom_fields_values": [
             {"field_id": 1105338, # Поле оплаты картой
@@ -425,10 +582,10 @@ class AmoCRMWrapper:
              ]
              }
         ]}
-        response = self._base_request(type='patch', endpoint=url, data=data)
+        response = await self._base_request(type='patch', endpoint=url, data=data)
         return response
 
-    def put_tg_id_to_customer(self, id_customer, tg_id):
+    async def put_tg_id_to_customer(self, id_customer, tg_id):
         url = f'/api/v4/customers/{id_customer}'
         data = {"custom_fields_values": [
             {"field_id": 1104992,
@@ -436,11 +593,11 @@ class AmoCRMWrapper:
                  {"value": f"{tg_id}"},
                  ]
              }]}
-        response = self._base_request(type='patch', endpoint=url, data=data)
+        response = await self._base_request(type='patch', endpoint=url, data=data)
         logger.info(f'Запись ID_telegram: {tg_id} в карту партнёра: {id_customer}\n'
                     f'Статус операции: {response.status_code}')
 
-    def put_tgid_username_to_contact(self, id_contact, tg_id, username, fields_id: dict):
+    async def put_tgid_username_to_contact(self, id_contact, tg_id, username, fields_id: dict):
         url = f'/api/v4/contacts/{id_contact}'
         tg_id_field = fields_id.get('tg_id_field')
         tg_username_field = fields_id.get('tg_username_field')
@@ -455,11 +612,11 @@ class AmoCRMWrapper:
                  {"value": f"{username}"},
              ]
              }]}
-        response = self._base_request(type='patch', endpoint=url, data=data)
+        response = await self._base_request(type='patch', endpoint=url, data=data)
         logger.info(f'Запись ID_telegram: {tg_id} и username: {username} в контакт покупателя: {id_contact}\n'
                     f'Статус операции: {response.status_code}')
 
-    def send_lead_to_amo(self, pipeline_id: int, status_id: int, contact_id: int, utm_metriks_fields: dict,
+    async def send_lead_to_amo(self, pipeline_id: int, status_id: int, contact_id: int, utm_metriks_fields: dict,
                          user: User):
         custom_fields_values = []
         for metrik, metrika_id in utm_metriks_fields.items():
@@ -488,11 +645,11 @@ class AmoCRMWrapper:
             }
 
         },]
-        response = self._base_request(type='post', endpoint=url, data=data)
+        response = await self._base_request(type='post', endpoint=url, data=data)
         lead_id = response.json().get('_embedded').get('leads')[0].get('id')
         return lead_id
 
-    def push_lead_to_status(self, lead_id: str, pipeline_id: int, status_id: int):
+    async def push_lead_to_status(self, lead_id: str, pipeline_id: int, status_id: int):
         url = f'/api/v4/leads/{int(lead_id)}'
         data = {
             'name': 'Автосделка из бота hite_pro_education',
@@ -501,17 +658,19 @@ class AmoCRMWrapper:
             'status_id': int(status_id),
 
         }
-        response = self._base_request(type='patch', endpoint=url, data=data)
+        response = await self._base_request(type='patch', endpoint=url, data=data)
 
         if response.status_code == 200:
             return True
         else:
+            logger.error(f'Не удалось перевести сделку {lead_id} в этап {status_id}: '
+                         f'{response.status_code} {response.text[:300]}')
             return False
 
 
 
 
-    def add_new_note_to_lead(self, lead_id, text):
+    async def add_new_note_to_lead(self, lead_id, text):
         url = f'/api/v4/leads/{lead_id}/notes'
         data = [
             {
@@ -521,10 +680,10 @@ class AmoCRMWrapper:
                 }
             }
         ]
-        response = self._base_request(type='post', endpoint=url, data=data)
+        response = await self._base_request(type='post', endpoint=url, data=data)
         return response.json()
 
-    def add_catalog_elements_to_lead(self, lead_id, catalog_id: int, elements: list[dict,]):
+    async def add_catalog_elements_to_lead(self, lead_id, catalog_id: int, elements: list[dict,]):
         url = f'/api/v4/leads/{lead_id}/link'
         data = []
         for element in elements:
@@ -539,7 +698,7 @@ class AmoCRMWrapper:
                 }
             }
             data.append(element_for_record)
-        response = self._base_request(type='post', endpoint=url, data=data)
+        response = await self._base_request(type='post', endpoint=url, data=data)
         return response.json()
 
     # def get_catalog_by_id(self, catalog_id: int, page: int, limit:int):
@@ -551,33 +710,33 @@ class AmoCRMWrapper:
     #     response = self._base_request(type='get_param', endpoint=url, parameters=data)
     #     return response.json()
 
-    def get_catalog_elements_by_partnerid(self, partner_id):
+    async def get_catalog_elements_by_partnerid(self, partner_id):
         catalog_id = 2244
         url = f'/api/v4/catalogs/{catalog_id}/elements'
         filter = str(f'filter[custom_fields][1105082][from]={partner_id}&filter[custom_fields][1105082][to]={partner_id}')
-        response = self._base_request(type='get_param', endpoint=url, parameters=filter)
-        print(response.url)
+        response = await self._base_request(type='get_param', endpoint=url, parameters=filter)
+        logger.debug('Запрос элементов каталога: %s', response.url)
         return response.json()
 
 
-    def get_contact_by_id(self, contact_id) -> dict:
+    async def get_contact_by_id(self, contact_id) -> dict:
         url = f'/api/v4/contacts/{contact_id}'
-        response = self._base_request(type='get', endpoint=url)
+        response = await self._base_request(type='get', endpoint=url)
 
         return response.json()
 
-    def get_responsible_user_by_id(self, manager_id: int):
+    async def get_responsible_user_by_id(self, manager_id: int):
         url = f'/api/v4/users/{manager_id}'
 
-        responsible_manager = self._base_request(endpoint=url, type='get')
+        responsible_manager = await self._base_request(endpoint=url, type='get')
         if responsible_manager.status_code == 200:
             return responsible_manager.json()
         else:
-            raise JSONDecodeError
+            raise AmoApiError(f"amoCRM error {responsible_manager.status_code}: {responsible_manager.text}")
 
-    def get_lead_by_id(self, lead_id):
+    async def get_lead_by_id(self, lead_id):
         url = f'/api/v4/leads/{lead_id}'
-        response = self._base_request(type='get', endpoint=url)
+        response = await self._base_request(type='get', endpoint=url)
         return response.json()
 
     @staticmethod
@@ -587,7 +746,7 @@ class AmoCRMWrapper:
         return customer
 
 
-    def get_customers_list_if_tg(self):
+    async def get_customers_list_if_tg(self):
         url = f'/api/v4/customers/'
         limit = 250
         page = 1
@@ -595,11 +754,11 @@ class AmoCRMWrapper:
             'filter[custom_fields][5B1104992][from]': '1',
             # 'page': '1'
         }
-        response = self._base_request(type='get_param', endpoint=url, parameters=filter)
+        response = await self._base_request(type='get_param', endpoint=url, parameters=filter)
         logger.info(f'Статус код запроса записей покупателя: {response.status_code}')
         return response.json()
 
-    def create_new_contact(self, first_name: str, last_name: str, phone: str, tg_id_field: int, tg_id: str,
+    async def create_new_contact(self, first_name: str, last_name: str, phone: str, tg_id_field: int, tg_id: str,
                            username_id: int, username: str):
         url = '/api/v4/contacts'
         data = [{
@@ -627,11 +786,11 @@ class AmoCRMWrapper:
                  }
             ],
         }]
-        response = self._base_request(type='post', endpoint=url, data=data)
+        response = await self._base_request(type='post', endpoint=url, data=data)
         contact_id = response.json().get('_embedded').get('contacts')[0].get('id')
         return contact_id
 
-    def add_tg_to_contact(self, contact_id: int, tg_id_field: int, tg_id: str, username_id: int, username: str):
+    async def add_tg_to_contact(self, contact_id: int, tg_id_field: int, tg_id: str, username_id: int, username: str):
         url = f'/api/v4/contacts/{contact_id}'
         data = {
             'custom_fields_values': [
@@ -649,7 +808,7 @@ class AmoCRMWrapper:
                  }
             ],
         }
-        response = self._base_request(type='patch', endpoint=url, data=data)
+        response = await self._base_request(type='patch', endpoint=url, data=data)
         if response.status_code == 200:
             logger.info('TG_ID успешно добавлен в контакт')
             return True
@@ -657,7 +816,7 @@ class AmoCRMWrapper:
             logger.error('TG_ID не добавлен в контакт')
             return False
 
-    def find_lead_by_contact_in_pipeline_stage(
+    async def find_lead_by_contact_in_pipeline_stage(
             self,
             contact_id: str,
             pipeline_id: str,
@@ -687,17 +846,16 @@ class AmoCRMWrapper:
         if with_entities:
             params.append("with=contacts")
 
-        response = self._base_request(
+        response = await self._base_request(
             type="get_param",
             endpoint="/api/v4/leads",
             parameters="&".join(params),
         )
 
 
-        # requests.Response
         if response.status_code >= 400:
             # тут можно логировать response.text
-            raise RuntimeError(f"amoCRM error {response.status_code}: {response.text}")
+            raise AmoApiError(f"amoCRM error {response.status_code}: {response.text}")
 
         payload = response.json()
 
@@ -729,7 +887,7 @@ class AmoCRMWrapper:
 
         return None
 
-    def find_lead_by_contact_in_pipeline_stage_new(
+    async def find_lead_by_contact_in_pipeline_stage_new(
             self,
             contact_id: str,
             pipeline_id: str,
@@ -737,76 +895,26 @@ class AmoCRMWrapper:
             *,
             with_entities: bool = True
     ) -> Optional[int]:
-        page = 1
-        limit = 250
-        target_contact_id = int(contact_id)
-        target_pipeline_id = int(pipeline_id)
-        target_status_id = int(status_id)
-
-        while True:
-            query = (
-                f'filter[pipeline_id][]=3616530&'
-                f'filter[statuses][0][pipeline_id]=3616530&'
-                f'filter[statuses][0][status_id]=47244117&'
-                f'with=contacts&'
-                f'limit={limit}&'
-                f'page={page}'
-            )
-
-            response = self._base_request(
-                type="get_param",
-                endpoint="/api/v4/leads",
-                parameters=query,
-            )
-            if response.status_code >= 400:
-                raise RuntimeError(f"amoCRM error {response.status_code}: {response.text}")
-
-            payload = response.json()
-
-            leads = payload.get("_embedded", {}).get("leads", []) or []
-            if not leads:
-                return None
-
-            for lead in leads:
-                if int(lead.get("pipeline_id", -1)) != target_pipeline_id:
-                    continue
-                if int(lead.get("status_id", -1)) != target_status_id:
-                    continue
-
-                lead_contacts = lead.get("_embedded", {}).get("contacts", []) or []
-                if not lead_contacts:
-                    continue
-
-                main_contact = None
-                for lead_contact in lead_contacts:
-                    is_main = lead_contact.get("is_main")
-                    if is_main is True or str(is_main).lower() in {"1", "true"}:
-                        main_contact = lead_contact
-                        break
-
-                if main_contact is None and len(lead_contacts) == 1:
-                    main_contact = lead_contacts[0]
-                if main_contact is None:
-                    continue
-
-                try:
-                    main_contact_id = int(main_contact.get("id", -1))
-                except (TypeError, ValueError):
-                    continue
-
-                if main_contact_id == target_contact_id:
-                    return lead.get("id")
-
-            if not payload.get("_links", {}).get("next"):
-                return None
-
-            page += 1
-
+        """
+        Найти ID сделки, где контакт основной, на этапе status_id воронки pipeline_id.
 
+        Ищет по локальному индексу этапа; если контакта в нём нет - прямым запросом сделок контакта,
+        поэтому число запросов не зависит от количества сделок на этапе.
+        """
+        return await self.lead_index(pipeline_id, status_id).find(int(contact_id))
 
+    def lead_index(self, pipeline_id: int | str, status_id: int | str) -> LeadStageIndex:
+        key = (int(pipeline_id), int(status_id))
+        index = self._lead_indexes.get(key)
+        if index is None:
+            index = LeadStageIndex(self, *key, refresh_interval=self.lead_index_refresh_interval)
+            self._lead_indexes[key] = index
+        return index
 
 
 if __name__ == '__main__':
+    import asyncio
+
     from config.config import load_config, Config
     config: Config = load_config()
 
@@ -820,6 +928,11 @@ if __name__ == '__main__':
         amocrm_access_token=config.amo_config.amocrm_access_token,
         amocrm_refresh_token=config.amo_config.amocrm_refresh_token
     )
-    amo_api.init_oauth2()
 
+    async def _init() -> None:
+        try:
+            await amo_api.init_oauth2()
+        finally:
+            await amo_api.close()
 
+    asyncio.run(_init())
@@ -3,9 +3,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from db.models import User
 
 
-def processing_contact(amo_api: AmoCRMWrapper,
+async def processing_contact(amo_api: AmoCRMWrapper,
                        contact_phone_number: str,) -> dict|None:
-    contact_amo: tuple[bool, dict|str] = amo_api.get_contact_by_phone(phone_number=contact_phone_number)
+    contact_amo: tuple[bool, dict|str] = await amo_api.get_contact_by_phone(phone_number=contact_phone_number)
     if contact_amo[0]: # Контакт найден
         contact = contact_amo[1]
         first_name = contact.get("first_name", "")
@@ -24,14 +24,14 @@ def processing_contact(amo_api: AmoCRMWrapper,
         return None
 
 
-def processing_lead(amo_api: AmoCRMWrapper,
+async def processing_lead(amo_api: AmoCRMWrapper,
                     contact_id: str,
                     pipeline_id: str,
                     status_id: str) -> dict|None:
 
-    lead_id = amo_api.find_lead_by_contact_in_pipeline_stage_new(contact_id=str(contact_id),
-                                                          pipeline_id=pipeline_id,
-                                                          status_id=status_id)
+    lead_id = await amo_api.find_lead_by_contact_in_pipeline_stage_new(contact_id=str(contact_id),
+                                                                pipeline_id=pipeline_id,
+                                                                status_id=status_id)
     if lead_id is not None:
         return {
             "amo_deal_id": lead_id,
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, AsyncIterator
+
+if TYPE_CHECKING:
+    from amo_api.amo_api import AmoCRMWrapper
+
+logger = logging.getLogger(__name__)
+
+PAGE_LIMIT = 250
+# Запас на расхождение часов и задержку индексации amoCRM при инкрементальной синхронизации
+SYNC_OVERLAP_SECONDS = 120
+
+
+def _raise_for_status(response) -> None:
+    if response.status_code >= 400:
+        # Импорт здесь: amo_api.amo_api сам импортирует этот модуль
+        from amo_api.amo_api import AmoApiError
+
+        raise AmoApiError(f"amoCRM error {response.status_code}: {response.text}")
+
+
+def main_contact_id(lead: dict) -> int | None:
+    lead_contacts = lead.get("_embedded", {}).get("contacts", []) or []
+    if not lead_contacts:
+        return None
+
+    main_contact = None
+    for lead_contact in lead_contacts:
+        is_main = lead_contact.get("is_main")
+        if is_main is True or str(is_main).lower() in {"1", "true"}:
+            main_contact = lead_contact
+            break
+
+    if main_contact is None and len(lead_contacts) == 1:
+        main_contact = lead_contacts[0]
+    if main_contact is None:
+        return None
+
+    try:
+        return int(main_contact.get("id", -1))
+    except (TypeError, ValueError):
+        return None
+
+
+class LeadStageIndex:
+    """Локальный индекс contact_id -> lead_id для сделок на одном этапе воронки.
+
+    Индекс один раз строится полным обходом этапа в фоне, затем фоновый цикл раз
+    в refresh_interval читает события lead_status_changed и lead_deleted и вычёркивает
+    сделки индекса, которые сменили этап, воронку или удалены. После этого изменённые
+    сделки своей воронки забираются по filter[updated_at] и filter[pipeline_id]: сделка,
+    по-прежнему стоящая на этапе, возвращается в индекс. Пока индекс не готов или в нём
+    нет контакта, поиск идёт прямым запросом сделок контакта.
+    """
+
+    def __init__(
+        self,
+        amo_api: AmoCRMWrapper,
+        pipeline_id: int,
+        status_id: int,
+        *,
+        refresh_interval: float = 300,
+    ):
+        self._amo_api = amo_api
+        self.pipeline_id = int(pipeline_id)
+        self.status_id = int(status_id)
+        self.refresh_interval = refresh_interval
+        self._lead_by_contact: dict[int, int] = {}
+        self._contact_by_lead: dict[int, int] = {}
+        self._synced_until: int | None = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self._synced_until is not None
+
+    def __len__(self) -> int:
+        return len(self._lead_by_contact)
+
+    async def find(self, contact_id: int) -> int | None:
+        contact_id = int(contact_id)
+        # Синхронизация идёт в фоне: запрос пользователя её не ждёт
+        self.start()
+        lead_id = self._lead_by_contact.get(contact_id)
+        if lead_id is not None:
+            return lead_id
+
+        lead = await self._find_direct(contact_id)
+        if lead is None:
+            return None
+        self.apply_lead(lead)
+        return lead.get("id")
+
+    async def refresh(self) -> None:
+        """Одна инкрементальная синхронизация: события и изменённые сделки с прошлого раза."""
+        async with self._lock:
+            started_at = int(time.time())
+            since = (self._synced_until or started_at) - SYNC_OVERLAP_SECONDS
+            # Сначала вычёркиваем по событиям: выборка изменённых вернёт тех, кто остался на этапе
+            await self._sync_events(since)
+            await self._sync_updated(since)
+            self._synced_until = started_at
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"amocrm-lead-index-{self.status_id}")
+            self._task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Не удалось построить индекс сделок этапа %s: %s", self.status_id, task.exception()
+            )
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        if not self.ready:
+            await self._build()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Не удалось обновить индекс сделок этапа %s", self.status_id)
+
+    def apply_lead(self, lead: dict) -> None:
+        """Учитывает актуальное состояние сделки (из выборки, вебхука или прямого запроса)."""
+        try:
+            lead_id = int(lead["id"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self._discard_lead(lead_id)
+        if int(lead.get("pipeline_id", -1)) != self.pipeline_id:
+            return
+        if int(lead.get("status_id", -1)) != self.status_id:
+            return
+        contact_id = main_contact_id(lead)
+        if contact_id is None:
+            return
+        previous_lead = self._lead_by_contact.get(contact_id)
+        if previous_lead is not None:
+            self._contact_by_lead.pop(previous_lead, None)
+        self._lead_by_contact[contact_id] = lead_id
+        self._contact_by_lead[lead_id] = contact_id
+
+    def _discard_lead(self, lead_id: int) -> None:
+        contact_id = self._contact_by_lead.pop(lead_id, None)
+        if contact_id is not None and self._lead_by_contact.get(contact_id) == lead_id:
+            del self._lead_by_contact[contact_id]
+
+    async def _build(self) -> None:
+        async with self._lock:
+            started_at = int(time.time())
+            query = (
+                f'filter[pipeline_id][]={self.pipeline_id}&'
+                f'filter[statuses][0][pipeline_id]={self.pipeline_id}&'
+                f'filter[statuses][0][status_id]={self.status_id}&'
+                f'with=contacts'
+            )
+            count = 0
+            async for leads in self._pages("/api/v4/leads", query, "leads"):
+                for lead in leads:
+                    self.apply_lead(lead)
+                    count += 1
+            self._synced_until = started_at
+            logger.info(
+                "Индекс сделок этапа %s построен: сделок %s, контактов %s",
+                self.status_id,
+                count,
+                len(self._lead_by_contact),
+            )
+
+    async def _sync_updated(self, since: int) -> None:
+        # Только своя воронка: сделки остальных воронок аккаунта индексу не нужны
+        query = (
+            f'filter[updated_at][from]={since}&'
+            f'filter[pipeline_id][]={self.pipeline_id}&'
+            f'with=contacts'
+        )
+        async for leads in self._pages("/api/v4/leads", query, "leads"):
+            for lead in leads:
+                self.apply_lead(lead)
+
+    async def _sync_events(self, since: int) -> None:
+        # Ушедшие в другую воронку и удалённые сделки выборка по воронке не вернёт
+        query = (
+            f'filter[entity][]=lead&'
+            f'filter[type][]=lead_status_changed&'
+            f'filter[type][]=lead_deleted&'
+            f'filter[created_at][from]={since}'
+        )
+        async for events in self._pages("/api/v4/events", query, "events"):
+            for item in events:
+                try:
+                    self._discard_lead(int(item["entity_id"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+    async def _pages(self, endpoint: str, query: str, key: str) -> AsyncIterator[list[dict]]:
+        page = 1
+        while True:
+            response = await self._amo_api._base_request(
+                type="get_param",
+                endpoint=endpoint,
+                parameters=f"{query}&limit={PAGE_LIMIT}&page={page}",
+            )
+            if response.status_code == 204:
+                return
+            _raise_for_status(response)
+            payload = response.json()
+            items = payload.get("_embedded", {}).get(key, []) or []
+            if not items:
+                return
+            yield items
+            if not payload.get("_links", {}).get("next"):
+                return
+            page += 1
+
+    async def _find_direct(self, contact_id: int) -> dict | None:
+        response = await self._amo_api._base_request(
+            type="get_param",
+            endpoint=f"/api/v4/contacts/{contact_id}",
+            parameters="with=leads",
+        )
+        if response.status_code == 204:
+            return None
+        _raise_for_status(response)
+        contact_leads = response.json().get("_embedded", {}).get("leads", []) or []
+        lead_ids = [int(item["id"]) for item in contact_leads if item.get("id") is not None]
+        if not lead_ids:
+            return None
+
+        for offset in range(0, len(lead_ids), PAGE_LIMIT):
+            chunk = lead_ids[offset:offset + PAGE_LIMIT]
+            query = "&".join(f"filter[id][]={lead_id}" for lead_id in chunk)
+            response = await self._amo_api._base_request(
+                type="get_param",
+                endpoint="/api/v4/leads",
+                parameters=f"{query}&with=contacts&limit={PAGE_LIMIT}",
+            )
+            if response.status_code == 204:
+                continue
+            _raise_for_status(response)
+            for lead in response.json().get("_embedded", {}).get("leads", []) or []:
+                if int(lead.get("pipeline_id", -1)) != self.pipeline_id:
+                    continue
+                if int(lead.get("status_id", -1)) != self.status_id:
+                    continue
+                if main_contact_id(lead) == contact_id:
+                    return lead
+        return None
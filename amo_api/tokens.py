@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+TokenFetcher = Callable[[str | None], Awaitable[dict]]
+
+
+def write_env_values(path: str | Path, values: dict[str, str]) -> None:
+    """Записывает ключи в .env одним проходом через временный файл и атомарную замену."""
+    path = Path(path)
+    lines = path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+    pending = dict(values)
+    result: list[str] = []
+    for line in lines:
+        name = line.split("=", 1)[0].strip()
+        if name.startswith("export "):
+            name = name[len("export "):].strip()
+        if name in pending:
+            result.append(f"{name}='{pending.pop(name)}'")
+        else:
+            result.append(line)
+    result.extend(f"{name}='{value}'" for name, value in pending.items())
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+            tmp.write("\n".join(result) + "\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        if path.exists():
+            os.chmod(tmp_name, path.stat().st_mode & 0o777)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class AmoTokenManager:
+    """Хранит OAuth-токены amoCRM и обновляет их заранее, одним запросом на всех ожидающих."""
+
+    def __init__(
+        self,
+        path_to_env: str | Path,
+        access_token: str | None,
+        refresh_token: str | None,
+        fetch_tokens: TokenFetcher,
+        *,
+        refresh_margin: float = 300,
+        retry_delay: float = 60,
+    ):
+        self.path_to_env = path_to_env
+        self.refresh_token = refresh_token
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self._fetch_tokens = fetch_tokens
+        self._access_token: str | None = None
+        self._expires_at = 0.0
+        self._refresh_task: asyncio.Task | None = None
+        self._renewal_task: asyncio.Task | None = None
+        self._set_access_token(access_token)
+
+    @property
+    def access_token(self) -> str | None:
+        return self._access_token
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def _set_access_token(self, token: str | None) -> None:
+        self._access_token = token
+        self._expires_at = self._decode_expiry(token)
+
+    @staticmethod
+    def _decode_expiry(token: str | None) -> float:
+        if not token:
+            return 0.0
+        try:
+            token_data = jwt.decode(token, options={"verify_signature": False})
+            return float(token_data["exp"])
+        except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+            logger.warning("Не удалось прочитать срок действия токена amoCRM")
+            return 0.0
+
+    def is_expired(self, *, margin: float = 0) -> bool:
+        return time.time() >= self._expires_at - margin
+
+    async def get_access_token(self) -> str | None:
+        self._ensure_renewal_loop()
+        if self.is_expired():
+            await self.refresh()
+        elif self.is_expired(margin=self.refresh_margin):
+            # Токен ещё действует: обновляем его в фоне и не задерживаем запрос
+            self._start_refresh()
+        return self._access_token
+
+    async def refresh(self) -> bool:
+        return await asyncio.shield(self._start_refresh())
+
+    async def set_tokens(self, access_token: str, refresh_token: str) -> None:
+        self._set_access_token(access_token)
+        self.refresh_token = refresh_token
+        await asyncio.to_thread(
+            write_env_values,
+            self.path_to_env,
+            {"AMOCRM_ACCESS_TOKEN": access_token, "AMOCRM_REFRESH_TOKEN": refresh_token},
+        )
+
+    async def close(self) -> None:
+        for task in (self._renewal_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._renewal_task = None
+        self._refresh_task = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._do_refresh(), name="amocrm-token-refresh")
+        return self._refresh_task
+
+    async def _do_refresh(self) -> bool:
+        try:
+            response = await self._fetch_tokens(self.refresh_token)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Не удалось запросить новые токены amoCRM")
+            return False
+        try:
+            access_token = response["access_token"]
+            refresh_token = response["refresh_token"]
+        except (KeyError, TypeError):
+            logger.error("Ошибка обновления токенов")
+            return False
+        await self.set_tokens(access_token, refresh_token)
+        logger.info("Токены amoCRM обновлены")
+        return True
+
+    def _ensure_renewal_loop(self) -> None:
+        if self._renewal_task is None or self._renewal_task.done():
+            self._renewal_task = asyncio.create_task(self._renewal_loop(), name="amocrm-token-renewal")
+
+    async def _renewal_loop(self) -> None:
+        while True:
+            delay = self._expires_at - self.refresh_margin - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                refreshed = await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Фоновое обновление токенов amoCRM завершилось ошибкой")
+                refreshed = False
+            if not refreshed or self.is_expired(margin=self.refresh_margin):
+                await asyncio.sleep(self.retry_delay)
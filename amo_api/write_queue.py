@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Iterable
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from amo_api.amo_api import AmoApiError, AmoCRMWrapper
+from db.models import AmoOutbox
+from service.service import check_push_to_new_status
+
+logger = logging.getLogger(__name__)
+
+KIND_NOTE = "lead_note"
+KIND_STATUS = "lead_status"
+KIND_LEAD_FIELDS = "lead_fields"
+KIND_CONTACT_FIELDS = "contact_fields"
+
+# amoCRM принимает до 250 сущностей в одном запросе, берём с запасом
+BATCH_SIZE = 100
+# Аренда забранных записей: дольше самой медленной отправки пачки с повторами
+LEASE_SECONDS = 600
+# Ошибки валидации: amoCRM отклонил пачку из-за конкретной сущности, её ищем делением пачки
+SPLIT_STATUSES = {400, 422}
+# Лимит и авторизация не зависят от записей: пачка откладывается целиком, попытка не тратится
+DEFER_STATUSES = {401, 429}
+DEFER_BASE_SECONDS = 30
+# Так же сделку переименовывает AmoCRMWrapper.push_lead_to_status
+LEAD_NAME = "Автосделка из бота hite_pro_education"
+
+
+class AmoWriteQueue:
+    """Надёжная очередь записей в amoCRM.
+
+    Хендлеры кладут примечания, переводы сделок и обновления полей в таблицу amo_outbox
+    и сразу отвечают пользователю. Фоновый цикл раз в flush_interval секунд забирает
+    накопившиеся записи и отправляет их пачками: POST /api/v4/leads/notes,
+    PATCH /api/v4/leads и PATCH /api/v4/contacts.
+    """
+
+    def __init__(
+        self,
+        amo_api: AmoCRMWrapper,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        flush_interval: float = 3,
+        max_attempts: int = 5,
+        lease_seconds: float = LEASE_SECONDS,
+    ):
+        self.amo_api = amo_api
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._task: asyncio.Task | None = None
+        # Растёт вдвое при каждом подряд 429/401 и сбрасывается после отправки без них
+        self._defer_seconds = DEFER_BASE_SECONDS
+
+    async def enqueue_note(self, lead_id: int, text: str) -> None:
+        await self._enqueue(KIND_NOTE, lead_id, {"text": text})
+
+    async def enqueue_status(
+        self,
+        lead_id: int,
+        pipeline_id: int,
+        status_id: int,
+        *,
+        lesson_key: str | None = None,
+    ) -> None:
+        """Перевод сделки; с lesson_key сделка двигается только вперёд по воронке обучения."""
+        await self._enqueue(
+            KIND_STATUS,
+            lead_id,
+            {"pipeline_id": int(pipeline_id), "status_id": int(status_id), "lesson_key": lesson_key},
+        )
+
+    async def enqueue_lead_fields(self, lead_id: int, custom_fields_values: list[dict]) -> None:
+        await self._enqueue(KIND_LEAD_FIELDS, lead_id, {"custom_fields_values": custom_fields_values})
+
+    async def enqueue_contact_fields(self, contact_id: int, custom_fields_values: list[dict]) -> None:
+        await self._enqueue(KIND_CONTACT_FIELDS, contact_id, {"custom_fields_values": custom_fields_values})
+
+    async def _enqueue(self, kind: str, entity_id: int, payload: dict[str, Any]) -> None:
+        async with self.session_factory() as session:
+            session.add(
+                AmoOutbox(
+                    kind=kind,
+                    entity_id=int(entity_id),
+                    payload=json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+                    status="pending",
+                    attempts=0,
+                    created_at=datetime.now(timezone.utc),
+                )
+            )
+            await session.commit()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="amocrm-write-queue")
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Не удалось отправить очередь amoCRM при остановке")
+
+    async def _run(self) -> None:
+        while True:
+            # Записи, накопившиеся за интервал, уходят одной пачкой
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Полная успешная пачка - значит, в очереди могут быть ещё записи
+                while await self.flush() >= BATCH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка отправки очереди amoCRM")
+
+    async def flush(self) -> int:
+        """Отправляет одну пачку ожидающих записей. Возвращает число отправленных записей.
+
+        Записи забираются короткой транзакцией с арендой на lease_seconds, HTTP-запросы
+        к amoCRM идут без открытой транзакции, итог пишется второй короткой транзакцией.
+        Аренда, не закрытая из-за падения процесса, истекает, и записи забираются снова.
+        """
+        rows = await self._claim()
+        if not rows:
+            return 0
+        deferred: dict[int, str] = {}
+        failed = await self.send(rows, deferred)
+        delay = self._defer_seconds
+        if deferred:
+            self._defer_seconds = min(self._defer_seconds * 2, self.lease_seconds)
+        else:
+            self._defer_seconds = DEFER_BASE_SECONDS
+        await self._record(rows, failed, deferred, delay)
+        sent = len(rows) - len(failed) - len(deferred)
+        logger.info(
+            "Очередь amoCRM: отправлено %s, с ошибкой %s, отложено %s",
+            sent,
+            len(failed),
+            len(deferred),
+        )
+        return sent
+
+    async def _claim(self) -> list[AmoOutbox]:
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            rows = list(
+                (
+                    await session.execute(
+                        select(AmoOutbox)
+                        .where(
+                            AmoOutbox.status.in_(("pending", "sending")),
+                            or_(AmoOutbox.locked_until.is_(None), AmoOutbox.locked_until < now),
+                        )
+                        .order_by(AmoOutbox.id)
+                        .limit(BATCH_SIZE)
+                        .with_for_update(skip_locked=True)
+                    )
+                ).scalars()
+            )
+            for row in rows:
+                row.status = "sending"
+                row.locked_until = now + timedelta(seconds=self.lease_seconds)
+            await session.commit()
+        return rows
+
+    async def _record(
+        self,
+        rows: list[AmoOutbox],
+        failed: dict[int, str],
+        deferred: dict[int, str],
+        delay: float,
+    ) -> None:
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            sent_ids = [row.id for row in rows if row.id not in failed and row.id not in deferred]
+            if sent_ids:
+                await session.execute(delete(AmoOutbox).where(AmoOutbox.id.in_(sent_ids)))
+            deferred_ids = [row.id for row in rows if row.id in deferred]
+            if deferred_ids:
+                # Попытка не засчитывается: запись вернётся в очередь, когда истечёт locked_until
+                await session.execute(
+                    update(AmoOutbox)
+                    .where(AmoOutbox.id.in_(deferred_ids))
+                    .values(
+                        status="pending",
+                        error=next(iter(deferred.values()))[:2000],
+                        processed_at=now,
+                        locked_until=now + timedelta(seconds=delay),
+                    )
+                )
+            for row in rows:
+                if row.id not in failed:
+                    continue
+                attempts = row.attempts + 1
+                error = failed[row.id][:2000]
+                status = "failed" if attempts >= self.max_attempts else "pending"
+                await session.execute(
+                    update(AmoOutbox)
+                    .where(AmoOutbox.id == row.id)
+                    .values(status=status, attempts=attempts, error=error, processed_at=now, locked_until=None)
+                )
+                if status == "failed":
+                    logger.error(
+                        "Запись %s (%s, %s) в amoCRM не отправлена после %s попыток: %s",
+                        row.id,
+                        row.kind,
+                        row.entity_id,
+                        attempts,
+                        error,
+                    )
+            await session.commit()
+
+    async def send(
+        self,
+        rows: Iterable[AmoOutbox],
+        deferred: dict[int, str] | None = None,
+    ) -> dict[int, str]:
+        """Отправляет записи пачками и возвращает ошибки по id записей.
+
+        Записи, отложенные из-за 429 или 401, попадают в deferred; без него они
+        считаются ошибками.
+        """
+        rows = list(rows)
+        failed: dict[int, str] = {}
+        postponed: dict[int, str] = {} if deferred is None else deferred
+        notes = [row for row in rows if row.kind == KIND_NOTE]
+        lead_rows = [row for row in rows if row.kind in (KIND_STATUS, KIND_LEAD_FIELDS)]
+        contact_rows = [row for row in rows if row.kind == KIND_CONTACT_FIELDS]
+        unknown = [row for row in rows if row.kind not in (KIND_NOTE, KIND_STATUS, KIND_LEAD_FIELDS, KIND_CONTACT_FIELDS)]
+        for row in unknown:
+            failed[row.id] = f"Неизвестный тип записи: {row.kind}"
+
+        batches = (
+            (notes, self._note_data, "post", "/api/v4/leads/notes"),
+            (lead_rows, self._lead_updates, "patch", "/api/v4/leads"),
+            (contact_rows, self._contact_data, "patch", "/api/v4/contacts"),
+        )
+        for batch, build, method, endpoint in batches:
+            if batch:
+                await self._send_batch(failed, postponed, batch, build, type=method, endpoint=endpoint)
+        if deferred is None:
+            failed.update(postponed)
+        return failed
+
+    async def _send_batch(
+        self,
+        failed: dict[int, str],
+        deferred: dict[int, str],
+        rows: list[AmoOutbox],
+        build: Callable[[list[AmoOutbox]], Awaitable[list[dict]]],
+        **request: Any,
+    ) -> None:
+        """Отправляет rows одним запросом.
+
+        amoCRM отклоняет всю пачку из-за одной неверной сущности (400 на удалённую сделку),
+        поэтому при 400 и 422 пачка делится пополам по сущностям, пока ошибку не получат
+        только записи виноватой сущности. После 429 или 401 запросы до конца отправки
+        не делаются: эта и остальные пачки откладываются целиком.
+        """
+        if deferred:
+            error_text = next(iter(deferred.values()))
+            for row in rows:
+                deferred[row.id] = error_text
+            return
+        try:
+            data = await build(rows)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.exception("Не удалось подготовить пачку %s %s", request["type"], request["endpoint"])
+            error_text = str(error) or error.__class__.__name__
+            for row in rows:
+                failed[row.id] = error_text
+            return
+        if not data:
+            return
+
+        status_code, error_text = await self._call(data=data, **request)
+        if error_text is None:
+            return
+        if status_code in DEFER_STATUSES:
+            logger.warning("Пачка %s %s отложена: %s", request["type"], request["endpoint"], error_text)
+            for row in rows:
+                deferred[row.id] = error_text
+            return
+        entity_ids = sorted({int(row.entity_id) for row in rows})
+        if status_code in SPLIT_STATUSES and len(entity_ids) > 1:
+            left = set(entity_ids[:len(entity_ids) // 2])
+            for part in (
+                [row for row in rows if int(row.entity_id) in left],
+                [row for row in rows if int(row.entity_id) not in left],
+            ):
+                await self._send_batch(failed, deferred, part, build, **request)
+            return
+        logger.warning("Пачка %s %s не отправлена: %s", request["type"], request["endpoint"], error_text)
+        for row in rows:
+            failed[row.id] = error_text
+
+    async def _call(self, **request: Any) -> tuple[int | None, str | None]:
+        """Код ответа и текст ошибки; (код, None) - запрос прошёл."""
+        try:
+            response = await self.amo_api._base_request(**request)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            return None, str(error) or error.__class__.__name__
+        if response.status_code < 400:
+            return response.status_code, None
+        return response.status_code, f"amoCRM error {response.status_code}: {response.text}"
+
+    @staticmethod
+    async def _note_data(rows: list[AmoOutbox]) -> list[dict]:
+        return [
+            {
+                "entity_id": int(row.entity_id),
+                "note_type": "common",
+                "params": {"text": json.loads(row.payload)["text"]},
+            }
+            for row in rows
+        ]
+
+    async def _contact_data(self, rows: list[AmoOutbox]) -> list[dict]:
+        return self._merge_fields(rows)
+
+    async def _lead_updates(self, rows: list[AmoOutbox]) -> list[dict]:
+        updates: dict[int, dict] = {}
+        status_rows = [row for row in rows if row.kind == KIND_STATUS]
+        current = await self._current_statuses({int(row.entity_id) for row in status_rows}) if status_rows else {}
+
+        for row in rows:
+            lead_id = int(row.entity_id)
+            payload = json.loads(row.payload)
+            update = updates.setdefault(lead_id, {"id": lead_id})
+            if row.kind == KIND_LEAD_FIELDS:
+                _merge_custom_fields(update, payload["custom_fields_values"])
+                continue
+
+            lesson_key = payload.get("lesson_key")
+            if lesson_key and lead_id in current:
+                if not await check_push_to_new_status(lesson_key=lesson_key, lead_status=current[lead_id]):
+                    continue
+            update["name"] = LEAD_NAME
+            update["updated_by"] = 0
+            update["pipeline_id"] = payload["pipeline_id"]
+            update["status_id"] = payload["status_id"]
+            # Следующие записи этой же пачки сравниваются уже с новым статусом
+            current[lead_id] = payload["status_id"]
+
+        return [update for update in updates.values() if len(update) > 1]
+
+    async def _current_statuses(self, lead_ids: set[int]) -> dict[int, int]:
+        query = "&".join(f"filter[id][]={lead_id}" for lead_id in sorted(lead_ids))
+        response = await self.amo_api._base_request(
+            type="get_param",
+            endpoint="/api/v4/leads",
+            parameters=f"{query}&limit={BATCH_SIZE}",
+        )
+        if response.status_code == 204:
+            return {}
+        if response.status_code >= 400:
+            raise AmoApiError(f"amoCRM error {response.status_code}: {response.text}")
+        leads = response.json().get("_embedded", {}).get("leads", []) or []
+        return {int(lead["id"]): int(lead["status_id"]) for lead in leads if lead.get("status_id") is not None}
+
+    @staticmethod
+    def _merge_fields(rows: list[AmoOutbox]) -> list[dict]:
+        updates: dict[int, dict] = {}
+        for row in rows:
+            entity_id = int(row.entity_id)
+            update = updates.setdefault(entity_id, {"id": entity_id})
+            _merge_custom_fields(update, json.loads(row.payload)["custom_fields_values"])
+        return list(updates.values())
+
+
+def _merge_custom_fields(update: dict, custom_fields_values: list[dict]) -> None:
+    # Более поздняя запись того же поля заменяет раннюю
+    fields = {field["field_id"]: field for field in update.get("custom_fields_values", [])}
+    for field in custom_fields_values:
+        fields[field["field_id"]] = field
+    update["custom_fields_values"] = list(fields.values())
@@ -44,6 +44,20 @@ amo_fields = {
 @dataclass
 class TgBot:
     token: str  #Токен для доступа к боту
+    fsm_storage: str = "db"  # Где хранить состояния диалогов: db (PostgreSQL) или memory
+    fsm_ttl_days: int = 30  # Через сколько дней неактивности состояние пользователя удаляется
+    updates_mode: str = "polling"  # Получение апдейтов: polling или webhook
+    webhook_base_url: str = ""  # Адрес бота, доступный Bot API серверу
+    webhook_path: str = "/tg_education/telegram/webhook"
+    webhook_host: str = "127.0.0.1"  # Где слушает вебхук, если админка запущена отдельным процессом
+    webhook_port: int = 8106
+    webhook_secret: str = ""  # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+    webhook_workers: int = 8  # Сколько чатов обрабатывается параллельно
+    webhook_queue_size: int = 1000  # Общий лимит апдейтов, ожидающих обработки
+
+    @property
+    def webhook_enabled(self) -> bool:
+        return self.updates_mode == "webhook" and bool(self.webhook_secret)
 
 
 # Класс с объектом TGBot
@@ -62,6 +76,11 @@ class AdminWebConfig:
     prefix: str = "/tg_education/admin"
     max_bot_api_url: str = "http://127.0.0.1:8107"
     max_bot_api_secret: str = ""
+    broadcast_concurrency: int = 16
+    broadcast_telegram_rate: float = 25
+    broadcast_max_rate: float = 20
+    # Сколько секунд готовый отчёт отдаётся повторно, пока данные не изменились
+    report_cache_ttl: float = 300
 
     @property
     def enabled(self) -> bool:
@@ -82,6 +101,11 @@ class AmoConfig:
     amocrm_refresh_token: str | None
     amocrm_secret_code: str
     path_to_env: str
+    request_timeout: float = 15
+    write_flush_interval: float = 3
+    rate_limit: float = 6
+    max_retries: int = 4
+    lead_index_refresh_interval: float = 300
 
 @dataclass
 class Config:
@@ -104,7 +128,20 @@ def load_config(path: str | None = BASE_DIR / '.env'):
 
     return Config(
         tg_bot=TgBot(
-            token=env("BOT_TOKEN")
+            token=env("BOT_TOKEN"),
+            fsm_storage=env("FSM_STORAGE", default="db").lower(),
+            fsm_ttl_days=env.int("FSM_TTL_DAYS", default=30),
+            updates_mode=env("TG_UPDATES_MODE", default="polling").lower(),
+            webhook_base_url=env(
+                "TG_WEBHOOK_BASE_URL",
+                default=f'http://{env("WEB_ADMIN_HOST", default="127.0.0.1")}:{env.int("WEB_ADMIN_PORT", default=8106)}',
+            ).rstrip("/"),
+            webhook_path=env("TG_WEBHOOK_PATH", default="/tg_education/telegram/webhook"),
+            webhook_host=env("TG_WEBHOOK_HOST", default=env("WEB_ADMIN_HOST", default="127.0.0.1")),
+            webhook_port=env.int("TG_WEBHOOK_PORT", default=env.int("WEB_ADMIN_PORT", default=8106)),
+            webhook_secret=env("TG_WEBHOOK_SECRET", default=""),
+            webhook_workers=env.int("TG_WEBHOOK_WORKERS", default=8),
+            webhook_queue_size=env.int("TG_WEBHOOK_QUEUE_SIZE", default=1000),
         ),
         db=Database(
             url=env("DATABASE_URL")
@@ -118,6 +155,10 @@ def load_config(path: str | None = BASE_DIR / '.env'):
             prefix=env("WEB_ADMIN_PREFIX", default="/tg_education/admin").rstrip("/"),
             max_bot_api_url=env("MAX_BOT_API_URL", default="http://127.0.0.1:8107"),
             max_bot_api_secret=env("MAX_BOT_API_SECRET", default=""),
+            broadcast_concurrency=env.int("BROADCAST_CONCURRENCY", default=16),
+            broadcast_telegram_rate=env.float("BROADCAST_TELEGRAM_RATE", default=25),
+            broadcast_max_rate=env.float("BROADCAST_MAX_RATE", default=20),
+            report_cache_ttl=env.float("REPORT_CACHE_TTL", default=300),
         ),
         amo_config=AmoConfig(
             path_to_env=path,
@@ -127,7 +168,12 @@ def load_config(path: str | None = BASE_DIR / '.env'):
             amocrm_redirect_url=env("AMOCRM_REDIRECT_URL"),
             amocrm_access_token=env("AMOCRM_ACCESS_TOKEN"),
             amocrm_refresh_token=env("AMOCRM_REFRESH_TOKEN"),
-            amocrm_secret_code=env("AMOCRM_SECRET")
+            amocrm_secret_code=env("AMOCRM_SECRET"),
+            request_timeout=env.float("AMOCRM_REQUEST_TIMEOUT", default=15),
+            write_flush_interval=env.float("AMOCRM_WRITE_FLUSH_INTERVAL", default=3),
+            rate_limit=env.float("AMOCRM_RATE_LIMIT", default=6),
+            max_retries=env.int("AMOCRM_MAX_RETRIES", default=4),
+            lead_index_refresh_interval=env.float("AMOCRM_LEAD_INDEX_REFRESH_INTERVAL", default=300),
         ),
         amo_fields=amo_fields,
         admin=env("ADMIN_ID"),
@@ -1,22 +1,30 @@
 from db.base import Base
 from db.models import (
+    AmoOutbox,
     Broadcast,
     BroadcastButton,
     BroadcastDelivery,
     BroadcastRecipient,
+    FsmStorageRecord,
     HpLessonResult,
+    MediaFile,
     User,
+    UserProgress,
 )
 from db.session import async_session_factory, get_session, init_db, shutdown_db
 
 __all__ = [
+    "AmoOutbox",
     "Base",
     "Broadcast",
     "BroadcastButton",
     "BroadcastDelivery",
     "BroadcastRecipient",
+    "FsmStorageRecord",
     "HpLessonResult",
+    "MediaFile",
     "User",
+    "UserProgress",
     "async_session_factory",
     "get_session",
     "init_db",
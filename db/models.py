@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from sqlalchemy import BigInteger, DateTime, ForeignKey, Integer, String, Boolean, Text, Index
+from sqlalchemy import BigInteger, DateTime, Float, ForeignKey, Integer, String, Boolean, Text, Index, event, or_, text, update
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from db.base import Base
@@ -31,6 +31,16 @@ class User(Base):
     start_edu: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     notification_stage: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)
+    # Последнее начало или завершение урока; обновляется событиями HpLessonResult ниже
+    last_activity_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, default=datetime.utcnow)
+    # Когда планировщику напоминаний пересмотреть пользователя; None - напоминаний больше не будет
+    next_notification_at: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, index=True, default=datetime.utcnow
+    )
+    # Водяной знак кэша отчётов: onupdate срабатывает и для ORM, и для Core UPDATE
+    updated_at: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, index=True, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
 
     lesson_results: Mapped[list["HpLessonResult"]] = relationship(
         back_populates="user",
@@ -40,19 +50,64 @@ class User(Base):
 
 class HpLessonResult(Base):
     __tablename__ = "lesson_results"
+    __table_args__ = (
+        # Ведущий user_id заменяет отдельный индекс по user_id
+        Index("ix_lesson_results_user_key_compleat", "user_id", "lesson_key", "compleat"),
+        # EXISTS «экзамен сдан» в выборке напоминаний
+        Index(
+            "ix_lesson_results_exam_passed",
+            "user_id",
+            postgresql_where=text("lesson_key = 'exam' AND compleat IS TRUE"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     lesson_key: Mapped[str] = mapped_column(String(64))
     result: Mapped[str | None] = mapped_column(String(128), nullable=True)
     score: Mapped[int | None] = mapped_column(Integer, nullable=True)
     compleat: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     started_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow)
     completed_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, index=True, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
 
     user: Mapped[User] = relationship(back_populates="lesson_results")
 
 
+class UserProgress(Base):
+    """Сводка прогресса: бит на каждый пройденный урок, ведётся service.progress."""
+
+    __tablename__ = "user_progress"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    completed_mask: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+@event.listens_for(HpLessonResult, "after_insert")
+@event.listens_for(HpLessonResult, "after_update")
+def _touch_user_activity(mapper, connection, target: HpLessonResult) -> None:
+    """Держит users.last_activity_at актуальным при любом старте и завершении урока.
+
+    Заодно ставит пользователя в очередь планировщика: тот пересчитает стадию и срок
+    следующего напоминания.
+    """
+    activity_at = target.completed_at or target.started_at
+    if activity_at is None:
+        return
+    users = User.__table__
+    connection.execute(
+        update(users)
+        .where(
+            users.c.id == target.user_id,
+            or_(users.c.last_activity_at.is_(None), users.c.last_activity_at < activity_at),
+        )
+        .values(last_activity_at=activity_at, next_notification_at=activity_at)
+    )
+
+
 class Broadcast(Base):
     __tablename__ = "broadcasts"
 
@@ -64,6 +119,7 @@ class Broadcast(Base):
     media_original_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     max_media_token: Mapped[str | None] = mapped_column(String(1024), nullable=True)
     max_media_type: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    telegram_file_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
     status: Mapped[str] = mapped_column(String(32), index=True)
     scheduled_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
@@ -142,3 +198,42 @@ class BroadcastDelivery(Base):
 
     broadcast: Mapped[Broadcast] = relationship(back_populates="deliveries")
     recipient: Mapped[BroadcastRecipient] = relationship(back_populates="deliveries")
+
+
+class AmoOutbox(Base):
+    __tablename__ = "amo_outbox"
+    __table_args__ = (
+        Index("ix_amo_outbox_status_id", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    entity_id: Mapped[int] = mapped_column(BigInteger)
+    payload: Mapped[str] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    processed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    # Аренда записи в статусе sending или отсрочка pending после 429/401: до этого времени запись не забирается
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class FsmStorageRecord(Base):
+    __tablename__ = "fsm_storage"
+
+    key: Mapped[str] = mapped_column(String(512), primary_key=True)
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+class MediaFile(Base):
+    __tablename__ = "media_files"
+
+    source: Mapped[str] = mapped_column(String(1024), primary_key=True)
+    content_type: Mapped[str] = mapped_column(String(32), primary_key=True)
+    mtime: Mapped[float | None] = mapped_column(Float, nullable=True)
+    file_id: Mapped[str] = mapped_column(String(255))
+    file_unique_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
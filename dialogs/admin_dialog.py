@@ -1,8 +1,7 @@
-import datetime
 import operator
-import os
-import tempfile
+from datetime import datetime
 
+from aiogram import Bot
 from aiogram.types import CallbackQuery, Message, FSInputFile
 from aiogram_dialog.widgets.kbd import Button, Column, Multiselect, Group, Start, Back, Row, Cancel, Next, \
     ManagedMultiselect, Radio, ManagedRadio
@@ -15,12 +14,13 @@ from aiogram_dialog.widgets.media import StaticMedia
 from config.config import BASE_DIR
 from service.questions_lexicon import questions_1 as questions
 from service.service import pad_right, format_results, format_progress, checking_result
-from db.models import User, HpLessonResult as LessonResult
+from service.report_jobs import STATUS_EMPTY, STATUS_FAILED, ReportJob, ReportJobManager
+from service.reports import EMPLOYMENT_TYPE, USERS_RESULTS, Report
+from service.users import get_user
+from db.models import User
 from amo_api.amo_api import AmoCRMWrapper
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
-from openpyxl import Workbook
+from sqlalchemy import update
 
 
 async def admin_getter(dialog_manager: DialogManager, **kwargs):
@@ -43,8 +43,7 @@ async def add_admin_input(message: Message, _, dialog_manager: DialogManager):
         await message.answer("Нужен числовой tg_id. Попробуйте ещё раз.")
         return
 
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await get_user(session, tg_user_id=tg_id)
     if user is None:
         await message.answer(f"Пользователь с tg_id={tg_id} не найден.")
         return
@@ -78,8 +77,7 @@ async def delete_user_input(message: Message, _, dialog_manager: DialogManager):
         await message.answer("Нужен числовой tg_id. Попробуйте ещё раз.")
         return
 
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await get_user(session, tg_user_id=tg_id)
     if user is None:
         await message.answer(f"Пользователь с tg_id={tg_id} не найден.")
         return
@@ -93,219 +91,43 @@ async def delete_user_input(message: Message, _, dialog_manager: DialogManager):
 
 async def delete_notification(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     session: AsyncSession = dialog_manager.middleware_data["session"]
-    result = await session.execute(select(User))
-    users = result.scalars().all()
-
-    for user in users:
-        user.notification_stage = None
-
-    await session.commit()
-
-    await callback.message.answer(f"Обработано записей: {len(users)}")
-
-
-async def get_converse(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
-    session: AsyncSession = dialog_manager.middleware_data["session"]
-
+    # Планировщик берёт только подошедший next_notification_at: без него сброс стадии не включит напоминания
     result = await session.execute(
-        select(User)
-        .options(selectinload(User.lesson_results))
-        .order_by(User.id)
+        update(User).values(notification_stage=None, next_notification_at=datetime.utcnow())
     )
-    users = result.scalars().all()
-
-    if not users:
-        await callback.message.answer("Пользователи в БД не найдены.")
-        return
+    await session.commit()
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "users_results"
-
-    headers = [
-        "user_id",
-        "tg_id",
-        "max_user_id",
-        "notification_stage",
-        "username",
-        "first_name",
-        "last_name",
-        "phone_number",
-        "amo_contact_id",
-        "amo_deal_id",
-        "lesson_id",
-        "lesson_key",
-        "score",
-        "compleat",
-        "started_at",
-        "completed_at",
-    ]
-    ws.append(headers)
-
-    def fmt_dt(value: datetime.datetime | None) -> str:
-        if value is None:
-            return ""
-        return value.strftime("%Y-%m-%d %H:%M:%S")
-
-    def nullable(value):
-        return value if value is not None else ""
-
-    for user in users:
-        lessons = sorted(
-            [lesson for lesson in (user.lesson_results or []) if lesson.completed_at is not None],
-            key=lambda l: l.id or 0,
-        )
-        if not lessons:
-            ws.append(
-                [
-                    user.id,
-                    nullable(user.tg_user_id),
-                    nullable(user.max_user_id),
-                    nullable(user.notification_stage),
-                    user.username or "",
-                    user.first_name or "",
-                    user.last_name or "",
-                    user.phone_number or "",
-                    nullable(user.amo_contact_id),
-                    nullable(user.amo_deal_id),
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                    "",
-                ]
-            )
-            continue
-
-        for lesson in lessons:
-            ws.append(
-                [
-                    user.id,
-                    nullable(user.tg_user_id),
-                    nullable(user.max_user_id),
-                    nullable(user.notification_stage),
-                    user.username or "",
-                    user.first_name or "",
-                    user.last_name or "",
-                    user.phone_number or "",
-                    nullable(user.amo_contact_id),
-                    nullable(user.amo_deal_id),
-                    lesson.id,
-                    lesson.lesson_key,
-                    lesson.score if lesson.score is not None else "",
-                    lesson.compleat,
-                    fmt_dt(lesson.started_at),
-                    fmt_dt(lesson.completed_at),
-                ]
+    await callback.message.answer(f"Обработано записей: {result.rowcount}")
+
+
+async def send_report(callback: CallbackQuery, dialog_manager: DialogManager, report: Report):
+    report_jobs: ReportJobManager = dialog_manager.middleware_data["report_jobs"]
+    bot: Bot = dialog_manager.middleware_data["bot"]
+    chat_id = callback.message.chat.id
+
+    # Файл приходит отдельным сообщением, когда выгрузка готова; колбэк не ждёт её
+    async def deliver(job: ReportJob) -> None:
+        if job.status == STATUS_EMPTY:
+            await bot.send_message(chat_id, report.empty_text)
+        elif job.status == STATUS_FAILED:
+            await bot.send_message(chat_id, "Не удалось сформировать отчёт, попробуйте позже.")
+        else:
+            await bot.send_document(
+                chat_id,
+                document=FSInputFile(job.path, filename=report.filename()),
+                caption=report.caption,
             )
 
-    filename = f"users_results_{datetime.datetime.utcnow():%Y%m%d_%H%M%S}.xlsx"
-    tmp_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp_path = tmp.name
-        wb.save(tmp_path)
-
-        await callback.message.answer_document(
-            document=FSInputFile(tmp_path, filename=filename),
-            caption="Таблица пользователей и результатов",
-        )
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+    report_jobs.submit(report, subscriber=deliver)
+    await callback.answer("Отчёт формируется, файл придёт следующим сообщением.")
 
 
-async def get_employment_type(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
-    session: AsyncSession = dialog_manager.middleware_data["session"]
-
-    completed_lessons = (
-        select(
-            LessonResult.user_id,
-            func.count(LessonResult.id).label("completed_lessons_count"),
-        )
-        .where(LessonResult.compleat.is_(True))
-        .group_by(LessonResult.user_id)
-        .subquery()
-    )
-
-    result = await session.execute(
-        select(
-            User,
-            func.coalesce(completed_lessons.c.completed_lessons_count, 0),
-        )
-        .outerjoin(completed_lessons, completed_lessons.c.user_id == User.id)
-        .where(
-            User.client_type.is_not(None),
-            User.client_type != "",
-        )
-        .order_by(User.id)
-    )
-    users = result.all()
-
-    if not users:
-        await callback.message.answer("Пользователи с заполненным типом занятости не найдены.")
-        return
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "employment_type"
-
-    ws.append(
-        [
-            "ID в ТГ",
-            "ID в MAX",
-            "Кто вы?",
-            "Дата создания",
-            "Ссылка на контакт",
-            "Ссылка на сделку",
-            "Пройдено уроков",
-        ]
-    )
-
-    def fmt_dt(value: datetime.datetime | None) -> str:
-        if value is None:
-            return ""
-        return value.strftime("%Y-%m-%d %H:%M:%S")
-
-    def nullable(value):
-        return value if value is not None else ""
-
-    for user, completed_lessons_count in users:
-        contact_link = ""
-        if user.amo_contact_id is not None:
-            contact_link = f"https://hite.amocrm.ru/contacts/detail/{user.amo_contact_id}"
-
-        deal_link = ""
-        if user.amo_deal_id is not None:
-            deal_link = f"https://hite.amocrm.ru/leads/detail/{user.amo_deal_id}"
-
-        ws.append(
-            [
-                nullable(user.tg_user_id),
-                nullable(user.max_user_id),
-                user.client_type or "",
-                fmt_dt(user.created_at),
-                contact_link,
-                deal_link,
-                completed_lessons_count,
-            ]
-        )
+async def get_converse(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    await send_report(callback, dialog_manager, USERS_RESULTS)
 
-    filename = f"employment_type_{datetime.datetime.utcnow():%Y%m%d_%H%M%S}.xlsx"
-    tmp_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp_path = tmp.name
-        wb.save(tmp_path)
 
-        await callback.message.answer_document(
-            document=FSInputFile(tmp_path, filename=filename),
-            caption="Тип занятости",
-        )
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            os.remove(tmp_path)
+async def get_employment_type(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    await send_report(callback, dialog_manager, EMPLOYMENT_TYPE)
 
 
 admin_menu = Window(
@@ -17,12 +17,11 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from amo_api.amo_api import AmoCRMWrapper
+from amo_api.write_queue import AmoWriteQueue
 from config.config import BASE_DIR
 from db import HpLessonResult as LessonResult
 from fsm_forms.fsm_models import HpExamLessonDialog
 from service.questions_lexicon import exam_lesson, edu_compleat_text, urls_to_messanger
-from service.service import check_push_to_new_status
 
 logger = logging.getLogger(__name__)
 
@@ -145,7 +144,7 @@ async def on_webapp_data(message: Message, _, dialog_manager: DialogManager):
 
 
 async def result_getter(dialog_manager: DialogManager, **kwargs):
-    amo_api: AmoCRMWrapper = dialog_manager.middleware_data["amo_api"]
+    amo_queue: AmoWriteQueue = dialog_manager.middleware_data["amo_queue"]
     session: AsyncSession = dialog_manager.middleware_data["session"]
     status_fields: dict = dialog_manager.middleware_data["amo_fields"].get("statuses")
     pipelines: dict = dialog_manager.middleware_data["amo_fields"].get("pipelines")
@@ -183,21 +182,18 @@ async def result_getter(dialog_manager: DialogManager, **kwargs):
             await session.refresh(user)
 
             if user is not None and user.amo_deal_id is not None:
-                amo_api.add_new_note_to_lead(
+                # Примечание и перевод сделки уходят в amoCRM через очередь: пользователь не ждёт ответа CRM
+                await amo_queue.enqueue_note(
                     lead_id=user.amo_deal_id,
                     text=amo_note_text or result_text,
                 )
-                user_lead_id = user.amo_deal_id
-                status_id_in_amo = amo_api.get_lead_by_id(lead_id=user_lead_id).get('status_id')
-                push_to_new_status = await check_push_to_new_status(lesson_key='compleat_exam',
-                                                              lead_status=status_id_in_amo)
                 if passed:
-                    if push_to_new_status:
-                        amo_api.push_lead_to_status(
-                            pipeline_id=pipelines.get("hite_pro_education"),
-                            status_id=status_fields.get("compleat_exam"),
-                            lead_id=str(user.amo_deal_id),
-                        )
+                    await amo_queue.enqueue_status(
+                        lead_id=user.amo_deal_id,
+                        pipeline_id=pipelines.get("hite_pro_education"),
+                        status_id=status_fields.get("compleat_exam"),
+                        lesson_key="compleat_exam",
+                    )
                     result_text = '<b>Экзамен пройден!</b>\n\n' + result_text
                     await dialog_manager.event.bot.send_message(text=result_text, chat_id=tg_id)
 
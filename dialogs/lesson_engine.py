@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import operator
+from dataclasses import dataclass
+
+from aiogram.enums import ContentType
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery
+from aiogram_dialog import Dialog, DialogManager, ShowMode, Window
+from aiogram_dialog.widgets.kbd import Back, Button, Cancel, Column, Group, ManagedMultiselect, ManagedRadio, \
+    Multiselect, Next, Radio, Row, SwitchTo
+from aiogram_dialog.widgets.media import StaticMedia
+from aiogram_dialog.widgets.text import Const, Format
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from amo_api.write_queue import AmoWriteQueue
+from config.config import BASE_DIR
+from db import HpLessonResult as LessonResult
+from service.quiz import Question, Quiz, quizzes
+from service.service import checking_result, count_missed_answers, format_progress, format_results
+
+logger = logging.getLogger(__name__)
+
+QUESTION_TEXT = "<b>Вопрос #{quest_number} из {count_quest}:\n\n{title}</b>\n"
+
+
+@dataclass(frozen=True, slots=True)
+class LessonSpec:
+    """Описание урока для движка: всё, чем уроки отличаются друг от друга.
+
+    Вопросы и ответы берутся из service.quiz по key, окна строятся в build_lesson_dialog.
+    """
+
+    key: str
+    number: int
+    # «первого», «второго»... - для текстов окон и логов
+    ordinal: str
+    states: type[StatesGroup]
+    video_state: State
+    result_state: State
+    video: str
+    video_url: str
+    video_size: tuple[int, int] = (1920, 1080)
+    # Вопросы с длинными вариантами: варианты в тексте, на кнопках «Вариант N»
+    numbered: frozenset[int] = frozenset()
+    back_text: str = 'В главное меню'
+
+    @property
+    def quiz(self) -> Quiz:
+        return quizzes[self.key]
+
+
+def _question(dialog_manager: DialogManager, quiz: Quiz) -> Question:
+    return quiz.question(dialog_manager.current_context().state.state)
+
+
+def _video_window(spec: LessonSpec) -> Window:
+    width, height = spec.video_size
+    return Window(
+        Const(text=f"<b>Запись {spec.ordinal} урока HiTE PRO!</b>\n"
+                   f"Не грузится видео? Посмотри по ссылке: <a href='{spec.video_url}'>Урок {spec.number}</a>"),
+        StaticMedia(
+            path=BASE_DIR / "media" / "video" / spec.video,
+            type=ContentType.VIDEO,
+            media_params={"supports_streaming": True,
+                          "width": width,
+                          "height": height,
+                          },
+        ),
+        Group(
+            Row(
+                Cancel(Const('Назад'), id='go_cancel_dialog'),
+                Next(Const('Вперед'), id='go_next_dialog', show_mode=ShowMode.SEND),
+            )),
+        state=spec.video_state,
+    )
+
+
+# Условие для отображения базовых кнопок Вперед и назад
+def show_when_not_confirmed(data, widget, manager) -> bool:
+    return not data.get("confirm_stage", False)
+
+
+class LessonEngine:
+    """Окна, геттеры и обработчики одного урока, собранные по LessonSpec."""
+
+    def __init__(self, spec: LessonSpec):
+        self.spec = spec
+        self.quiz = spec.quiz
+        self.states = {state.state: state for state in spec.states.__all_states__}
+
+    # Геттер для вопросов: данные окна собраны заранее в service.quiz
+    async def question_getter(self, dialog_manager: DialogManager, **kwargs):
+        question = _question(dialog_manager, self.quiz)
+        return question.render[dialog_manager.dialog_data.get('confirm_stage', False)]
+
+    # Хендлер для multiselect ответов
+    async def on_multiselect_changed(
+        self,
+        event: CallbackQuery,
+        widget: ManagedMultiselect,
+        dialog_manager: DialogManager,
+        item_id: str,
+    ):
+        question = _question(dialog_manager, self.quiz)
+        dialog_manager.dialog_data.setdefault("answers", {})
+        dialog_manager.dialog_data["answers"][question.key] = question.selected_mask(widget.get_checked())
+
+    # Хендлер для radio вопросов
+    async def on_radio_changed(
+        self,
+        event: CallbackQuery,
+        widget: ManagedRadio,
+        dialog_manager: DialogManager,
+        item_id: str,
+    ):
+        question = _question(dialog_manager, self.quiz)
+        checked_id = widget.get_checked()
+        dialog_manager.dialog_data.setdefault("answers", {})
+        dialog_manager.dialog_data["answers"][question.key] = question.selected_mask(
+            () if checked_id is None else (checked_id,)
+        )
+
+    async def on_send_result(self, callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
+        answers = dialog_manager.dialog_data.get('answers', {})
+        if await count_missed_answers(answers=answers, quiz=self.quiz) > 0:
+            await callback.answer('❗️Ответьте на все вопросы❗️', show_alert=True)
+        else:
+            await dialog_manager.switch_to(self.spec.result_state)
+
+    async def confirm_getter(self, dialog_manager: DialogManager, **kwargs):
+        answers = dialog_manager.dialog_data.get('answers', {})
+        message = format_progress(answers, quiz=self.quiz)
+        dialog_manager.dialog_data['confirm_stage'] = True
+        return {'message': message,
+                'dont_first_question': True,
+                'dont_last_question': False,
+                'confirm_stage': True,
+                }
+
+    async def result_getter(self, dialog_manager: DialogManager, **kwargs):
+        amo_queue: AmoWriteQueue = dialog_manager.middleware_data['amo_queue']
+        session: AsyncSession = dialog_manager.middleware_data['session']
+        status_fields: dict = dialog_manager.middleware_data['amo_fields'].get('statuses')
+        pipelines: dict = dialog_manager.middleware_data['amo_fields'].get('pipelines')
+        tg_id = dialog_manager.event.from_user.id
+        lesson_id = dialog_manager.start_data.get('lesson_id')
+        answers = dialog_manager.dialog_data.get('answers', {})
+
+        checking = checking_result(answers=answers, quiz=self.quiz)
+        score = checking.get('score')
+        compleat = checking.get('passed')
+        result = format_results(answers, quiz=self.quiz)
+
+        logger.info(f'Запущена проверка результатов {self.spec.ordinal} урока hite pro. '
+                    f'Пользователь tg_id {tg_id}. Результат проверки: баллов - {score}')
+
+        if lesson_id is None:
+            return {'result': result}
+        lesson = await session.scalar(
+            select(LessonResult)
+            .options(selectinload(LessonResult.user))
+            .where(LessonResult.id == lesson_id)
+        )
+        if lesson is None:
+            logger.warning(f'Не найдена запись урока {lesson_id} пользователя tg_id {tg_id}')
+            return {'result': result}
+        lesson.score = score
+        lesson.compleat = compleat
+        lesson.completed_at = datetime.datetime.utcnow()
+        await session.commit()
+        user = lesson.user
+
+        # Примечание и перевод сделки уходят в amoCRM через очередь: пользователь не ждёт ответа CRM
+        if user.amo_deal_id is not None:
+            await amo_queue.enqueue_note(lead_id=user.amo_deal_id,
+                                         text=f'Результаты урока №{self.spec.number}: {result}')
+
+            # Перемещаем сделку далее по воронке обучения, если успешно (только вперёд по этапам)
+            if compleat:
+                status_key = f'compleat_lesson_{self.spec.number}'
+                await amo_queue.enqueue_status(lead_id=user.amo_deal_id,
+                                               pipeline_id=pipelines.get('hite_pro_education'),
+                                               status_id=status_fields.get(status_key),
+                                               lesson_key=status_key)
+        return {'result': result}
+
+    def build(self) -> Dialog:
+        first_state = self.states[self.quiz.questions[0].state]
+        # Группа кнопок, отображаемых при достижении этапа "Подтверждение результатов"
+        confirm_stage_row_buttons = Row(
+            SwitchTo(Const('⏪'), id='to_first', when='dont_first_question', state=first_state),
+            Back(Const('⬅️'), id='back', when='dont_first_question'),
+            Next(Const('➡️'), id='next', when='dont_last_question'),
+            SwitchTo(Const('⏩'), id='to_last', when='dont_last_question', state=self.spec.states.confirm_answers),
+            when='confirm_stage',
+        )
+        base_row_buttons = Row(
+            Back(Const('Назад'), id='go_back_dialog'),
+            Next(Const('Вперед'), id='go_next_dialog'),
+            when=show_when_not_confirmed,
+        )
+        result_row_button = Row(
+            Button(Const('Отправить результат на проверку'), id='ti_result',
+                   on_click=self.on_send_result,
+                   when='confirm_stage'),
+        )
+        navigation = (base_row_buttons, confirm_stage_row_buttons, result_row_button)
+
+        windows = [_video_window(self.spec)]
+        windows.extend(self._question_window(question, navigation) for question in self.quiz.questions)
+        windows.append(Window(
+            Format(text='{message}'),
+            Group(confirm_stage_row_buttons, result_row_button),
+            state=self.spec.states.confirm_answers,
+            getter=self.confirm_getter,
+        ))
+        windows.append(Window(
+            Const(text=f'Ваши результаты прохождения {self.spec.ordinal} урока:'),
+            Format(text="{result}"),
+            Column(
+                Cancel(Const(self.spec.back_text), id='cancel', show_mode=ShowMode.SEND),
+            ),
+            state=self.spec.result_state,
+            getter=self.result_getter,
+        ))
+        return Dialog(*windows)
+
+    def _question_window(self, question: Question, navigation: tuple[Row, ...]) -> Window:
+        state = self.states[question.state]
+        text = QUESTION_TEXT + ('{multi}' if question.multi else '{radio}')
+        item_text = '{item[0]}'
+        if question.number in self.spec.numbered:
+            text += '\n\n{text_answers}'
+            item_text = 'Вариант {item[1]}'
+        # id виджета прежний: отмеченные варианты в начатых диалогах сохраняются
+        widget_id = f'{state.state.split(":")[1]}_answers_checked'
+        if question.multi:
+            selector = Multiselect(
+                checked_text=Format('✅ ' + item_text),
+                unchecked_text=Format('️◻️ ' + item_text),
+                id=widget_id,
+                item_id_getter=operator.itemgetter(1),
+                items="question_answers",
+                on_state_changed=self.on_multiselect_changed,
+            )
+        else:
+            selector = Radio(
+                checked_text=Format('🟢 ' + item_text),
+                unchecked_text=Format('⚪ ' + item_text),
+                id=widget_id,
+                item_id_getter=operator.itemgetter(1),
+                items="question_answers",
+                on_state_changed=self.on_radio_changed,
+            )
+        return Window(
+            Format(text=text),
+            Group(Column(selector), *navigation),
+            state=state,
+            getter=self.question_getter,
+        )
+
+
+def build_lesson_dialog(spec: LessonSpec) -> Dialog:
+    return LessonEngine(spec).build()
@@ -0,0 +1,85 @@
+from dialogs.lesson_engine import LessonSpec, build_lesson_dialog
+from fsm_forms.fsm_models import (
+    HpFifthLessonDialog,
+    HpFirstLessonDialog,
+    HpFourthLessonDialog,
+    HpSecondLessonDialog,
+    HpSeventhLessonDialog,
+    HpSixthLessonDialog,
+    HpThirdLessonDialog,
+)
+
+# Уроки HiTE PRO. Новый урок: StatesGroup в fsm_forms, вопросы в questions_lexicon, запись здесь
+LESSONS: tuple[LessonSpec, ...] = (
+    LessonSpec(
+        key='lesson_1', number=1, ordinal='первого',
+        states=HpFirstLessonDialog,
+        video_state=HpFirstLessonDialog.vebinar,
+        result_state=HpFirstLessonDialog.result_first_lesson,
+        video='hp_lesson_1.mp4',
+        video_url='https://peertube.hite-pro.ru/w/4sNqnxzvRFxmTArqWuXSuC',
+        numbered=frozenset({4, 6, 7, 8}),
+        back_text='К списку уроков',
+    ),
+    LessonSpec(
+        key='lesson_2', number=2, ordinal='второго',
+        states=HpSecondLessonDialog,
+        video_state=HpSecondLessonDialog.vebinar_1,
+        result_state=HpSecondLessonDialog.result_second_lesson,
+        video='hp_lesson_2.mp4',
+        video_url='https://peertube.hite-pro.ru/w/8Cfjs5SDVFffyKFbzVphTR',
+        video_size=(1280, 720),
+        numbered=frozenset({1, 3, 4, 5, 7, 8}),
+        back_text='К списку уроков',
+    ),
+    LessonSpec(
+        key='lesson_3', number=3, ordinal='третьего',
+        states=HpThirdLessonDialog,
+        video_state=HpThirdLessonDialog.vebinar_1,
+        result_state=HpThirdLessonDialog.result_third_lesson,
+        video='hp_lesson_3.mp4',
+        video_url='https://peertube.hite-pro.ru/w/fsXWjJ9raAHwYvqUz4Cbf3',
+        numbered=frozenset({1, 2, 3, 4}),
+    ),
+    LessonSpec(
+        key='lesson_4', number=4, ordinal='четвертого',
+        states=HpFourthLessonDialog,
+        video_state=HpFourthLessonDialog.vebinar_1,
+        result_state=HpFourthLessonDialog.result_fourth_lesson,
+        video='hp_lesson_4.mp4',
+        video_url='https://peertube.hite-pro.ru/w/gAFxQmjGrVmEnTmuaJWgwy',
+        numbered=frozenset({4, 6, 7, 8}),
+    ),
+    LessonSpec(
+        key='lesson_5', number=5, ordinal='пятого',
+        states=HpFifthLessonDialog,
+        video_state=HpFifthLessonDialog.vebinar_1,
+        result_state=HpFifthLessonDialog.result_fifth_lesson,
+        video='hp_lesson_5.mp4',
+        video_url='https://peertube.hite-pro.ru/w/kbCco1hbyc2i5CPuJVAgKW',
+        numbered=frozenset({1, 3, 4, 5, 6, 7, 8, 9}),
+    ),
+    LessonSpec(
+        key='lesson_6', number=6, ordinal='шестого',
+        states=HpSixthLessonDialog,
+        video_state=HpSixthLessonDialog.vebinar_1,
+        result_state=HpSixthLessonDialog.result_sixth_lesson,
+        video='hp_lesson_6.mp4',
+        video_url='https://peertube.hite-pro.ru/w/ovYLGcb1FWZubWs4RUUQye',
+        numbered=frozenset({2, 3, 4, 5, 6}),
+    ),
+    LessonSpec(
+        key='lesson_7', number=7, ordinal='седьмого',
+        states=HpSeventhLessonDialog,
+        video_state=HpSeventhLessonDialog.vebinar_1,
+        result_state=HpSeventhLessonDialog.result_seventh_lesson,
+        video='hp_lesson_7.mp4',
+        video_url='https://peertube.hite-pro.ru/w/bf9K9oNbJo43AoLsqUzjkZ',
+        numbered=frozenset({3, 4, 5, 7, 8, 9, 10, 11}),
+    ),
+)
+
+# Диалоги собираются один раз при импорте, лениво их не зарегистрировать: роутеры Dialog
+# подключаются к диспетчеру до старта polling, а setup_dialogs собирает реестр состояний
+# из уже подключённых диалогов. Диалог, добавленный позже, не найдётся при manager.start
+lesson_dialogs = tuple(build_lesson_dialog(spec) for spec in LESSONS)
@@ -21,10 +21,13 @@ from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
 from db.models import User, HpLessonResult as LessonResult
 from amo_api.amo_api import AmoCRMWrapper
+from amo_api.write_queue import AmoWriteQueue
 from aiogram.utils.chat_action import ChatActionSender
 
 from service.questions_lexicon import welcome_message, exam_in_message, start_message, who_are_you
-from service.service import get_lessons_buttons, lesson_access, check_push_to_new_status
+from service.progress import merge_progress
+from service.service import get_lessons_buttons, lesson_access
+from service.users import get_user
 
 logger = logging.getLogger(__name__)
 EXAM_WEBAPP_URL = "https://profi-shop.hite-pro.ru/landing/"
@@ -49,6 +52,14 @@ def _resolve_event_user(dialog_manager: DialogManager):
     return dialog_manager.middleware_data.get("event_from_user")
 
 
+async def _get_db_user(dialog_manager: DialogManager, tg_id: int) -> User | None:
+    """Пользователь апдейта из DbUserMiddleware, без повторного запроса к БД."""
+    user = dialog_manager.middleware_data.get('db_user')
+    if user is not None and user.tg_user_id == tg_id:
+        return user
+    return await get_user(dialog_manager.middleware_data['session'], tg_user_id=tg_id)
+
+
 async def main_menu_getter(dialog_manager: DialogManager, **kwargs):
     session: AsyncSession = dialog_manager.middleware_data['session']
     admin_id = int(dialog_manager.middleware_data['admin_id'])
@@ -61,8 +72,7 @@ async def main_menu_getter(dialog_manager: DialogManager, **kwargs):
         raise ValueError("Cannot resolve user from dialog event")
     tg_id = from_user.id
     logger.info(f'Запущен бот пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     lessons_text = {}
     if user is None:
         logger.info(f'Для пользователя tg_id:{tg_id} не найдена запись в БД, создаю новую запись!')
@@ -82,6 +92,7 @@ async def main_menu_getter(dialog_manager: DialogManager, **kwargs):
         session.add(user)
         await session.commit()
         await session.refresh(user)
+        dialog_manager.middleware_data['db_user'] = user
         logger.info(f'Создана новая запись в таблице USERS: tg_id: {user.tg_user_id}, '
                     f' username: {user.username}, '
                     f' first_name: {user.first_name}')
@@ -138,8 +149,7 @@ async def select_client_type(
 ):
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = callback.from_user.id
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при выборе client_type, tg_id: {tg_id}')
 
@@ -180,6 +190,7 @@ async def _merge_user_by_amo_contact_id(
         .where(LessonResult.user_id == duplicate_user.id)
         .values(user_id=current_user.id)
     )
+    await merge_progress(session, current_user.id, duplicate_user.id)
 
     pending_max_user_id = None
 
@@ -225,6 +236,13 @@ async def _merge_user_by_amo_contact_id(
     if duplicate_user.created_at < current_user.created_at:
         current_user.created_at = duplicate_user.created_at
 
+    if duplicate_user.last_activity_at and (
+        current_user.last_activity_at is None or duplicate_user.last_activity_at > current_user.last_activity_at
+    ):
+        current_user.last_activity_at = duplicate_user.last_activity_at
+    # Стадия и активность могли измениться: планировщик пересмотрит пользователя на ближайшем проходе
+    current_user.next_notification_at = datetime.datetime.utcnow()
+
     await session.delete(duplicate_user)
     await session.flush()
 
@@ -246,8 +264,7 @@ async def back_to_main_menu(callback: CallbackQuery, button: Button, dialog_mana
 async def first_lesson_start(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 1, tg_id: {tg_id}')
     if user.start_edu is None:
@@ -273,8 +290,7 @@ async def second_lesson_start(callback: CallbackQuery, button: Button, dialog_ma
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен второй урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 2, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_2')
@@ -302,8 +318,7 @@ async def third_lesson_start(callback: CallbackQuery, button: Button, dialog_man
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен третий урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 3, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_3')
@@ -331,8 +346,7 @@ async def fourth_lesson_start(callback: CallbackQuery, button: Button, dialog_ma
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен четвертый урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 4, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_4')
@@ -360,8 +374,7 @@ async def fifth_lesson_start(callback: CallbackQuery, button: Button, dialog_man
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен пятый урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 5, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_5')
@@ -389,8 +402,7 @@ async def sixth_lesson_start(callback: CallbackQuery, button: Button, dialog_man
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен шестой урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 6, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_6')
@@ -418,8 +430,7 @@ async def seventh_lesson_start(callback: CallbackQuery, button: Button, dialog_m
     session: AsyncSession = dialog_manager.middleware_data['session']
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен седьмой урок пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в урок 7, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='lesson_7')
@@ -445,13 +456,12 @@ async def seventh_lesson_start(callback: CallbackQuery, button: Button, dialog_m
 
 async def exam_lesson_start(callback: CallbackQuery, button: Button, dialog_manager: DialogManager):
     session: AsyncSession = dialog_manager.middleware_data['session']
-    amo_api: AmoCRMWrapper = dialog_manager.middleware_data["amo_api"]
+    amo_queue: AmoWriteQueue = dialog_manager.middleware_data["amo_queue"]
     status_fields: dict = dialog_manager.middleware_data["amo_fields"].get("statuses")
     pipelines: dict = dialog_manager.middleware_data["amo_fields"].get("pipelines")
     tg_id = dialog_manager.event.from_user.id
     logger.info(f'Запущен экзамен пользователем tg_ID:{tg_id}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     if user is None:
         raise ValueError(f'Пользователь не найден при переходе в экзамен, tg_id: {tg_id}')
     lesson_deny = await lesson_access(user=user, session=session, lesson_key='exam')
@@ -487,15 +497,13 @@ async def exam_lesson_start(callback: CallbackQuery, button: Button, dialog_mana
                 text=exam_in_message,
                 reply_markup=kb,
             )
-        status_id_in_amo = amo_api.get_lead_by_id(lead_id=user.amo_deal_id).get('status_id')
-        push_to_new_status = await check_push_to_new_status(lesson_key='ready_to_exam',
-                                                            lead_status=status_id_in_amo)
-        if push_to_new_status:
+        if user.amo_deal_id is not None:
             try:
-                amo_api.push_lead_to_status(
+                await amo_queue.enqueue_status(
+                    lead_id=user.amo_deal_id,
                     pipeline_id=pipelines.get("hite_pro_education"),
                     status_id=status_fields.get("ready_to_exam"),
-                    lead_id=str(user.amo_deal_id),
+                    lesson_key="ready_to_exam",
                 )
             except Exception as error:
                 logger.error(f'Не получилось перевести сделку в этап "Приступил к экзамену"')
@@ -588,15 +596,14 @@ async def on_contact(message: Message, _, dialog_manager):
     username = '@' + dialog_manager.event.from_user.username if dialog_manager.event.from_user.username is not None else ''
     phone_number = message.contact.phone_number
     logger.info(f'Пользователь tg_id: {tg_id} поделился номером телефона: {phone_number}')
-    result = await session.execute(select(User).where(User.tg_user_id == tg_id))
-    user = result.scalar_one_or_none()
+    user = await _get_db_user(dialog_manager, tg_id)
     user.phone_number = phone_number
-    contact_data = processing_contact(amo_api=amo_api, contact_phone_number=str(phone_number))
+    contact_data = await processing_contact(amo_api=amo_api, contact_phone_number=str(phone_number))
 
     if contact_data: # Данные контакта найдены в амосрм
         if not contact_data['tg_id']: # Если tg_id нет в контакте, то добавляем
-            amo_api.add_tg_to_contact(contact_id=contact_data["amo_contact_id"], tg_id=tg_id, tg_id_field=tg_field_id,
-                                      username_id=username_field_id, username=username)
+            await amo_api.add_tg_to_contact(contact_id=contact_data["amo_contact_id"], tg_id=tg_id, tg_id_field=tg_field_id,
+                                            username_id=username_field_id, username=username)
             logger.info('попытка записать данные tg_id')
         await _merge_user_by_amo_contact_id(
             session=session,
@@ -607,20 +614,20 @@ async def on_contact(message: Message, _, dialog_manager):
         user.last_name = contact_data["last_name"]
         user.amo_contact_id = contact_data["amo_contact_id"]
         logger.info(f'Пользователь tg_id: {tg_id} найден в амосрм: {user.first_name} {user.last_name}')
-        lead_data = processing_lead(amo_api=amo_api, contact_id=contact_data["amo_contact_id"],
-                                    pipeline_id=pipelines["hite_pro_education"], status_id=status_fields['admitted_to_training'],)
+        lead_data = await processing_lead(amo_api=amo_api, contact_id=contact_data["amo_contact_id"],
+                                          pipeline_id=pipelines["hite_pro_education"], status_id=status_fields['admitted_to_training'],)
         if lead_data: # Данные сделки найдены в амосрм
             user.amo_deal_id = lead_data["amo_deal_id"]
             logger.info(f'Для пользователя{user.first_name} {user.last_name} tg_id: {tg_id} найдена сделка в амосрм')
 
         else: # Сделка не найдена, создаём новую
             logger.info(f'Для пользователя{user.first_name} {user.last_name} tg_id: {tg_id} не найдена сделка в амосрм')
-            new_lead_id = amo_api.send_lead_to_amo(pipeline_id=pipelines.get('hite_pro_education'),
-                                                   status_id=status_fields.get('admitted_to_training'),
-                                                   contact_id=contact_data.get("amo_contact_id"),
-                                                   utm_metriks_fields=utm_metriks,
-                                                   user=user
-                                                   )
+            new_lead_id = await amo_api.send_lead_to_amo(pipeline_id=pipelines.get('hite_pro_education'),
+                                                         status_id=status_fields.get('admitted_to_training'),
+                                                         contact_id=contact_data.get("amo_contact_id"),
+                                                         utm_metriks_fields=utm_metriks,
+                                                         user=user
+                                                         )
             user.amo_deal_id = new_lead_id
             logger.info(f'Для пользователя{user.first_name} {user.last_name} tg_id: {tg_id} создана сделка {new_lead_id}')
 
@@ -628,17 +635,17 @@ async def on_contact(message: Message, _, dialog_manager):
         first_name = dialog_manager.event.from_user.first_name if dialog_manager.event.from_user.first_name is not None else ''
         last_name = dialog_manager.event.from_user.last_name if dialog_manager.event.from_user.last_name is not None else ''
         logger.info(f'В амо не найден контакт для пользователя tg_id: {tg_id}, телефон: {phone_number}')
-        new_contact_id = amo_api.create_new_contact(first_name=first_name,
-                                                    last_name=last_name,
-                                                    phone=message.contact.phone_number,
-                                                    tg_id_field=tg_field_id, tg_id=tg_id,
-                                                    username_id=username_field_id, username=username)
-        new_lead_id = amo_api.send_lead_to_amo(pipeline_id=pipelines.get('hite_pro_education'),
-                                               status_id=status_fields.get('admitted_to_training'),
-                                               contact_id=new_contact_id,
-                                               utm_metriks_fields=utm_metriks,
-                                               user=user
-                                               )
+        new_contact_id = await amo_api.create_new_contact(first_name=first_name,
+                                                          last_name=last_name,
+                                                          phone=message.contact.phone_number,
+                                                          tg_id_field=tg_field_id, tg_id=tg_id,
+                                                          username_id=username_field_id, username=username)
+        new_lead_id = await amo_api.send_lead_to_amo(pipeline_id=pipelines.get('hite_pro_education'),
+                                                     status_id=status_fields.get('admitted_to_training'),
+                                                     contact_id=new_contact_id,
+                                                     utm_metriks_fields=utm_metriks,
+                                                     user=user
+                                                     )
         await _merge_user_by_amo_contact_id(
             session=session,
             current_user=user,
@@ -651,9 +658,9 @@ async def on_contact(message: Message, _, dialog_manager):
 
     await session.commit()
     await session.refresh(user)
-    response = amo_api.push_lead_to_status(pipeline_id=pipelines.get('hite_pro_education'),
-                                           status_id=status_fields.get('authorized_in_bot'),
-                                           lead_id=str(user.amo_deal_id))
+    response = await amo_api.push_lead_to_status(pipeline_id=pipelines.get('hite_pro_education'),
+                                                 status_id=status_fields.get('authorized_in_bot'),
+                                                 lead_id=str(user.amo_deal_id))
     if response:
         logger.info(f'Сделка {user.amo_deal_id} перемещена в следующий этап - Авторизовался в боте')
     else:
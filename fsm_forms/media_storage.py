@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from aiogram import Bot
+from aiogram.types import ContentType, FSInputFile
+from aiogram_dialog import Dialog
+from aiogram_dialog.api.entities import MediaId
+from aiogram_dialog.api.protocols import MediaIdStorageProtocol
+from aiogram_dialog.utils import get_media_id
+from aiogram_dialog.widgets.media import StaticMedia
+from aiogram_dialog.widgets.text import Const
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.models import MediaFile
+
+logger = logging.getLogger(__name__)
+
+SEND_METHODS = {
+    ContentType.PHOTO: ("send_photo", "photo"),
+    ContentType.VIDEO: ("send_video", "video"),
+    ContentType.DOCUMENT: ("send_document", "document"),
+    ContentType.ANIMATION: ("send_animation", "animation"),
+}
+# Сколько помнить, что file_id в БД нет: окно без загруженного видео не ходит в БД на каждый показ
+MISS_CACHE_TTL = 60
+
+
+@dataclass(frozen=True)
+class CachedMedia:
+    media_id: MediaId
+    mtime: float | None
+
+
+def media_key(path: str | Path | None, url: str | None, type: ContentType | str) -> tuple[str, str]:
+    return str(path or url), getattr(type, "value", str(type))
+
+
+def file_mtime(path: str | None) -> float | None:
+    if not path or not os.path.exists(path):
+        return None
+    return os.path.getmtime(path)
+
+
+class SqlAlchemyMediaIdStorage(MediaIdStorageProtocol):
+    """Реестр file_id медиа aiogram_dialog в PostgreSQL.
+
+    Файл уходит в Telegram один раз, дальше окна урока отправляют его по file_id,
+    в том числе после перезапуска бота. Изменился mtime файла - загружаем заново.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        miss_ttl: float = MISS_CACHE_TTL,
+    ):
+        self.session_factory = session_factory
+        self.miss_ttl = miss_ttl
+        self._cache: dict[tuple[str, str], CachedMedia] = {}
+        # Ключи без записи в БД и момент, до которого их не перечитываем
+        self._misses: dict[tuple[str, str], float] = {}
+
+    async def get_media_id(
+        self,
+        path: str | Path | None,
+        url: str | None,
+        type: ContentType,
+    ) -> MediaId | None:
+        if not path and not url:
+            return None
+        key = media_key(path, url, type)
+        cached = self._cache.get(key)
+        if cached is None:
+            if self._misses.get(key, 0.0) > time.monotonic():
+                return None
+            cached = await self._load(key)
+            if cached is None:
+                self._misses[key] = time.monotonic() + self.miss_ttl
+                return None
+            self._misses.pop(key, None)
+            self._cache[key] = cached
+        mtime = file_mtime(str(path)) if path else None
+        if mtime is not None and mtime != cached.mtime:
+            return None
+        return cached.media_id
+
+    async def save_media_id(
+        self,
+        path: str | Path | None,
+        url: str | None,
+        type: ContentType,
+        media_id: MediaId,
+    ) -> None:
+        if not path and not url:
+            return
+        key = media_key(path, url, type)
+        self._misses.pop(key, None)
+        cached = CachedMedia(media_id, file_mtime(str(path)) if path else None)
+        # aiogram_dialog сохраняет id после каждой отправки - в БД пишем только изменения
+        if self._cache.get(key) == cached:
+            return
+        self._cache[key] = cached
+        values = {
+            "mtime": cached.mtime,
+            "file_id": media_id.file_id,
+            "file_unique_id": media_id.file_unique_id,
+            "updated_at": datetime.now(timezone.utc),
+        }
+        statement = insert(MediaFile).values(source=key[0], content_type=key[1], **values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[MediaFile.source, MediaFile.content_type],
+            set_=values,
+        )
+        try:
+            async with self.session_factory() as session:
+                await session.execute(statement)
+                await session.commit()
+        except Exception:
+            # Не критично: file_id останется в памяти процесса
+            logger.exception("Не удалось сохранить file_id для %s", key[0])
+
+    async def _load(self, key: tuple[str, str]) -> CachedMedia | None:
+        try:
+            async with self.session_factory() as session:
+                record = await session.get(MediaFile, key)
+        except Exception:
+            logger.exception("Не удалось прочитать file_id для %s", key[0])
+            return None
+        if record is None:
+            return None
+        return CachedMedia(MediaId(record.file_id, record.file_unique_id), record.mtime)
+
+
+def iter_static_media(dialogs: Iterable[Dialog]) -> Iterator[StaticMedia]:
+    """Статические медиа окон с постоянным путём - их можно загрузить заранее."""
+    seen: set[tuple[str, str]] = set()
+    for dialog in dialogs:
+        for window in dialog.windows.values():
+            media = getattr(window, "media", None)
+            if not isinstance(media, StaticMedia) or not isinstance(media.path, Const):
+                continue
+            key = media_key(media.path.text, None, media.type)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield media
+
+
+async def warm_up_media(
+    bot: Bot,
+    storage: SqlAlchemyMediaIdStorage,
+    dialogs: Iterable[Dialog],
+    chat_id: int,
+) -> int:
+    """Загружает в Telegram медиа без file_id, отправляя их в служебный чат.
+
+    Запускается при деплое, чтобы первый ученик не ждал загрузки видео. Возвращает
+    число загруженных файлов.
+    """
+    uploaded = 0
+    for media in iter_static_media(dialogs):
+        path = str(media.path.text)
+        if media.type not in SEND_METHODS:
+            continue
+        if await storage.get_media_id(path, None, media.type) is not None:
+            continue
+        if not os.path.exists(path):
+            logger.warning("Медиафайл %s не найден", path)
+            continue
+        method, field = SEND_METHODS[media.type]
+        message = await getattr(bot, method)(
+            chat_id=chat_id,
+            **{field: FSInputFile(path)},
+            **media.media_params,
+        )
+        media_id = get_media_id(message)
+        if media_id is not None:
+            await storage.save_media_id(path, None, media.type, media_id)
+            uploaded += 1
+            logger.info("Загружен %s", path)
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+        except Exception:
+            logger.warning("Не удалось удалить служебное сообщение с %s", path)
+    return uploaded
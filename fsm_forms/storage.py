@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import and_, case, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.models import FsmStorageRecord
+
+logger = logging.getLogger(__name__)
+
+
+def dump_data(data: Mapping[str, Any]) -> str | None:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_data(raw: str | None) -> dict[str, Any]:
+    if not raw:
+        return {}
+    return json.loads(raw)
+
+
+class SqlAlchemyStorage(BaseStorage):
+    """FSM-хранилище aiogram в PostgreSQL.
+
+    Стек и контексты aiogram_dialog переживают перезапуск бота и общие для нескольких
+    экземпляров. Записи, не обновлявшиеся дольше ttl, не читаются и периодически удаляются.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        *,
+        key_builder: KeyBuilder | None = None,
+        ttl: timedelta | None = timedelta(days=30),
+        purge_interval: float = 3600,
+    ):
+        self.session_factory = session_factory
+        # aiogram_dialog хранит стек и каждый контекст под отдельным destiny
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._purge_task: asyncio.Task | None = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._upsert(self.key_builder.build(key), {"state": value})
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = await self._get(self.key_builder.build(key))
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._upsert(self.key_builder.build(key), {"data": dump_data(data)})
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = await self._get(self.key_builder.build(key))
+        return load_data(record.data) if record is not None else {}
+
+    async def close(self) -> None:
+        if self._purge_task is not None and not self._purge_task.done():
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+        self._purge_task = None
+
+    async def _get(self, key: str) -> FsmStorageRecord | None:
+        conditions = [FsmStorageRecord.key == key]
+        if self.ttl is not None:
+            conditions.append(FsmStorageRecord.updated_at >= datetime.now(timezone.utc) - self.ttl)
+        async with self.session_factory() as session:
+            result = await session.execute(select(FsmStorageRecord).where(and_(*conditions)))
+            return result.scalar_one_or_none()
+
+    async def _upsert(self, key: str, values: dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        statement = insert(FsmStorageRecord).values(key=key, updated_at=now, **values)
+        update_values: dict[str, Any] = {**values, "updated_at": now}
+        if self.ttl is not None:
+            # Просроченную, но ещё не удалённую запись не «оживляем» вместе со старыми данными
+            expired = FsmStorageRecord.updated_at < now - self.ttl
+            for column in ("state", "data"):
+                if column not in values:
+                    update_values[column] = case((expired, None), else_=getattr(FsmStorageRecord, column))
+        statement = statement.on_conflict_do_update(
+            index_elements=[FsmStorageRecord.key],
+            set_=update_values,
+        )
+        async with self.session_factory() as session:
+            await session.execute(statement)
+            # Пустой контекст не держим в таблице
+            await session.execute(
+                delete(FsmStorageRecord).where(
+                    FsmStorageRecord.key == key,
+                    FsmStorageRecord.state.is_(None),
+                    FsmStorageRecord.data.is_(None),
+                )
+            )
+            await session.commit()
+        self._schedule_purge()
+
+    def _schedule_purge(self) -> None:
+        if self.ttl is None or time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        if self._purge_task is not None and not self._purge_task.done():
+            return
+        self._purged_at = time.monotonic()
+        self._purge_task = asyncio.create_task(self.purge_expired(), name="fsm-storage-purge")
+
+    async def purge_expired(self) -> int:
+        if self.ttl is None:
+            return 0
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    delete(FsmStorageRecord).where(
+                        FsmStorageRecord.updated_at < datetime.now(timezone.utc) - self.ttl
+                    )
+                )
+                await session.commit()
+        except Exception:
+            logger.exception("Не удалось очистить устаревшие записи FSM")
+            return 0
+        if result.rowcount:
+            logger.info("Удалено устаревших записей FSM: %s", result.rowcount)
+        return result.rowcount or 0
@@ -3,8 +3,6 @@ from __future__ import annotations
 from aiogram import F, Router
 from aiogram.types import CallbackQuery
 from aiogram_dialog import DialogManager
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import User
 from dialogs.main_dialog import (
@@ -45,9 +43,7 @@ async def run_broadcast_action(callback: CallbackQuery, dialog_manager: DialogMa
         await callback.answer("Действие недоступно.", show_alert=True)
         return
     if action_key != "main_menu":
-        session: AsyncSession = dialog_manager.middleware_data["session"]
-        result = await session.execute(select(User).where(User.tg_user_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
+        user: User | None = dialog_manager.middleware_data.get("db_user")
         if user is None or user.amo_contact_id is None or not user.client_type:
             await callback.answer(
                 "Сначала пройдите авторизацию в главном меню бота.",
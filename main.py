@@ -1,7 +1,12 @@
+import argparse
 import asyncio
 import logging
+import os
+import signal
+from datetime import timedelta
 
 import uvicorn
+from fastapi import FastAPI
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.session.aiohttp import AiohttpSession
@@ -10,30 +15,31 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram_dialog import DialogManager, StartMode, setup_dialogs
 
 from amo_api.amo_api import AmoCRMWrapper
+from amo_api.write_queue import AmoWriteQueue
 from dialogs.admin_dialog import admin_getter, admin_dialog
 from dialogs.error_dialog import errors_router
-from dialogs.hp_fifth_lesson_dialog import hp_fifth_lesson_dialog
-from dialogs.hp_fourth_lesson_dialog import hp_fourth_lesson_dialog
-from dialogs.hp_seventh_lesson_dialog import hp_seventh_lesson_dialog
-from dialogs.hp_sixth_lesson_dialog import hp_sixth_lesson_dialog
 from dialogs.hp_exam_dialog import hp_exam_lesson_dialog
 from dialogs.main_dialog import main_menu_dialog
-from dialogs.hp_first_lesson_dialog import hp_first_lesson_dialog
-from dialogs.hp_second_lesson_dialog import hp_second_lesson_dialog
-from dialogs.hp_third_lesson_dialog import hp_third_lesson_dialog
+from dialogs.lessons import lesson_dialogs
 from handlers.start_handler import main_menu_router
 from handlers.broadcast_actions import broadcast_actions_router
 from config.config import load_config
 from aiogram.enums.parse_mode import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from db import init_db, shutdown_db
+from db import async_session_factory, init_db, shutdown_db
+from fsm_forms.media_storage import SqlAlchemyMediaIdStorage, warm_up_media
+from fsm_forms.storage import SqlAlchemyStorage
 from middlewares.db import DbSessionMiddleware
 from middlewares.amo_api import AmoApiMiddleware
+from middlewares.user import DbUserMiddleware
+from service.report_jobs import ReportJobManager
+from service.telegram_webhook import UpdateWorkerPool, create_webhook_router
 from service.background_notifications import (
     start_inactivity_scheduler,
     stop_inactivity_scheduler,
 )
-from web_admin.app import create_admin_app
+from web_admin.app import create_admin_app, create_broadcast_service
+from web_admin.service import BroadcastService
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +50,10 @@ logging.basicConfig(
 logger.info("Starting hitepro_edu_bot")
 
 config = load_config()
-storage = MemoryStorage()
+if config.tg_bot.fsm_storage == "memory":
+    storage = MemoryStorage()
+else:
+    storage = SqlAlchemyStorage(async_session_factory, ttl=timedelta(days=config.tg_bot.fsm_ttl_days))
 
 api = TelegramAPIServer.from_base(
         "http://127.0.0.1:8081",
@@ -66,66 +75,205 @@ amo_api = AmoCRMWrapper(
     amocrm_secret_code=config.amo_config.amocrm_secret_code,
     amocrm_access_token=config.amo_config.amocrm_access_token,
     amocrm_refresh_token=config.amo_config.amocrm_refresh_token,
+    request_timeout=config.amo_config.request_timeout,
+    rate_limit=config.amo_config.rate_limit,
+    max_retries=config.amo_config.max_retries,
+    lead_index_refresh_interval=config.amo_config.lead_index_refresh_interval,
 )
+amo_queue = AmoWriteQueue(
+    amo_api,
+    async_session_factory,
+    flush_interval=config.amo_config.write_flush_interval,
+)
+# Выгрузки отчётов общие для админки бота и веб-админки процесса
+report_jobs = ReportJobManager(
+    async_session_factory,
+    config.admin_web.data_dir / "reports",
+    ttl=config.admin_web.report_cache_ttl,
+)
+dp["report_jobs"] = report_jobs
 
 inactivity_scheduler_task: asyncio.Task | None = None
 
 dp.update.middleware(DbSessionMiddleware())
+dp.update.middleware(DbUserMiddleware())
 dp.update.middleware(AmoApiMiddleware(amo_api, amo_fields=config.amo_fields, admin_id=config.admin,
-                                      webhook_url=config.webhook_url, utm_token=config.utm_token))
+                                      webhook_url=config.webhook_url, utm_token=config.utm_token,
+                                      amo_queue=amo_queue))
 dp.errors.middleware(DbSessionMiddleware())
 dp.errors.middleware(AmoApiMiddleware(amo_api, amo_fields=config.amo_fields, admin_id=config.admin,
-                                      webhook_url=config.webhook_url, utm_token=config.utm_token))
+                                      webhook_url=config.webhook_url, utm_token=config.utm_token,
+                                      amo_queue=amo_queue))
 
 dp.include_router(main_menu_router)
 dp.include_router(broadcast_actions_router)
-dp.include_routers(main_menu_dialog, hp_first_lesson_dialog, hp_second_lesson_dialog,
-                   hp_third_lesson_dialog, hp_fourth_lesson_dialog, hp_fifth_lesson_dialog, hp_sixth_lesson_dialog,
-                   hp_seventh_lesson_dialog, hp_exam_lesson_dialog, admin_dialog, errors_router)
+DIALOGS = (main_menu_dialog, *lesson_dialogs, hp_exam_lesson_dialog, admin_dialog)
+dp.include_routers(*DIALOGS, errors_router)
+
+# file_id видео уроков хранятся в БД: файл загружается в Telegram один раз
+media_id_storage = SqlAlchemyMediaIdStorage(async_session_factory)
+setup_dialogs(dp, media_id_storage=media_id_storage)
+
+
+ROLES = ("all", "bot", "admin", "broadcast-worker", "scheduler")
 
-setup_dialogs(dp)
 
+async def wait_for_shutdown_signal() -> None:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+    await stop_event.wait()
 
-async def main() -> None:
+
+async def main(role: str = "all") -> None:
     global inactivity_scheduler_task
+    # Роли общаются только через БД: каждую можно запускать отдельным процессом
+    run_bot = role in ("all", "bot")
+    run_admin = role in ("all", "admin")
+    run_scheduler = role in ("all", "scheduler")
+    logger.info("Starting role %s", role)
     try:
         await init_db()
     except Exception as exc:
         logger.exception("DB init failed: %s", exc)
 
-    inactivity_scheduler_task = start_inactivity_scheduler(bot)
+    if run_scheduler:
+        inactivity_scheduler_task = start_inactivity_scheduler(bot)
+    if run_bot:
+        amo_queue.start()
+    broadcast_service: BroadcastService | None = None
+    if role == "broadcast-worker":
+        broadcast_service = create_broadcast_service(bot, config.admin_web)
+        await broadcast_service.initialize()
+        broadcast_service.start()
+
     server: uvicorn.Server | None = None
     server_task: asyncio.Task | None = None
-    if config.admin_web.enabled:
-        app = create_admin_app(bot, config.admin_web)
-        server = uvicorn.Server(uvicorn.Config(
-            app,
-            host=config.admin_web.host,
-            port=config.admin_web.port,
-            log_level="info",
-        ))
-        server_task = asyncio.create_task(server.serve(), name="web-admin-server")
+    app: FastAPI | None = None
+    host, port = config.tg_bot.webhook_host, config.tg_bot.webhook_port
+    if run_admin and config.admin_web.enabled:
+        # В режиме all рассылки по-прежнему отправляет воркер внутри админки.
+        # Метрики amoCRM есть только там, где работает бот: в отдельной админке клиент простаивает
+        app = create_admin_app(
+            bot,
+            config.admin_web,
+            run_worker=role == "all",
+            report_jobs=report_jobs,
+            amo_api=amo_api if run_bot else None,
+        )
+        host, port = config.admin_web.host, config.admin_web.port
         logger.info(
             "Web admin enabled at http://%s:%s%s",
             config.admin_web.host,
             config.admin_web.port,
             config.admin_web.prefix,
         )
-    else:
+    elif run_admin:
         logger.warning("Web admin disabled: configure ADMIN_PANEL_PASSWORD and ADMIN_SESSION_SECRET")
 
+    update_pool: UpdateWorkerPool | None = None
+    if run_bot and config.tg_bot.webhook_enabled:
+        update_pool = UpdateWorkerPool(
+            dp,
+            bot,
+            workers=config.tg_bot.webhook_workers,
+            queue_size=config.tg_bot.webhook_queue_size,
+        )
+        if app is None:
+            app = FastAPI(title="HiTE PRO education bot")
+        # Вебхук обслуживает тот же uvicorn, что и веб-админка
+        app.include_router(create_webhook_router(update_pool, config.tg_bot.webhook_path, config.tg_bot.webhook_secret))
+    elif run_bot and config.tg_bot.updates_mode == "webhook":
+        logger.warning("Webhook mode requires TG_WEBHOOK_SECRET, falling back to polling")
+
+    if app is not None:
+        server = uvicorn.Server(uvicorn.Config(
+            app,
+            host=host,
+            port=port,
+            log_level="info",
+        ))
+        server_task = asyncio.create_task(server.serve(), name="web-admin-server")
+
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if update_pool is not None:
+            await dp.emit_startup(bot=bot)
+            update_pool.start()
+            await bot.set_webhook(
+                url=f"{config.tg_bot.webhook_base_url}{config.tg_bot.webhook_path}",
+                secret_token=config.tg_bot.webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info(
+                "Webhook mode: %s workers at %s%s",
+                config.tg_bot.webhook_workers,
+                config.tg_bot.webhook_base_url,
+                config.tg_bot.webhook_path,
+            )
+            await server_task
+        elif run_bot:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+        elif server_task is not None:
+            await server_task
+        else:
+            await wait_for_shutdown_signal()
     finally:
         if server is not None:
             server.should_exit = True
         if server_task is not None:
             await server_task
+        if update_pool is not None:
+            await update_pool.stop()
+            await dp.emit_shutdown(bot=bot)
+        if broadcast_service is not None:
+            await broadcast_service.stop()
+        await report_jobs.close()
         await stop_inactivity_scheduler(inactivity_scheduler_task)
         inactivity_scheduler_task = None
+        if run_bot:
+            await amo_queue.close()
+        await amo_api.close()
+        await bot.session.close()
+        # Останавливает фоновую очистку просроченных FSM-записей до закрытия пула БД
+        await storage.close()
         await shutdown_db()
 
 
+async def warm_up(chat_id: int) -> None:
+    await init_db()
+    try:
+        uploaded = await warm_up_media(bot, media_id_storage, DIALOGS, chat_id)
+        logger.info("Media warm-up finished: %s files uploaded", uploaded)
+    finally:
+        await bot.session.close()
+        await shutdown_db()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="HiTE PRO education bot")
+    parser.add_argument(
+        "--role",
+        choices=ROLES,
+        default=os.environ.get("APP_ROLE", "all"),
+        help="Что запускать в этом процессе (по умолчанию всё сразу, как раньше)",
+    )
+    parser.add_argument(
+        "--warm-up-media",
+        action="store_true",
+        help="Загрузить медиа уроков в Telegram (в чат ADMIN_ID), сохранить file_id и выйти",
+    )
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.warm_up_media:
+        asyncio.run(warm_up(int(config.admin)))
+    else:
+        asyncio.run(main(args.role))
@@ -5,12 +5,14 @@ from typing import Any, Awaitable, Callable
 from aiogram import BaseMiddleware
 
 from amo_api.amo_api import AmoCRMWrapper
+from amo_api.write_queue import AmoWriteQueue
 
 
 class AmoApiMiddleware(BaseMiddleware):
     def __init__(self, amo_api: AmoCRMWrapper, amo_fields: dict, admin_id: str,
-                 webhook_url: str, utm_token: str) -> None:
+                 webhook_url: str, utm_token: str, amo_queue: AmoWriteQueue | None = None) -> None:
         self._amo_api = amo_api
+        self._amo_queue = amo_queue
         self._amo_fields = amo_fields
         self.admin_id = admin_id
         self.webhook_url = webhook_url
@@ -23,6 +25,7 @@ class AmoApiMiddleware(BaseMiddleware):
         data: dict[str, Any],
     ) -> Any:
         data["amo_api"] = self._amo_api
+        data["amo_queue"] = self._amo_queue
         data["amo_fields"] = self._amo_fields
         data["admin_id"] = self.admin_id
         data["webhook_url"] = self.webhook_url
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+
+from service.users import get_user
+
+
+class DbUserMiddleware(BaseMiddleware):
+    """Кладёт в data["db_user"] запись users автора апдейта (или None).
+
+    Подключается после DbSessionMiddleware: пользователь загружается один раз
+    на апдейт, геттеры и обработчики диалогов берут его из middleware_data.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        session = data.get("session")
+        data["db_user"] = None
+        if from_user is not None and session is not None:
+            data["db_user"] = await get_user(session, tg_user_id=from_user.id)
+        return await handler(event, data)
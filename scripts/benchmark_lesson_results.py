@@ -0,0 +1,142 @@
+"""Планы запросов к lesson_results до и после индексов миграции 20260905_01.
+
+Создаёт отдельную схему в базе из DATABASE_URL, наполняет её синтетическими
+результатами уроков, печатает EXPLAIN ANALYZE горячих запросов со старым индексом
+по user_id и с индексами из db.models, после чего удаляет схему.
+
+    python -m scripts.benchmark_lesson_results --results 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.schema import CreateIndex
+
+from config.config import load_config
+from db.models import HpLessonResult
+
+SCHEMA = "bench_lesson_results"
+LESSON_KEYS = ("lesson_1", "lesson_2", "lesson_3", "lesson_4", "lesson_5", "lesson_6", "lesson_7", "exam")
+
+CREATE_TABLES = (
+    "CREATE TABLE users (id integer PRIMARY KEY)",
+    """
+    CREATE TABLE lesson_results (
+        id serial PRIMARY KEY,
+        user_id integer NOT NULL REFERENCES users (id),
+        lesson_key varchar(64) NOT NULL,
+        result varchar(128),
+        score integer,
+        compleat boolean NOT NULL DEFAULT false,
+        started_at timestamp,
+        completed_at timestamp
+    )
+    """,
+    # Состояние до миграции: индекс только по user_id
+    "CREATE INDEX ix_lesson_results_user_id ON lesson_results (user_id)",
+)
+
+QUERIES = {
+    "Доступ к уроку (user_id, lesson_key, compleat)": """
+        SELECT EXISTS (
+            SELECT 1 FROM lesson_results
+            WHERE user_id = :user_id AND lesson_key = 'lesson_3' AND compleat IS TRUE
+        )
+    """,
+    "История пользователя (user_id)": """
+        SELECT id, lesson_key, compleat FROM lesson_results WHERE user_id = :user_id
+    """,
+    "Напоминания: экзамен не сдан (EXISTS по пачке из 1000)": """
+        SELECT count(*) FROM users
+        WHERE users.id BETWEEN :user_id AND :user_id + 999
+          AND NOT EXISTS (
+            SELECT 1 FROM lesson_results
+            WHERE lesson_results.user_id = users.id
+              AND lesson_results.lesson_key = 'exam'
+              AND lesson_results.compleat IS TRUE
+          )
+    """,
+}
+
+
+async def seed(conn: AsyncConnection, results: int, users: int) -> None:
+    for statement in CREATE_TABLES:
+        await conn.execute(text(statement))
+    await conn.execute(text("INSERT INTO users (id) SELECT generate_series(1, :users)"), {"users": users})
+    keys = ", ".join(f"'{key}'" for key in LESSON_KEYS)
+    # Экзамен сдают реже, чем обычные уроки
+    await conn.execute(
+        text(
+            f"""
+            INSERT INTO lesson_results (user_id, lesson_key, score, compleat, started_at, completed_at)
+            SELECT
+                1 + floor(random() * :users)::int,
+                key,
+                floor(random() * 100)::int,
+                random() < CASE WHEN key = 'exam' THEN 0.3 ELSE 0.7 END,
+                started_at,
+                started_at + interval '20 minutes'
+            FROM (
+                SELECT
+                    (ARRAY[{keys}])[1 + floor(random() * {len(LESSON_KEYS)})::int] AS key,
+                    timezone('utc', now()) - random() * interval '365 days' AS started_at
+                FROM generate_series(1, :results)
+            ) AS generated
+            """
+        ),
+        {"users": users, "results": results},
+    )
+    await conn.execute(text("ANALYZE users"))
+    await conn.execute(text("ANALYZE lesson_results"))
+
+
+async def apply_model_indexes(conn: AsyncConnection) -> None:
+    for index in sorted(HpLessonResult.__table__.indexes, key=lambda item: item.name):
+        await conn.execute(CreateIndex(index, if_not_exists=True))
+    await conn.execute(text("DROP INDEX IF EXISTS ix_lesson_results_user_id"))
+    await conn.execute(text("ANALYZE lesson_results"))
+
+
+async def explain(conn: AsyncConnection, title: str, user_id: int) -> None:
+    print(f"=== {title}")
+    for name, query in QUERIES.items():
+        rows = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), {"user_id": user_id})
+        print(f"--- {name}")
+        for (line,) in rows:
+            print(line)
+    print()
+
+
+async def run(results: int, users: int, keep: bool) -> None:
+    engine = create_async_engine(load_config().db.url)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+            await conn.execute(text(f"SET LOCAL search_path TO {SCHEMA}"))
+            await seed(conn, results, users)
+            user_id = users // 2
+            await explain(conn, "До: индекс только по user_id", user_id)
+            await apply_model_indexes(conn)
+            await explain(conn, "После: индексы из db.models", user_id)
+            if not keep:
+                await conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    finally:
+        await engine.dispose()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--results", type=int, default=1_000_000, help="Сколько результатов уроков создать")
+    parser.add_argument("--users", type=int, default=100_000, help="Сколько пользователей создать")
+    parser.add_argument("--keep", action="store_true", help=f"Не удалять схему {SCHEMA} после замеров")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(run(args.results, args.users, args.keep))
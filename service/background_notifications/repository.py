@@ -1,12 +1,36 @@
 from __future__ import annotations
 
-from sqlalchemy import select, update
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Sequence
+
+from sqlalchemy import Select, bindparam, case, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.models import HpLessonResult, User
+from service.background_notifications.rules import STAGE_THRESHOLDS
+
+
+@dataclass(frozen=True)
+class NotificationCandidate:
+    user_id: int
+    tg_user_id: int
+    notification_stage: int | None
+    activity_at: datetime
+    target_stage: int
+    exam_completed: bool = False
 
 
-async def get_notification_candidates(session: AsyncSession) -> list[User]:
+def build_due_notifications_query(
+    now: datetime,
+    *,
+    user_ids: Sequence[int] | None = None,
+    limit: int | None = None,
+) -> Select:
+    """Пользователи, у которых подошло next_notification_at, с активностью и целевой стадией.
+
+    Выборка идёт по индексу next_notification_at; стадию по порогам считает сам запрос.
+    """
     exam_completed_exists = (
         select(HpLessonResult.id)
         .where(
@@ -16,35 +40,74 @@ async def get_notification_candidates(session: AsyncSession) -> list[User]:
         )
         .exists()
     )
-    result = await session.execute(
-        select(User)
+    activity_at = func.coalesce(User.last_activity_at, User.created_at)
+    target_stage = case(
+        *[(activity_at > now - threshold, stage) for stage, threshold in enumerate(STAGE_THRESHOLDS)],
+        else_=len(STAGE_THRESHOLDS),
+    )
+    query = (
+        select(
+            User.id.label("user_id"),
+            User.tg_user_id,
+            User.notification_stage,
+            activity_at.label("activity_at"),
+            target_stage.label("target_stage"),
+            exam_completed_exists.label("exam_completed"),
+        )
         .where(User.tg_user_id.is_not(None))
-        .where(~exam_completed_exists)
-        .order_by(User.id)
+        .where(User.next_notification_at <= now)
+        .order_by(User.next_notification_at, User.id)
     )
-    return result.scalars().all()
+    if user_ids is not None:
+        query = query.where(User.id.in_(user_ids))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
 
 
-async def get_last_lesson_result(
+async def get_due_notifications(
     session: AsyncSession,
-    user_id: int,
-) -> HpLessonResult | None:
+    now: datetime,
+    *,
+    user_ids: Sequence[int] | None = None,
+    limit: int | None = None,
+) -> list[NotificationCandidate]:
+    result = await session.execute(build_due_notifications_query(now, user_ids=user_ids, limit=limit))
+    return [NotificationCandidate(**row) for row in result.mappings()]
+
+
+async def get_upcoming_notifications(
+    session: AsyncSession,
+    until: datetime,
+    limit: int,
+) -> list[tuple[datetime, int]]:
     result = await session.execute(
-        select(HpLessonResult)
-        .where(HpLessonResult.user_id == user_id)
-        .order_by(HpLessonResult.started_at.desc().nullslast(), HpLessonResult.id.desc())
-        .limit(1)
+        select(User.next_notification_at, User.id)
+        .where(User.tg_user_id.is_not(None))
+        .where(User.next_notification_at <= until)
+        .order_by(User.next_notification_at, User.id)
+        .limit(limit)
     )
-    return result.scalar_one_or_none()
+    return [(due_at, user_id) for due_at, user_id in result.all()]
 
 
-async def update_notification_stage(
+async def update_notification_schedule(
     session: AsyncSession,
-    user_id: int,
-    stage: int | None,
+    schedule: dict[int, tuple[int | None, datetime | None]],
 ) -> None:
+    """Пишет стадию и следующий срок пачкой: один executemany на все строки."""
+    if not schedule:
+        return
+    users = User.__table__
     await session.execute(
-        update(User)
-        .where(User.id == user_id)
-        .values(notification_stage=stage)
+        update(users)
+        .where(users.c.id == bindparam("user_id"))
+        .values(
+            notification_stage=bindparam("stage"),
+            next_notification_at=bindparam("next_at"),
+        ),
+        [
+            {"user_id": user_id, "stage": stage, "next_at": next_at}
+            for user_id, (stage, next_at) in schedule.items()
+        ],
     )
@@ -1,6 +1,23 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# Порог бездействия для стадий 1..4: стадия N наступает, когда прошло STAGE_THRESHOLDS[N - 1].
+# Те же границы использует SQL-запрос кандидатов в repository.py
+STAGE_THRESHOLDS = (
+    timedelta(days=2),
+    timedelta(days=5),
+    timedelta(days=10),
+    timedelta(days=20),
+)
+
+# Сообщения уходят только в эти часы по Москве
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
+SEND_WINDOW_START = time(10, 0)
+SEND_WINDOW_END = time(21, 0)
+# Не доставили сообщение - пробуем снова через сутки, как раньше при ежедневном запуске
+RETRY_DELAY = timedelta(days=1)
 
 
 def resolve_activity_at(
@@ -16,15 +33,10 @@ def resolve_activity_at(
 
 
 def resolve_target_stage(elapsed_timedelta: timedelta) -> int:
-    if elapsed_timedelta < timedelta(days=2):
-        return 0
-    if elapsed_timedelta < timedelta(days=5):
-        return 1
-    if elapsed_timedelta < timedelta(days=10):
-        return 2
-    if elapsed_timedelta < timedelta(days=20):
-        return 3
-    return 4
+    for stage, threshold in enumerate(STAGE_THRESHOLDS):
+        if elapsed_timedelta < threshold:
+            return stage
+    return len(STAGE_THRESHOLDS)
 
 
 def should_send(stage_current: int | None, stage_target: int) -> bool:
@@ -37,3 +49,44 @@ def should_send(stage_current: int | None, stage_target: int) -> bool:
     if stage_target == 4:
         return stage_current in (None, 3)
     return False
+
+
+def resolve_next_due_at(activity_at: datetime, stage: int | None, target_stage: int) -> datetime | None:
+    """Когда пользователь пересечёт следующий порог. None - сообщений больше не будет."""
+    reached = max(stage or 0, target_stage)
+    if reached >= len(STAGE_THRESHOLDS):
+        return None
+    return activity_at + STAGE_THRESHOLDS[reached]
+
+
+def _window_bounds(day_local: datetime) -> tuple[datetime, datetime]:
+    start = day_local.replace(
+        hour=SEND_WINDOW_START.hour, minute=SEND_WINDOW_START.minute, second=0, microsecond=0
+    )
+    end = day_local.replace(
+        hour=SEND_WINDOW_END.hour, minute=SEND_WINDOW_END.minute, second=0, microsecond=0
+    )
+    return start, end
+
+
+def in_send_window(moment: datetime) -> bool:
+    local = moment.replace(tzinfo=timezone.utc).astimezone(MOSCOW_TZ)
+    start, end = _window_bounds(local)
+    return start <= local < end
+
+
+def shift_into_send_window(moment: datetime, user_id: int) -> datetime:
+    """Переносит наивное UTC-время в разрешённые часы.
+
+    Попавшие на ночь распределяются по всему следующему окну по user_id, чтобы утром
+    не было всплеска отправок.
+    """
+    if in_send_window(moment):
+        return moment
+    local = moment.replace(tzinfo=timezone.utc).astimezone(MOSCOW_TZ)
+    start, end = _window_bounds(local)
+    if local >= end:
+        start, end = _window_bounds(local + timedelta(days=1))
+    window_seconds = int((end - start).total_seconds())
+    offset = timedelta(seconds=(user_id * 2654435761) % window_seconds)
+    return (start + offset).astimezone(timezone.utc).replace(tzinfo=None)
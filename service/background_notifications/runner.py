@@ -1,27 +1,40 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import time
 from datetime import datetime
+from typing import Sequence
 
 from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
 
 from config.config import BASE_DIR
 from db import async_session_factory
 from service.background_message import get_background_message
 from service.background_notifications.repository import (
-    get_last_lesson_result,
-    get_notification_candidates,
-    update_notification_stage,
+    NotificationCandidate,
+    get_due_notifications,
+    update_notification_schedule,
 )
 from service.background_notifications.rules import (
-    resolve_activity_at,
-    resolve_target_stage,
+    RETRY_DELAY,
+    in_send_window,
+    resolve_next_due_at,
     should_send,
+    shift_into_send_window,
 )
+from service.rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 NOTIFICATION_PHOTO_PATH = BASE_DIR / "media" / "photo" / "notification.png"
+STAGE_UPDATE_BATCH_SIZE = 100
+# Отправители и общий темп: Telegram допускает ~30 сообщений в секунду на бота
+NOTIFICATION_CONCURRENCY = 8
+NOTIFICATION_RATE = 20
+SEND_ATTEMPTS = 3
+PROGRESS_LOG_INTERVAL = 30
 CONTINUE_EDU_KEYBOARD = InlineKeyboardMarkup(
     inline_keyboard=[
         [InlineKeyboardButton(text="Продолжить обучение", callback_data="start")],
@@ -33,98 +46,196 @@ def _build_stats() -> dict[str, int]:
     return {
         "processed": 0,
         "skipped": 0,
+        "postponed": 0,
         "sent": 0,
         "errors": 0,
+        "retries": 0,
     }
 
 
-async def run_inactivity_notifications_once(bot: Bot) -> dict[str, int]:
+def _plan(due_at: datetime | None, user_id: int) -> datetime | None:
+    return shift_into_send_window(due_at, user_id) if due_at is not None else None
+
+
+async def _flush_schedule(schedule: dict[int, tuple[int | None, datetime | None]]) -> None:
+    if not schedule:
+        return
+    # Забираем пачку до await: остальные отправители продолжают дописывать в schedule
+    batch = dict(schedule)
+    schedule.clear()
+    try:
+        async with async_session_factory() as session:
+            await update_notification_schedule(session, batch)
+            await session.commit()
+    except Exception:
+        logger.exception("Failed to store notification schedule for %s users", len(batch))
+
+
+async def _send_notification(
+    bot: Bot,
+    bucket: TokenBucket,
+    candidate: NotificationCandidate,
+    message: str,
+    stats: dict[str, int],
+) -> None:
+    for attempt in range(SEND_ATTEMPTS):
+        await bucket.acquire()
+        try:
+            await bot.send_message(
+                chat_id=candidate.tg_user_id,
+                text=message,
+                reply_markup=CONTINUE_EDU_KEYBOARD,
+            )
+                # await bot.send_photo( # пример отправки сообщения с фото, пока что не используется.
+                #     chat_id=candidate.tg_user_id,
+                #     photo=FSInputFile(NOTIFICATION_PHOTO_PATH),
+                #     caption=message,
+                #     reply_markup=CONTINUE_EDU_KEYBOARD,
+                # )
+            return
+        except TelegramRetryAfter as error:
+            if attempt == SEND_ATTEMPTS - 1:
+                raise
+            # Флуд-контроль общий для бота: притормаживаем всех отправителей
+            bucket.pause(float(error.retry_after))
+            stats["retries"] += 1
+        except (TelegramNetworkError, TelegramServerError):
+            if attempt == SEND_ATTEMPTS - 1:
+                raise
+            stats["retries"] += 1
+            await asyncio.sleep(2 ** attempt)
+
+
+async def run_inactivity_notifications_once(
+    bot: Bot,
+    *,
+    user_ids: Sequence[int] | None = None,
+    now: datetime | None = None,
+    limit: int | None = None,
+    concurrency: int = NOTIFICATION_CONCURRENCY,
+    rate: float = NOTIFICATION_RATE,
+    bucket: TokenBucket | None = None,
+) -> dict[str, int]:
+    """Обрабатывает пользователей с подошедшим next_notification_at.
+
+    Каждому обработанному записываются стадия и срок следующего пересмотра, поэтому
+    повторно он попадёт в выборку только когда пересечёт следующий порог.
+    Планировщик передаёт свой bucket, общий для всех запусков; без него темп rate
+    действует только в пределах этого вызова.
+    """
     stats = _build_stats()
-    now_utc = datetime.utcnow()
+    now_utc = now or datetime.utcnow()
 
+    # Сессия нужна только на время выборки, отправка идёт без открытой транзакции
     async with async_session_factory() as session:
-        users = await get_notification_candidates(session)
-
-        for user in users:
+        candidates = await get_due_notifications(session, now_utc, user_ids=user_ids, limit=limit)
+
+    total = len(candidates)
+    if not total:
+        return stats
+    logger.info("Inactivity notifications run started: candidates=%s", total)
+    bucket = bucket or TokenBucket(rate)
+    schedule: dict[int, tuple[int | None, datetime | None]] = {}
+    queue = iter(candidates)
+    started_at = time.monotonic()
+    logged_at = started_at
+
+    async def process(candidate: NotificationCandidate) -> None:
+        user_id = candidate.user_id
+        target_stage = candidate.target_stage
+        current_stage = candidate.notification_stage
+
+        if candidate.exam_completed:
+            schedule[user_id] = (current_stage, None)
+            stats["skipped"] += 1
+            return
+
+        if current_stage is not None and target_stage < current_stage:
+            current_stage = None
+
+        if target_stage == 0 or not should_send(current_stage, target_stage):
+            next_at = resolve_next_due_at(candidate.activity_at, current_stage, target_stage)
+            schedule[user_id] = (current_stage, _plan(next_at, user_id))
+            stats["skipped"] += 1
+            return
+
+        if not in_send_window(now_utc):
+            schedule[user_id] = (current_stage, shift_into_send_window(now_utc, user_id))
+            stats["postponed"] += 1
+            return
+
+        message = get_background_message(target_stage)
+        if not message:
+            logger.error(
+                "Missing inactivity template for stage=%s user_id=%s",
+                target_stage,
+                user_id,
+            )
+            schedule[user_id] = (current_stage, _plan(now_utc + RETRY_DELAY, user_id))
+            stats["errors"] += 1
+            return
+
+        try:
+            await _send_notification(bot, bucket, candidate, message, stats)
+        except Exception:
+            logger.exception(
+                "Failed to send inactivity message user_id=%s tg_user_id=%s stage=%s",
+                user_id,
+                candidate.tg_user_id,
+                target_stage,
+            )
+            schedule[user_id] = (current_stage, _plan(now_utc + RETRY_DELAY, user_id))
+            stats["errors"] += 1
+            return
+
+        next_at = resolve_next_due_at(candidate.activity_at, target_stage, target_stage)
+        schedule[user_id] = (target_stage, _plan(next_at, user_id))
+        stats["sent"] += 1
+
+    async def sender() -> None:
+        nonlocal logged_at
+        for candidate in queue:
             stats["processed"] += 1
             try:
-                last_result = await get_last_lesson_result(session, user.id)
-                last_started_at = last_result.started_at if last_result is not None else None
-                last_completed_at = last_result.completed_at if last_result is not None else None
-
-                activity_at = resolve_activity_at(
-                    user_created_at=user.created_at,
-                    last_started_at=last_started_at,
-                    last_completed_at=last_completed_at,
-                )
-                elapsed = now_utc - activity_at
-                target_stage = resolve_target_stage(elapsed)
-                current_stage = user.notification_stage
-
-                if current_stage is not None and target_stage < current_stage:
-                    await update_notification_stage(session, user.id, None)
-                    await session.commit()
-                    current_stage = None
-                    user.notification_stage = None
-
-                if target_stage == 0:
-                    stats["skipped"] += 1
-                    continue
-
-                if not should_send(current_stage, target_stage):
-                    stats["skipped"] += 1
-                    continue
-
-                message = get_background_message(target_stage)
-                if not message:
-                    logger.error(
-                        "Missing inactivity template for stage=%s user_id=%s",
-                        target_stage,
-                        user.id,
-                    )
-                    stats["errors"] += 1
-                    continue
-
-                try:
-                    if user.tg_user_id is not None:
-                        await bot.send_message(
-                            chat_id=user.tg_user_id,
-                            text=message,
-                            reply_markup=CONTINUE_EDU_KEYBOARD,
-                        )
-                            # await bot.send_photo( # пример отправки сообщения с фото, пока что не используется.
-                            #     chat_id=user.tg_user_id,
-                            #     photo=FSInputFile(NOTIFICATION_PHOTO_PATH),
-                            #     caption=message,
-                            #     reply_markup=CONTINUE_EDU_KEYBOARD,
-                            # )
-                except Exception:
-                    logger.exception(
-                        "Failed to send inactivity message user_id=%s tg_user_id=%s stage=%s",
-                        user.id,
-                        user.tg_user_id,
-                        target_stage,
-                    )
-                    stats["errors"] += 1
-                    continue
-
-                await update_notification_stage(session, user.id, target_stage)
-                await session.commit()
-                user.notification_stage = target_stage
-                stats["sent"] += 1
+                await process(candidate)
             except Exception:
-                await session.rollback()
                 logger.exception(
                     "Unexpected error while processing inactivity notifications for user_id=%s",
-                    user.id,
+                    candidate.user_id,
+                )
+                # Без записи срок остаётся в прошлом, и пользователь падал бы на каждом проходе
+                schedule[candidate.user_id] = (
+                    candidate.notification_stage,
+                    _plan(now_utc + RETRY_DELAY, candidate.user_id),
                 )
                 stats["errors"] += 1
+            if len(schedule) >= STAGE_UPDATE_BATCH_SIZE:
+                await _flush_schedule(schedule)
+            if time.monotonic() - logged_at >= PROGRESS_LOG_INTERVAL:
+                logged_at = time.monotonic()
+                logger.info(
+                    "Inactivity notifications progress: %s/%s sent=%s errors=%s retries=%s",
+                    stats["processed"],
+                    total,
+                    stats["sent"],
+                    stats["errors"],
+                    stats["retries"],
+                )
+
+    try:
+        await asyncio.gather(*(sender() for _ in range(max(min(concurrency, total), 1))))
+    finally:
+        await _flush_schedule(schedule)
 
     logger.info(
-        "Inactivity notifications run finished: processed=%s skipped=%s sent=%s errors=%s",
+        "Inactivity notifications run finished: processed=%s skipped=%s postponed=%s sent=%s errors=%s "
+        "retries=%s in %.1fs",
         stats["processed"],
         stats["skipped"],
+        stats["postponed"],
         stats["sent"],
         stats["errors"],
+        stats["retries"],
+        time.monotonic() - started_at,
     )
     return stats
@@ -1,55 +1,108 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
 import logging
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
 
 from aiogram import Bot
 
-from service.background_notifications.runner import run_inactivity_notifications_once
+from db import async_session_factory
+from service.background_notifications.repository import get_upcoming_notifications
+from service.background_notifications.rules import MOSCOW_TZ, SEND_WINDOW_END, SEND_WINDOW_START
+from service.background_notifications.runner import NOTIFICATION_RATE, run_inactivity_notifications_once
+from service.rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
-MOSCOW_TZ = ZoneInfo("Europe/Moscow")
-RUN_HOUR = 16
-RUN_MINUTE = 0
+# Очередь пополняется из БД раз в REFRESH_INTERVAL на LOOKAHEAD вперёд: так подхватываются
+# пользователи, которых бот поставил в очередь после своей активности
+LOOKAHEAD = timedelta(minutes=10)
+REFRESH_INTERVAL = timedelta(minutes=1)
+HEAP_LIMIT = 5000
+DISPATCH_BATCH_SIZE = 200
 
 
-def _seconds_until_next_run(now: datetime) -> float:
-    next_run = now.replace(
-        hour=RUN_HOUR,
-        minute=RUN_MINUTE,
-        second=0,
-        microsecond=0,
-    )
-    if now > next_run:
-        next_run += timedelta(days=1)
-    return max((next_run - now).total_seconds(), 0.0)
+class NotificationQueue:
+    """Min-heap сроков next_notification_at ближайших пользователей."""
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[datetime, int]] = []
+        self._due: dict[int, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def push(self, due_at: datetime, user_id: int) -> None:
+        if self._due.get(user_id) == due_at:
+            return
+        # Старую запись не ищем в куче: она станет неактуальной и отбросится при pop
+        self._due[user_id] = due_at
+        heapq.heappush(self._heap, (due_at, user_id))
+
+    def next_due_at(self) -> datetime | None:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime, limit: int) -> list[int]:
+        user_ids: list[int] = []
+        while len(user_ids) < limit:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, user_id = heapq.heappop(self._heap)
+            del self._due[user_id]
+            user_ids.append(user_id)
+        return user_ids
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+
+async def _refresh(queue: NotificationQueue, now: datetime) -> None:
+    async with async_session_factory() as session:
+        upcoming = await get_upcoming_notifications(session, now + LOOKAHEAD, HEAP_LIMIT)
+    for due_at, user_id in upcoming:
+        queue.push(due_at, user_id)
 
 
 async def _scheduler_loop(bot: Bot) -> None:
     logger.info(
-        "Inactivity scheduler started. timezone=%s run_time=%02d:%02d",
+        "Inactivity scheduler started. timezone=%s send_window=%s-%s",
         MOSCOW_TZ.key,
-        RUN_HOUR,
-        RUN_MINUTE,
+        SEND_WINDOW_START.strftime("%H:%M"),
+        SEND_WINDOW_END.strftime("%H:%M"),
     )
+    queue = NotificationQueue()
+    # Один бакет на весь планировщик: частые мелкие запуски не обнуляют темп и паузу флуд-контроля
+    bucket = TokenBucket(NOTIFICATION_RATE)
+    refresh_at = datetime.min
     try:
         while True:
-            now = datetime.now(MOSCOW_TZ)
-            sleep_seconds = _seconds_until_next_run(now)
-            next_run_at = now + timedelta(seconds=sleep_seconds)
-            logger.info("Next inactivity notifications run at %s", next_run_at.isoformat())
-
-            await asyncio.sleep(sleep_seconds)
-
-            try:
-                await run_inactivity_notifications_once(bot)
-            except asyncio.CancelledError:
-                raise
-            except Exception:
-                logger.exception("Unhandled error in inactivity notifications run")
+            now = datetime.utcnow()
+            if now >= refresh_at:
+                try:
+                    await _refresh(queue, now)
+                except Exception:
+                    logger.exception("Could not load upcoming inactivity notifications")
+                refresh_at = now + REFRESH_INTERVAL
+
+            user_ids = queue.pop_due(now, DISPATCH_BATCH_SIZE)
+            if user_ids:
+                try:
+                    # Сроки перепроверяются в БД: пользователь мог вернуться к обучению
+                    await run_inactivity_notifications_once(
+                        bot, user_ids=user_ids, now=now, bucket=bucket
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Unhandled error in inactivity notifications run")
+                continue
+
+            wake_at = min(filter(None, (queue.next_due_at(), refresh_at)))
+            await asyncio.sleep(max((wake_at - datetime.utcnow()).total_seconds(), 0.0))
     except asyncio.CancelledError:
         logger.info("Inactivity scheduler stopped")
         raise
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from db.models import HpLessonResult, UserProgress
+from service.questions_lexicon import lessons
+
+# Бит пройденного урока в user_progress.completed_mask - по порядку уроков в меню
+LESSON_BITS: dict[str, int] = {lesson['title']: 1 << index for index, lesson in enumerate(lessons)}
+PROGRESS_CACHE_TTL = 300
+# Ключ Session.info: биты, которые попадут в кэш только после коммита
+_STAGED_BITS = "progress_staged_bits"
+
+
+def is_completed(mask: int, lesson_key: str) -> bool:
+    bit = LESSON_BITS.get(lesson_key)
+    return bit is not None and bool(mask & bit)
+
+
+class ProgressCache:
+    """Маски прогресса в памяти процесса.
+
+    Завершение урока дописывает бит в кэш после коммита транзакции, TTL страхует
+    от записей из других процессов.
+    """
+
+    def __init__(self, ttl: float = PROGRESS_CACHE_TTL):
+        self.ttl = ttl
+        self._items: dict[int, tuple[int, float]] = {}
+
+    def get(self, user_id: int) -> int | None:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        mask, expires_at = item
+        if expires_at < time.monotonic():
+            del self._items[user_id]
+            return None
+        return mask
+
+    def set(self, user_id: int, mask: int) -> None:
+        self._items[user_id] = (mask, time.monotonic() + self.ttl)
+
+    def add_bits(self, user_id: int, bits: int) -> None:
+        mask = self.get(user_id)
+        if mask is not None:
+            self.set(user_id, mask | bits)
+
+    def invalidate(self, user_id: int) -> None:
+        self._items.pop(user_id, None)
+
+
+progress_cache = ProgressCache()
+
+
+def _upsert_bits(user_id: int, bits: int):
+    statement = insert(UserProgress).values(
+        user_id=user_id,
+        completed_mask=bits,
+        updated_at=datetime.utcnow(),
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[UserProgress.user_id],
+        set_={
+            "completed_mask": UserProgress.completed_mask.op("|")(statement.excluded.completed_mask),
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+
+
+async def get_completed_mask(session: AsyncSession, user_id: int) -> int:
+    """Маска пройденных уроков: из кэша или одним чтением по первичному ключу."""
+    mask = progress_cache.get(user_id)
+    if mask is None:
+        mask = await session.scalar(
+            select(UserProgress.completed_mask).where(UserProgress.user_id == user_id)
+        ) or 0
+        progress_cache.set(user_id, mask)
+    return mask
+
+
+async def merge_progress(session: AsyncSession, user_id: int, duplicate_user_id: int) -> None:
+    duplicate_mask = await session.scalar(
+        select(UserProgress.completed_mask).where(UserProgress.user_id == duplicate_user_id)
+    )
+    if duplicate_mask:
+        await session.execute(_upsert_bits(user_id, duplicate_mask))
+    progress_cache.invalidate(user_id)
+    progress_cache.invalidate(duplicate_user_id)
+
+
+@event.listens_for(HpLessonResult, "after_insert")
+@event.listens_for(HpLessonResult, "after_update")
+def _record_completed_lesson(mapper, connection, target: HpLessonResult) -> None:
+    """Пройденный урок попадает в user_progress в той же транзакции, что и результат."""
+    bit = LESSON_BITS.get(target.lesson_key)
+    if not target.compleat or bit is None:
+        return
+    connection.execute(_upsert_bits(target.user_id, bit))
+    session = object_session(target)
+    if session is None:
+        progress_cache.invalidate(target.user_id)
+        return
+    # Откат не должен оставить в кэше урок, которого нет в БД: кэш обновляется после коммита
+    staged = session.info.setdefault(_STAGED_BITS, {})
+    staged[target.user_id] = staged.get(target.user_id, 0) | bit
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_staged_bits(session: Session) -> None:
+    for user_id, bits in session.info.pop(_STAGED_BITS, {}).items():
+        progress_cache.add_bits(user_id, bits)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_staged_bits(session: Session) -> None:
+    session.info.pop(_STAGED_BITS, None)
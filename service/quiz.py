@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Mapping
+
+from service.questions_lexicon import (
+    explan,
+    questions_1,
+    questions_2,
+    questions_3,
+    questions_4,
+    questions_5,
+    questions_6,
+    questions_7,
+)
+
+ANSWERS_HEADER = '<b>Варианты ответов:</b>\n'
+# Ширина кнопки ответа фиксирована, см. service.service.pad_right
+BUTTON_PADDING = "\u2800" * 50
+
+Option = tuple[str, str, bool]
+
+
+@dataclass(frozen=True, slots=True)
+class Question:
+    """Вопрос теста, собранный из questions_lexicon при импорте.
+
+    Варианты ответа кодируются битами по порядку: correct_mask - набор верных
+    вариантов, render - готовые данные окна для обычного режима и этапа подтверждения.
+    В dialog_data ответ хранится той же маской выбранных вариантов.
+    """
+
+    state: str
+    key: str
+    number: int
+    title: str
+    options: tuple[Option, ...]
+    option_bits: Mapping[str, int]
+    correct_mask: int
+    multi: bool
+    render: Mapping[bool, Mapping[str, object]]
+
+    def selected_mask(self, option_ids: Iterable[str]) -> int:
+        mask = 0
+        for option_id in option_ids:
+            mask |= self.option_bits.get(option_id, 0)
+        return mask
+
+    def is_correct(self, selected: int) -> bool:
+        return selected == self.correct_mask
+
+    def is_answered(self, answer: object) -> bool:
+        # int - маска выбранных вариантов; dict {вариант: верно} - прежний формат dialog_data
+        return isinstance(answer, int) or (isinstance(answer, dict) and bool(answer))
+
+    def grade(self, answer: object) -> bool:
+        """Верен ли ответ из dialog_data["answers"]; пропущенный вопрос - неверно."""
+        if isinstance(answer, int):
+            return self.is_correct(answer)
+        return isinstance(answer, dict) and bool(answer) and all(answer.values())
+
+
+@dataclass(frozen=True, slots=True)
+class Quiz:
+    questions: tuple[Question, ...]
+    by_state: Mapping[str, Question]
+
+    @property
+    def total(self) -> int:
+        return len(self.questions)
+
+    def question(self, state: str) -> Question:
+        return self.by_state[state]
+
+
+def compile_question(state: str, data: dict, total: int, answers_header: str) -> Question:
+    options = tuple((title, option_id, is_correct) for title, option_id, is_correct in data['answers'])
+    option_bits = {option_id: 1 << index for index, (_, option_id, _) in enumerate(options)}
+    correct_mask = 0
+    for _, option_id, is_correct in options:
+        if is_correct:
+            correct_mask |= option_bits[option_id]
+    key = data['key']
+    number = int(key[1:])
+    text_answers = answers_header + "".join(
+        f'{index}) {title}\n\n' for index, (title, _, _) in enumerate(options, start=1)
+    )
+    base = {
+        "question_answers": tuple((title + BUTTON_PADDING, option_id, is_correct)
+                                  for title, option_id, is_correct in options),
+        "title": data['title'],
+        'quest_number': str(number),
+        'count_quest': str(total),
+        'text_answers': text_answers,
+        'multi': explan.get('multi'),
+        'radio': explan.get('radio'),
+        'dont_first_question': number != 1,
+        'dont_last_question': True,
+    }
+    render = {
+        confirm_stage: MappingProxyType({**base, 'confirm_stage': confirm_stage})
+        for confirm_stage in (False, True)
+    }
+    return Question(
+        state=state,
+        key=key,
+        number=number,
+        title=data['title'],
+        options=options,
+        option_bits=MappingProxyType(option_bits),
+        correct_mask=correct_mask,
+        # Несколько верных вариантов - вопрос с множественным выбором
+        multi=sum(1 for _, _, is_correct in options if is_correct) > 1,
+        render=MappingProxyType(render),
+    )
+
+
+def compile_quiz(questions: dict[str, dict], *, answers_header: str = ANSWERS_HEADER) -> Quiz:
+    compiled = tuple(
+        compile_question(state, data, len(questions), answers_header)
+        for state, data in questions.items()
+    )
+    return Quiz(
+        questions=tuple(sorted(compiled, key=lambda question: question.number)),
+        by_state=MappingProxyType({question.state: question for question in compiled}),
+    )
+
+
+quizzes: dict[str, Quiz] = {
+    'lesson_1': compile_quiz(questions_1, answers_header=ANSWERS_HEADER + '\n'),
+    'lesson_2': compile_quiz(questions_2),
+    'lesson_3': compile_quiz(questions_3),
+    'lesson_4': compile_quiz(questions_4),
+    'lesson_5': compile_quiz(questions_5),
+    'lesson_6': compile_quiz(questions_6),
+    'lesson_7': compile_quiz(questions_7),
+}
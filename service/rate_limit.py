@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше rate запросов в секунду, всплеск до capacity.
+
+    Один экземпляр делится между всеми вызывающими, поэтому лимит общий для процесса.
+    pause() задерживает всех ожидающих, например после 429 с Retry-After.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Ждёт свободный токен и возвращает время ожидания в секундах."""
+        waited = 0.0
+        # Очередь через lock сохраняет порядок вызывающих и не даёт им обгонять друг друга
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    delay = (tokens - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+
+    def pause(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        # После паузы начинаем с пустого бакета, чтобы не выстрелить всплеском сразу
+        self._tokens = 0.0
+        self._updated_at = max(self._updated_at, self._paused_until)
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.models import HpLessonResult, User
+from service.reports import Report, data_version, write_report
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_TTL = 300
+# Сколько завершённое задание доступно по id, если по отчёту уже есть задание новее
+JOB_RETENTION = 3600
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_EMPTY = "empty"
+STATUS_FAILED = "failed"
+
+Subscriber = Callable[["ReportJob"], Awaitable[None]]
+
+# Изменения через ORM в этом процессе: проверяются в памяти до запроса водяного знака в БД
+_local_version = 0
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+@event.listens_for(HpLessonResult, "after_insert")
+@event.listens_for(HpLessonResult, "after_update")
+@event.listens_for(HpLessonResult, "after_delete")
+def _bump_local_version(mapper, connection, target) -> None:
+    global _local_version
+    _local_version += 1
+
+
+@dataclass(slots=True, eq=False)
+class ReportJob:
+    id: str
+    report: Report
+    status: str = STATUS_PENDING
+    # Записано строк данных: растёт по ходу выгрузки
+    rows: int = 0
+    path: Path | None = None
+    version: tuple | None = None
+    # Файл взят из предыдущего задания без повторной выгрузки
+    cached: bool = False
+    error: str | None = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    built_at: float | None = None
+    finished_at: float | None = None
+    subscribers: list[Subscriber] = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_DONE, STATUS_EMPTY, STATUS_FAILED)
+
+
+class ReportJobManager:
+    """Фоновые выгрузки отчётов для админки бота и веб-админки.
+
+    Запрос получает задание с id и сразу возвращается. Пока отчёт собирается,
+    повторные запросы того же отчёта подписываются на идущее задание. Готовый файл
+    переиспользуется ttl секунд, если не изменился водяной знак данных. Сначала
+    в памяти проверяются TTL и локальные правки, и только потом дешёвый data_version.
+    Подписчики вызываются после завершения задания - так бот присылает файл в чат.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        directory: Path,
+        *,
+        ttl: float = REPORT_CACHE_TTL,
+    ):
+        self.session_factory = session_factory
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self._jobs: dict[str, ReportJob] = {}
+        # Последнее задание по каждому отчёту: идущее или источник кэша
+        self._latest: dict[str, ReportJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def get(self, job_id: str) -> ReportJob | None:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list[ReportJob]:
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def submit(self, report: Report, *, subscriber: Subscriber | None = None) -> ReportJob:
+        self._prune()
+        latest = self._latest.get(report.name)
+        if latest is not None and not latest.finished:
+            if subscriber is not None:
+                latest.subscribers.append(subscriber)
+            return latest
+
+        job = ReportJob(id=uuid.uuid4().hex, report=report)
+        if subscriber is not None:
+            job.subscribers.append(subscriber)
+        self._jobs[job.id] = job
+        self._latest[report.name] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job, latest), name=f"report-{report.name}")
+        return job
+
+    async def wait(self, job: ReportJob) -> ReportJob:
+        task = self._tasks.get(job.id)
+        if task is not None:
+            await asyncio.shield(task)
+        return job
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        for path in {job.path for job in self._jobs.values() if job.path is not None}:
+            path.unlink(missing_ok=True)
+        self._jobs.clear()
+        self._latest.clear()
+
+    def _may_reuse(self, job: ReportJob | None, local_version: int) -> bool:
+        """Проверка без БД: задание успешно, TTL не истёк и этот процесс данные не менял."""
+        return (
+            job is not None
+            and job.status in (STATUS_DONE, STATUS_EMPTY)
+            and job.version[0] == local_version
+            and time.monotonic() - job.built_at < self.ttl
+        )
+
+    async def _run(self, job: ReportJob, previous: ReportJob | None) -> None:
+        def progress(rows: int) -> None:
+            job.rows = rows
+
+        try:
+            async with self.session_factory() as session:
+                # Версия берётся до выгрузки: правка во время записи файла сделает его устаревшим
+                local_version = _local_version
+                version = (local_version, await data_version(session))
+                if self._may_reuse(previous, local_version) and previous.version == version:
+                    job.path, job.rows, job.built_at = previous.path, previous.rows, previous.built_at
+                    job.cached = True
+                else:
+                    job.status = STATUS_RUNNING
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    path = self.directory / f"{job.id}.xlsx"
+                    job.rows = await write_report(session, job.report, path, progress=progress)
+                    job.path = path if job.rows else None
+                    job.built_at = time.monotonic()
+                job.version = version
+                job.status = STATUS_DONE if job.rows else STATUS_EMPTY
+        except asyncio.CancelledError:
+            job.status = STATUS_FAILED
+            raise
+        except Exception as exc:
+            logger.exception("Не удалось сформировать отчёт %s", job.report.name)
+            job.status = STATUS_FAILED
+            job.error = str(exc)
+        finally:
+            job.finished_at = time.monotonic()
+            self._tasks.pop(job.id, None)
+
+        logger.info("Отчёт %s: %s, строк %s%s", job.report.name, job.status, job.rows,
+                    " (из кэша)" if job.cached else "")
+        for subscriber in job.subscribers:
+            try:
+                await subscriber(job)
+            except Exception:
+                logger.exception("Не удалось доставить отчёт %s", job.report.name)
+        job.subscribers.clear()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        expired = [
+            job for job in self._jobs.values()
+            if job.finished
+            and job is not self._latest.get(job.report.name)
+            and now - job.finished_at > JOB_RETENTION
+        ]
+        for job in expired:
+            del self._jobs[job.id]
+        in_use = {job.path for job in self._jobs.values()}
+        for path in {job.path for job in expired} - in_use:
+            if path is not None:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+from dataclasses import dataclass
+from os import PathLike
+from typing import Any, Callable, Sequence
+
+from openpyxl import Workbook
+from sqlalchemy import Select, and_, func, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import HpLessonResult, User
+
+# Строк за один fetch серверного курсора и за одну передачу в поток записи
+REPORT_BATCH_SIZE = 1000
+
+
+@dataclass(frozen=True, slots=True)
+class Report:
+    """Выгрузка в xlsx: запрос, шапка и преобразование строки результата в строку листа."""
+
+    name: str
+    caption: str
+    empty_text: str
+    headers: tuple[str, ...]
+    statement: Callable[[], Select]
+    row: Callable[[Row], list[Any]]
+
+    def filename(self) -> str:
+        return f"{self.name}_{datetime.datetime.utcnow():%Y%m%d_%H%M%S}.xlsx"
+
+
+def fmt_dt(value: datetime.datetime | None) -> str:
+    if value is None:
+        return ""
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def nullable(value):
+    return value if value is not None else ""
+
+
+def _users_results_statement() -> Select:
+    # Пользователь без завершённых уроков даёт одну строку с пустыми полями урока
+    return (
+        select(
+            User.id,
+            User.tg_user_id,
+            User.max_user_id,
+            User.notification_stage,
+            User.username,
+            User.first_name,
+            User.last_name,
+            User.phone_number,
+            User.amo_contact_id,
+            User.amo_deal_id,
+            HpLessonResult.id.label("lesson_id"),
+            HpLessonResult.lesson_key,
+            HpLessonResult.score,
+            HpLessonResult.compleat,
+            HpLessonResult.started_at,
+            HpLessonResult.completed_at,
+        )
+        .outerjoin(
+            HpLessonResult,
+            and_(HpLessonResult.user_id == User.id, HpLessonResult.completed_at.is_not(None)),
+        )
+        .order_by(User.id, HpLessonResult.id)
+    )
+
+
+def _users_results_row(row: Row) -> list[Any]:
+    return [
+        row.id,
+        nullable(row.tg_user_id),
+        nullable(row.max_user_id),
+        nullable(row.notification_stage),
+        row.username or "",
+        row.first_name or "",
+        row.last_name or "",
+        row.phone_number or "",
+        nullable(row.amo_contact_id),
+        nullable(row.amo_deal_id),
+        nullable(row.lesson_id),
+        row.lesson_key or "",
+        nullable(row.score),
+        nullable(row.compleat),
+        fmt_dt(row.started_at),
+        fmt_dt(row.completed_at),
+    ]
+
+
+def _employment_type_statement() -> Select:
+    completed_lessons = (
+        select(
+            HpLessonResult.user_id,
+            func.count(HpLessonResult.id).label("completed_lessons_count"),
+        )
+        .where(HpLessonResult.compleat.is_(True))
+        .group_by(HpLessonResult.user_id)
+        .subquery()
+    )
+    return (
+        select(
+            User.tg_user_id,
+            User.max_user_id,
+            User.client_type,
+            User.created_at,
+            User.amo_contact_id,
+            User.amo_deal_id,
+            func.coalesce(completed_lessons.c.completed_lessons_count, 0).label("completed_lessons_count"),
+        )
+        .outerjoin(completed_lessons, completed_lessons.c.user_id == User.id)
+        .where(
+            User.client_type.is_not(None),
+            User.client_type != "",
+        )
+        .order_by(User.id)
+    )
+
+
+def _employment_type_row(row: Row) -> list[Any]:
+    contact_link = ""
+    if row.amo_contact_id is not None:
+        contact_link = f"https://hite.amocrm.ru/contacts/detail/{row.amo_contact_id}"
+
+    deal_link = ""
+    if row.amo_deal_id is not None:
+        deal_link = f"https://hite.amocrm.ru/leads/detail/{row.amo_deal_id}"
+
+    return [
+        nullable(row.tg_user_id),
+        nullable(row.max_user_id),
+        row.client_type or "",
+        fmt_dt(row.created_at),
+        contact_link,
+        deal_link,
+        row.completed_lessons_count,
+    ]
+
+
+USERS_RESULTS = Report(
+    name="users_results",
+    caption="Таблица пользователей и результатов",
+    empty_text="Пользователи в БД не найдены.",
+    headers=(
+        "user_id",
+        "tg_id",
+        "max_user_id",
+        "notification_stage",
+        "username",
+        "first_name",
+        "last_name",
+        "phone_number",
+        "amo_contact_id",
+        "amo_deal_id",
+        "lesson_id",
+        "lesson_key",
+        "score",
+        "compleat",
+        "started_at",
+        "completed_at",
+    ),
+    statement=_users_results_statement,
+    row=_users_results_row,
+)
+
+EMPLOYMENT_TYPE = Report(
+    name="employment_type",
+    caption="Тип занятости",
+    empty_text="Пользователи с заполненным типом занятости не найдены.",
+    headers=(
+        "ID в ТГ",
+        "ID в MAX",
+        "Кто вы?",
+        "Дата создания",
+        "Ссылка на контакт",
+        "Ссылка на сделку",
+        "Пройдено уроков",
+    ),
+    statement=_employment_type_statement,
+    row=_employment_type_row,
+)
+
+
+REPORTS: dict[str, Report] = {report.name: report for report in (USERS_RESULTS, EMPLOYMENT_TYPE)}
+
+
+async def data_version(session: AsyncSession) -> tuple:
+    """Водяной знак данных выгрузок из БД, включая записи других процессов.
+
+    Только max() по индексированным колонкам: без полного прохода по таблицам.
+    Новые строки поднимают max(id), правки через ORM и Core поднимают max(updated_at).
+    Удаление строк водяной знак не меняет - его покрывает TTL кэша отчётов.
+    """
+    result = await session.execute(
+        select(
+            select(func.max(User.id)).scalar_subquery(),
+            select(func.max(User.updated_at)).scalar_subquery(),
+            select(func.max(HpLessonResult.id)).scalar_subquery(),
+            select(func.max(HpLessonResult.updated_at)).scalar_subquery(),
+        )
+    )
+    return tuple(result.one())
+
+
+def _append_rows(sheet, rows: Sequence[list[Any]]) -> None:
+    for row in rows:
+        sheet.append(row)
+
+
+async def write_report(
+    session: AsyncSession,
+    report: Report,
+    path: str | PathLike[str],
+    *,
+    batch_size: int = REPORT_BATCH_SIZE,
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """Пишет выгрузку в path и возвращает число строк данных; при 0 файл не создаётся.
+
+    Строки читаются серверным курсором пачками по batch_size, лист в режиме write_only
+    сбрасывает каждую строку на диск, поэтому память не растёт с размером таблицы.
+    Запись xlsx идёт в потоке, цикл событий бота остаётся свободным.
+    progress получает число записанных строк после каждой пачки.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = None
+    written = 0
+    result = await session.stream(report.statement().execution_options(yield_per=batch_size))
+    async for partition in result.partitions():
+        rows = [report.row(row) for row in partition]
+        if sheet is None:
+            sheet = workbook.create_sheet(report.name)
+            rows.insert(0, list(report.headers))
+        await asyncio.to_thread(_append_rows, sheet, rows)
+        written += len(partition)
+        if progress is not None:
+            progress(written)
+    if sheet is not None:
+        await asyncio.to_thread(workbook.save, path)
+    return written
@@ -1,11 +1,12 @@
 import logging
 
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import async_session_factory
-from db.models import User, HpLessonResult as LessonResult
+from db.models import User
+from service.progress import get_completed_mask, is_completed
 from service.questions_lexicon import lessons
+from service.quiz import Question, Quiz
 
 logger = logging.getLogger(__name__)
 
@@ -14,77 +15,59 @@ def pad_right(s: str, width: int) -> str:
     # поэтому лучше NBSP (неразрывный пробел)
     return s + ("\u2800" * 50)
 
-def format_results(answers: dict, total_questions: int) -> str:
-    def q_num(q_key: str) -> int:
-        return int(q_key[1:])  # 'q10' -> 10
+def _is_answered(answers: dict, question: Question) -> bool:
+    return question.is_answered(answers.get(question.key))
 
-    lines = []
-    correct_cnt = 0
 
-    for n in range(1, total_questions + 1):
-        q_key = f"q{n}"
+def _is_correct(answers: dict, question: Question) -> bool:
+    return question.grade(answers.get(question.key))
 
-        # пропущенный вопрос = неверно
-        if q_key not in answers or not isinstance(answers.get(q_key), dict) or not answers[q_key]:
-            is_correct = False
-        else:
-            is_correct = all(answers[q_key].values())
 
-        if is_correct:
-            correct_cnt += 1
+def _score(answers: dict, quiz: Quiz) -> tuple[int, float]:
+    correct_cnt = sum(1 for question in quiz.questions if _is_correct(answers, question))
+    percent = round((correct_cnt / quiz.total) * 100, 1) if quiz.total else 0.0
+    return correct_cnt, percent
 
-        status = "✅ Верно" if is_correct else "❌ Не верно"
-        lines.append(f"Вопрос {n} - {status};")
 
-    percent = round((correct_cnt / total_questions) * 100, 1) if total_questions else 0.0
+def format_results(answers: dict, quiz: Quiz) -> str:
+    lines = [
+        f"Вопрос {question.number} - {'✅ Верно' if _is_correct(answers, question) else '❌ Не верно'};"
+        for question in quiz.questions
+    ]
+    correct_cnt, percent = _score(answers, quiz)
     passed = percent > 80  # строго "более 80", как ты написал
 
     lines.append("")
-    lines.append(f"Верных ответов: {correct_cnt}/{total_questions} ({percent}%)")
+    lines.append(f"Верных ответов: {correct_cnt}/{quiz.total} ({percent}%)")
     lines.append("Урок пройден ✅" if passed else "Урок не пройден ❌")
 
     return "\n".join(lines)
 
 
-def format_progress(answers: dict, total_questions: int) -> str:
+def _missed_numbers(answers: dict, quiz: Quiz) -> list[int]:
+    return [question.number for question in quiz.questions if not _is_answered(answers, question)]
+
+
+def format_progress(answers: dict, quiz: Quiz) -> str:
     """
-    answers: {'q1': {'вариант': True/False, ...}, ...}
-    total_questions: общее число вопросов (например 23)
+    answers: {'q1': маска выбранных вариантов, ...}
+    quiz: скомпилированный тест урока (service.quiz)
 
-    Отвечен, если есть хотя бы один True.
+    Отвечен, если есть ответ на вопрос.
     Пропущен, если:
       - нет ключа qN
-      - или answers[qN] пустой/не dict
-      - или все значения False
+      - или answers[qN] в прежнем формате пустой dict
     """
-    answered_nums = []
-    missed_nums = []
-
-    for n in range(1, total_questions + 1):
-        q_key = f"q{n}"
-        q_data = answers.get(q_key)
-
-        if not isinstance(q_data, dict) or not q_data:
-            missed_nums.append(n)
-            continue
-        else:
-            answered_nums.append(n)
-
-        # has_selection = any(bool(v) for v in q_data.values())
-        # (answered_nums if has_selection else missed_nums).append(n)
-
-    answered_cnt = len(answered_nums)
+    missed_nums = _missed_numbers(answers, quiz)
     missed_cnt = len(missed_nums)
-
-    def fmt_nums(nums: list[int]) -> str:
-        return ", ".join(map(str, nums)) if nums else "—"
+    answered_cnt = quiz.total - missed_cnt
 
     lines = [
         "🧾 Прогресс перед проверкой:",
-        f"✅ Отвечено: {answered_cnt}/{total_questions}",
-        f"❓ Пропущено: {missed_cnt}/{total_questions}",
+        f"✅ Отвечено: {answered_cnt}/{quiz.total}",
+        f"❓ Пропущено: {missed_cnt}/{quiz.total}",
         "",
-        f"Пропущенные вопросы: {fmt_nums(missed_nums)}",
+        f"Пропущенные вопросы: {', '.join(map(str, missed_nums)) if missed_nums else '—'}",
     ]
 
     # если есть пропуски — мягкий призыв
@@ -95,53 +78,16 @@ def format_progress(answers: dict, total_questions: int) -> str:
 
     return "\n".join(lines)
 
-async def count_missed_answers(answers: dict, total_questions: int) -> int:
-    answered_nums = []
-    missed_nums = []
-
-    for n in range(1, total_questions + 1):
-        q_key = f"q{n}"
-        q_data = answers.get(q_key)
-
-        if not isinstance(q_data, dict) or not q_data:
-            missed_nums.append(n)
-        else:
-            answered_nums.append(n)
-
-        # has_selection = any(bool(v) for v in q_data.values())
-        # (answered_nums if has_selection else missed_nums).append(n)
-
-    answered_cnt = len(answered_nums)
-    missed_cnt = len(missed_nums)
-
-    return missed_cnt
+async def count_missed_answers(answers: dict, quiz: Quiz) -> int:
+    return sum(1 for question in quiz.questions if not _is_answered(answers, question))
 
 
 # Функция обработки ответов и отправки результата
-def checking_result(answers: dict, total_questions: int) -> dict:
-    def q_num(q_key: str) -> int:
-        return int(q_key[1:])  # 'q10' -> 10
-
-    lines = []
-    correct_cnt = 0
-
-    for n in range(1, total_questions + 1):
-        q_key = f"q{n}"
-
-        # пропущенный вопрос = неверно
-        if q_key not in answers or not isinstance(answers.get(q_key), dict) or not answers[q_key]:
-            is_correct = False
-        else:
-            is_correct = all(answers[q_key].values())
-
-        if is_correct:
-            correct_cnt += 1
-
-
-    percent = int(round((correct_cnt / total_questions) * 100, 1) if total_questions else 0.0)
+def checking_result(answers: dict, quiz: Quiz) -> dict:
+    _, percent = _score(answers, quiz)
+    percent = int(percent)
     passed = percent >= 80  # строго "более 80", как ты написал
 
-
     return {
         'score': percent,
         'passed': passed,
@@ -163,19 +109,9 @@ async def get_lessons_buttons(user: User, session: AsyncSession) -> dict:
             "lesson_3": "🔒 Третий урок",
         }
 
-    result = await session.execute(
-        select(LessonResult)
-        .where(LessonResult.user_id == user.id)
-    )
-    lesson_results = result.scalars().all()
-
-    # completed = {"lesson_1": False, "lesson_2": False, "lesson_3": False}
-    completed = {lesson['title']: False for lesson in lessons}
-    for lesson in lesson_results:
-        if lesson.compleat and lesson.lesson_key in completed:
-            completed[lesson.lesson_key] = True
-            if all(completed.values()):
-                break
+    # Пройденные уроки - битовая маска из кэша или одно чтение user_progress по ключу
+    mask = await get_completed_mask(session, user.id)
+    completed = {lesson['title']: is_completed(mask, lesson['title']) for lesson in lessons}
 
     for index, lesson in enumerate(lessons):
         if index == 0:
@@ -217,16 +153,8 @@ async def lesson_access(user: User, session: AsyncSession, lesson_key: str) -> b
             required_key = lessons[index-1].get('title')
 
 
-    result = await session.execute(
-        select(LessonResult.id)
-        .where(
-            LessonResult.user_id == user.id,
-            LessonResult.lesson_key == required_key,
-            LessonResult.compleat.is_(True),
-        )
-        .limit(1)
-    )
-    return result.scalar_one_or_none() is not None
+    mask = await get_completed_mask(session, user.id)
+    return is_completed(mask, required_key)
 
 
 async def check_push_to_new_status(lesson_key: str, lead_status: int) -> bool:
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateWorkerPool:
+    """Пул обработчиков входящих апдейтов Telegram.
+
+    У каждого воркера своя ограниченная очередь; апдейты одного чата всегда попадают
+    к одному воркеру, поэтому внутри чата порядок сохраняется, а разные чаты
+    обрабатываются параллельно.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, *, workers: int = 8, queue_size: int = 1000):
+        if workers < 1:
+            raise ValueError("workers must be positive")
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        per_worker = max(queue_size // workers, 1)
+        self._queues: list[asyncio.Queue[Update]] = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+
+    @staticmethod
+    def shard_key(update: Update) -> int:
+        context = UserContextMiddleware.resolve_event_context(update)
+        if context.chat_id is not None:
+            return context.chat_id
+        if context.user_id is not None:
+            return context.user_id
+        return update.update_id
+
+    def queue_for(self, update: Update) -> asyncio.Queue[Update]:
+        return self._queues[self.shard_key(update) % self.workers]
+
+    async def put(self, update: Update, *, timeout: float | None = None) -> bool:
+        """Ставит апдейт в очередь его чата. False - очередь переполнена дольше timeout."""
+        queue = self.queue_for(update)
+        try:
+            if timeout is None:
+                await queue.put(update)
+            else:
+                await asyncio.wait_for(queue.put(update), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"telegram-update-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    async def stop(self, *, drain_timeout: float = 10) -> None:
+        if not self._tasks:
+            return
+        # Даём дообработать принятые апдейты: Telegram их уже не пришлёт повторно
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки %s апдейтов при остановке", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, queue: asyncio.Queue[Update]) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Ошибка обработки апдейта %s", update.update_id)
+            finally:
+                queue.task_done()
+
+
+def create_webhook_router(
+    pool: UpdateWorkerPool,
+    path: str,
+    secret: str,
+    *,
+    enqueue_timeout: float = 5,
+) -> APIRouter:
+    router = APIRouter()
+
+    @router.post(path, include_in_schema=False)
+    async def telegram_webhook(request: Request) -> Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secret or not hmac.compare_digest(token, secret):
+            return Response(status_code=401)
+        payload: dict[str, Any] = await request.json()
+        update = Update.model_validate(payload, context={"bot": pool.bot})
+        if not await pool.put(update, timeout=enqueue_timeout):
+            # Telegram повторит доставку позже, апдейт не теряется
+            logger.warning("Очередь апдейтов переполнена, апдейт %s отклонён", update.update_id)
+            return JSONResponse({"ok": False}, status_code=503)
+        return JSONResponse({"ok": True})
+
+    return router
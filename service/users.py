@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from db.models import HpLessonResult, User
+
+USER_CACHE_TTL = 60
+
+CacheKey = tuple[str, int]
+
+
+class UserCache:
+    """Снимки строк users в памяти процесса по tg_user_id и max_user_id.
+
+    Храним значения колонок, а не ORM-объекты: каждая сессия получает свой экземпляр.
+    Запись пользователя через ORM сбрасывает снимок (события ниже), TTL страхует
+    от изменений из других процессов и Core-запросов.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL):
+        self.ttl = ttl
+        self._items: dict[CacheKey, tuple[dict[str, Any], float]] = {}
+        self._keys: dict[int, set[CacheKey]] = {}
+
+    def get(self, key: CacheKey) -> dict[str, Any] | None:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        values, expires_at = item
+        if expires_at < time.monotonic():
+            self.invalidate(values["id"])
+            return None
+        return values
+
+    def set(self, user: User) -> None:
+        values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        self.invalidate(user.id)
+        expires_at = time.monotonic() + self.ttl
+        keys = {("tg", user.tg_user_id), ("max", user.max_user_id)}
+        keys = {key for key in keys if key[1] is not None}
+        for key in keys:
+            self._items[key] = (values, expires_at)
+        self._keys[user.id] = keys
+
+    def invalidate(self, user_id: int | None) -> None:
+        for key in self._keys.pop(user_id, ()):
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._keys.clear()
+
+
+user_cache = UserCache()
+
+
+async def get_user(
+    session: AsyncSession,
+    *,
+    tg_user_id: int | None = None,
+    max_user_id: int | None = None,
+) -> User | None:
+    """Пользователь по tg_user_id или max_user_id, привязанный к session.
+
+    При попадании в кэш объект собирается из снимка без запроса к БД.
+    """
+    if tg_user_id is not None:
+        key, column = ("tg", tg_user_id), User.tg_user_id
+    elif max_user_id is not None:
+        key, column = ("max", max_user_id), User.max_user_id
+    else:
+        raise ValueError("tg_user_id or max_user_id is required")
+
+    values = user_cache.get(key)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+
+    result = await session.execute(select(User).where(column == key[1]))
+    user = result.scalar_one_or_none()
+    if user is not None:
+        user_cache.set(user)
+    return user
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target: User) -> None:
+    user_cache.invalidate(target.id)
+
+
+@event.listens_for(HpLessonResult, "after_insert")
+@event.listens_for(HpLessonResult, "after_update")
+def _invalidate_lesson_user(mapper, connection, target: HpLessonResult) -> None:
+    # last_activity_at пользователя обновляется Core-запросом в db.models
+    user_cache.invalidate(target.user_id)
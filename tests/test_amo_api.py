@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from urllib.parse import unquote
+
+import jwt
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from amo_api.amo_api import AmoCRMWrapper
+
+
+def make_token(expires_in: int = 3600) -> str:
+    return jwt.encode({"exp": int(time.time()) + expires_in}, "secret", algorithm="HS256")
+
+
+def make_wrapper(server: TestServer, tmp_path, **kwargs) -> AmoCRMWrapper:
+    return AmoCRMWrapper(
+        path=str(tmp_path / ".env"),
+        amocrm_subdomain="test",
+        amocrm_client_id="client",
+        amocrm_client_secret="secret",
+        amocrm_redirect_url="https://example.com",
+        amocrm_access_token=kwargs.pop("access_token", make_token()),
+        amocrm_refresh_token="refresh",
+        amocrm_secret_code="code",
+        base_url=str(server.make_url("")),
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_requests_share_one_session_and_send_bearer_token(tmp_path) -> None:
+    seen_headers: list[str] = []
+
+    async def get_lead(request: web.Request) -> web.Response:
+        seen_headers.append(request.headers["Authorization"])
+        return web.json_response({"id": int(request.match_info["lead_id"]), "status_id": 47244117})
+
+    async def patch_lead(_: web.Request) -> web.Response:
+        return web.json_response({"id": 1})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/leads/{lead_id}", get_lead)
+    app.router.add_patch("/api/v4/leads/{lead_id}", patch_lead)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    try:
+        lead = await amo_api.get_lead_by_id(lead_id=7)
+        session = amo_api._session
+        pushed = await amo_api.push_lead_to_status(lead_id="7", pipeline_id=1, status_id=2)
+        assert amo_api._session is session
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert lead == {"id": 7, "status_id": 47244117}
+    assert pushed is True
+    assert seen_headers == [f"Bearer {amo_api.amocrm_access_token}"]
+
+
+@pytest.mark.asyncio
+async def test_contact_lookup_falls_back_to_number_with_eight(tmp_path) -> None:
+    queries: list[str] = []
+
+    async def contacts(request: web.Request) -> web.Response:
+        queries.append(request.query["query"])
+        if request.query["query"].startswith("8"):
+            return web.json_response({"_embedded": {"contacts": [{"id": 42}]}})
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_get("/api/v4/contacts", contacts)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    try:
+        found, contact = await amo_api.get_contact_by_phone("79990001122")
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert found is True
+    assert contact == {"id": 42}
+    assert queries == ["79990001122", "89990001122"]
+
+
+@pytest.mark.asyncio
+async def test_expired_token_is_refreshed_once_for_concurrent_requests(tmp_path) -> None:
+    refresh_calls = 0
+    new_token = make_token()
+
+    async def oauth(_: web.Request) -> web.Response:
+        nonlocal refresh_calls
+        refresh_calls += 1
+        await asyncio.sleep(0.05)
+        return web.json_response({"access_token": new_token, "refresh_token": "refresh-2"})
+
+    async def get_lead(request: web.Request) -> web.Response:
+        assert request.headers["Authorization"] == f"Bearer {new_token}"
+        return web.json_response({"id": 1})
+
+    app = web.Application()
+    app.router.add_post("/oauth2/access_token", oauth)
+    app.router.add_get("/api/v4/leads/{lead_id}", get_lead)
+    server = TestServer(app)
+    await server.start_server()
+    (tmp_path / ".env").write_text("BOT_TOKEN=abc\nAMOCRM_ACCESS_TOKEN='old'\n", encoding="utf-8")
+    amo_api = make_wrapper(server, tmp_path, access_token=make_token(expires_in=-10))
+    try:
+        leads = await asyncio.gather(*(amo_api.get_lead_by_id(lead_id=1) for _ in range(5)))
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert leads == [{"id": 1}] * 5
+    assert refresh_calls == 1
+    assert (tmp_path / ".env").read_text(encoding="utf-8").splitlines() == [
+        "BOT_TOKEN=abc",
+        f"AMOCRM_ACCESS_TOKEN='{new_token}'",
+        "AMOCRM_REFRESH_TOKEN='refresh-2'",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_lead_lookup_uses_direct_query_then_index(tmp_path) -> None:
+    requests_seen: list[str] = []
+    stage_lead = {
+        "id": 11,
+        "pipeline_id": 3616530,
+        "status_id": 47244117,
+        "_embedded": {"contacts": [{"id": 5, "is_main": True}]},
+    }
+
+    async def contact(request: web.Request) -> web.Response:
+        requests_seen.append(request.path)
+        return web.json_response({"id": 5, "_embedded": {"leads": [{"id": 10}, {"id": 11}]}})
+
+    async def leads(request: web.Request) -> web.Response:
+        requests_seen.append(request.path_qs)
+        if "filter[id][]" in request.query_string:
+            other = {"id": 10, "pipeline_id": 3616530, "status_id": 1, "_embedded": {"contacts": [{"id": 5}]}}
+            return web.json_response({"_embedded": {"leads": [other, stage_lead]}})
+        await asyncio.sleep(0.05)
+        return web.json_response({"_embedded": {"leads": [stage_lead]}})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/contacts/{contact_id}", contact)
+    app.router.add_get("/api/v4/leads", leads)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    try:
+        first = await amo_api.find_lead_by_contact_in_pipeline_stage_new("5", "3616530", "47244117")
+        index = amo_api.lead_index(3616530, 47244117)
+        while not index.ready:
+            await asyncio.sleep(0.01)
+        requests_before = len(requests_seen)
+        second = await amo_api.find_lead_by_contact_in_pipeline_stage_new("5", "3616530", "47244117")
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert first == second == 11
+    assert index.ready and len(index) == 1
+    assert len(requests_seen) == requests_before
+
+
+@pytest.mark.asyncio
+async def test_lead_leaving_pipeline_or_deleted_is_evicted_from_index(tmp_path) -> None:
+    moved = {"id": 11, "pipeline_id": 3616530, "status_id": 47244117,
+             "_embedded": {"contacts": [{"id": 5, "is_main": True}]}}
+    deleted = {"id": 12, "pipeline_id": 3616530, "status_id": 47244117,
+               "_embedded": {"contacts": [{"id": 6, "is_main": True}]}}
+    sync_queries: list[str] = []
+
+    stayed = {"id": 13, "pipeline_id": 3616530, "status_id": 47244117,
+              "_embedded": {"contacts": [{"id": 7, "is_main": True}]}}
+
+    async def leads(request: web.Request) -> web.Response:
+        if "filter[updated_at]" in request.query_string:
+            sync_queries.append(request.query_string)
+            # Ушедшая в другую воронку сделка 11 в выборку по воронке не попадает
+            return web.json_response({"_embedded": {"leads": [stayed]}})
+        return web.json_response({"_embedded": {"leads": [moved, deleted, stayed]}})
+
+    async def events(_: web.Request) -> web.Response:
+        return web.json_response({"_embedded": {"events": [
+            {"entity_id": 11, "type": "lead_status_changed"},
+            {"entity_id": 12, "type": "lead_deleted"},
+            {"entity_id": 13, "type": "lead_status_changed"},
+        ]}})
+
+    async def contact(_: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_get("/api/v4/leads", leads)
+    app.router.add_get("/api/v4/events", events)
+    app.router.add_get("/api/v4/contacts/{contact_id}", contact)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    try:
+        index = amo_api.lead_index(3616530, 47244117)
+        index.start()
+        while not index.ready:
+            await asyncio.sleep(0.01)
+        assert len(index) == 3
+
+        await index.refresh()
+        found_moved = await index.find(5)
+        found_deleted = await index.find(6)
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert "filter[pipeline_id][]=3616530" in unquote(sync_queries[0])
+    # Сделка 13 сменила этап и вернулась: выборка изменённых возвращает её в индекс
+    assert len(index) == 1
+    assert found_moved is None and found_deleted is None
+
+
+@pytest.mark.asyncio
+async def test_throttled_request_is_retried_after_retry_after(tmp_path) -> None:
+    attempts = 0
+
+    async def get_lead(_: web.Request) -> web.Response:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            return web.Response(status=429, headers={"Retry-After": "0.05"})
+        if attempts == 2:
+            return web.Response(status=502)
+        return web.json_response({"id": 1})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/leads/{lead_id}", get_lead)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path, backoff_base=0.01)
+    try:
+        lead = await amo_api.get_lead_by_id(lead_id=1)
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert lead == {"id": 1}
+    assert attempts == 3
+    metrics = amo_api.metrics.snapshot()
+    assert metrics["requests"] == 3
+    assert metrics["retries"] == 2
+    assert metrics["throttled"] == 1
+    assert metrics["server_errors"] == 1
+    assert metrics["failed"] == 0
+    assert amo_api.metrics_snapshot()["rate_limit"] == amo_api.rate_limiter.rate
+
+
+@pytest.mark.asyncio
+async def test_post_is_not_retried_on_server_error(tmp_path) -> None:
+    attempts = 0
+
+    async def notes(_: web.Request) -> web.Response:
+        nonlocal attempts
+        attempts += 1
+        return web.Response(status=500)
+
+    app = web.Application()
+    app.router.add_post("/api/v4/leads/notes", notes)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path, backoff_base=0.01)
+    try:
+        response = await amo_api._base_request(type="post", endpoint="/api/v4/leads/notes", data=[])
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert response.status_code == 500
+    assert attempts == 1
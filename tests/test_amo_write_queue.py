@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from amo_api.write_queue import (
+    KIND_CONTACT_FIELDS,
+    KIND_LEAD_FIELDS,
+    KIND_NOTE,
+    KIND_STATUS,
+    AmoWriteQueue,
+)
+from tests.test_amo_api import make_wrapper
+
+
+def make_row(row_id: int, kind: str, entity_id: int, payload: dict) -> SimpleNamespace:
+    return SimpleNamespace(id=row_id, kind=kind, entity_id=entity_id, payload=json.dumps(payload))
+
+
+@pytest.mark.asyncio
+async def test_send_coalesces_writes_into_batched_requests(tmp_path) -> None:
+    calls: list[tuple[str, str, object]] = []
+
+    async def notes(request: web.Request) -> web.Response:
+        calls.append(("POST", request.path, await request.json()))
+        return web.json_response({})
+
+    async def leads(request: web.Request) -> web.Response:
+        if request.method == "GET":
+            calls.append(("GET", request.path, request.query.getall("filter[id][]")))
+            return web.json_response({"_embedded": {"leads": [
+                {"id": 1, "status_id": 35444481},
+                {"id": 2, "status_id": 41608800},
+            ]}})
+        calls.append(("PATCH", request.path, await request.json()))
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post("/api/v4/leads/notes", notes)
+    app.router.add_route("*", "/api/v4/leads", leads)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    queue = AmoWriteQueue(amo_api, session_factory=None)
+    rows = [
+        make_row(1, KIND_NOTE, 1, {"text": "Результаты урока №2"}),
+        make_row(2, KIND_NOTE, 2, {"text": "Результаты урока №2"}),
+        make_row(3, KIND_STATUS, 1, {"pipeline_id": 3616530, "status_id": 35444484, "lesson_key": "compleat_lesson_2"}),
+        make_row(4, KIND_STATUS, 2, {"pipeline_id": 3616530, "status_id": 35444484, "lesson_key": "compleat_lesson_2"}),
+        make_row(5, KIND_LEAD_FIELDS, 1, {"custom_fields_values": [{"field_id": 10, "values": [{"value": "a"}]}]}),
+    ]
+    try:
+        failed = await queue.send(rows)
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert failed == {}
+    assert [call[0] for call in calls] == ["POST", "GET", "PATCH"]
+    assert [note["entity_id"] for note in calls[0][2]] == [1, 2]
+    assert sorted(calls[1][2]) == ["1", "2"]
+    # Сделка 2 уже дальше по воронке: её статус не трогаем, сделка 1 получает и этап, и поле
+    patch = calls[2][2]
+    assert len(patch) == 1
+    assert patch[0]["id"] == 1
+    assert patch[0]["status_id"] == 35444484
+    assert patch[0]["custom_fields_values"] == [{"field_id": 10, "values": [{"value": "a"}]}]
+
+
+@pytest.mark.asyncio
+async def test_send_reports_failed_batch(tmp_path) -> None:
+    async def notes(_: web.Request) -> web.Response:
+        return web.json_response({"title": "Bad Request"}, status=400)
+
+    app = web.Application()
+    app.router.add_post("/api/v4/leads/notes", notes)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    queue = AmoWriteQueue(amo_api, session_factory=None)
+    try:
+        failed = await queue.send([make_row(7, KIND_NOTE, 1, {"text": "x"})])
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert list(failed) == [7]
+    assert "400" in failed[7]
+
+
+@pytest.mark.asyncio
+async def test_rejected_batch_is_split_so_only_bad_lead_fails(tmp_path) -> None:
+    patched: list[list[int]] = []
+
+    async def leads(request: web.Request) -> web.Response:
+        ids = [update["id"] for update in await request.json()]
+        patched.append(ids)
+        # Сделка 2 удалена: amoCRM отклоняет любую пачку, где она есть
+        if 2 in ids:
+            return web.json_response({"title": "Bad Request"}, status=400)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_patch("/api/v4/leads", leads)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path)
+    queue = AmoWriteQueue(amo_api, session_factory=None)
+    fields = {"custom_fields_values": [{"field_id": 10, "values": [{"value": "a"}]}]}
+    rows = [make_row(row_id, KIND_LEAD_FIELDS, lead_id, fields) for row_id, lead_id in ((1, 1), (2, 2), (3, 3), (4, 2))]
+    try:
+        failed = await queue.send(rows)
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    assert sorted(failed) == [2, 4]
+    assert patched[0] == [1, 2, 3]
+    assert [1] in patched and [3] in patched
+
+
+@pytest.mark.asyncio
+async def test_throttled_batch_is_deferred_whole_without_splitting(tmp_path) -> None:
+    patched: list[list[int]] = []
+    contacts_called = False
+
+    async def leads(request: web.Request) -> web.Response:
+        patched.append([update["id"] for update in await request.json()])
+        return web.json_response({"title": "Too Many Requests"}, status=429)
+
+    async def contacts(_: web.Request) -> web.Response:
+        nonlocal contacts_called
+        contacts_called = True
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_patch("/api/v4/leads", leads)
+    app.router.add_patch("/api/v4/contacts", contacts)
+    server = TestServer(app)
+    await server.start_server()
+    amo_api = make_wrapper(server, tmp_path, max_retries=0)
+    queue = AmoWriteQueue(amo_api, session_factory=None)
+    fields = {"custom_fields_values": [{"field_id": 10, "values": [{"value": "a"}]}]}
+    rows = [
+        make_row(1, KIND_LEAD_FIELDS, 1, fields),
+        make_row(2, KIND_LEAD_FIELDS, 2, fields),
+        make_row(3, KIND_CONTACT_FIELDS, 5, fields),
+    ]
+    deferred: dict[int, str] = {}
+    try:
+        failed = await queue.send(rows, deferred)
+    finally:
+        await amo_api.close()
+        await server.close()
+
+    # Одна попытка без деления, контакты после 429 не отправляются вовсе
+    assert patched == [[1, 2]]
+    assert not contacts_called
+    assert failed == {}
+    assert sorted(deferred) == [1, 2, 3]
+    assert "429" in deferred[3]
@@ -0,0 +1,200 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from service.background_notifications import runner
+from service.background_notifications.repository import (
+    NotificationCandidate,
+    build_due_notifications_query,
+)
+from service.background_notifications.rules import (
+    in_send_window,
+    resolve_next_due_at,
+    resolve_target_stage,
+    shift_into_send_window,
+)
+from service.background_notifications.scheduler import NotificationQueue
+
+# 12:00 по Москве - внутри окна отправки
+NOON_UTC = datetime(2026, 8, 3, 9, 0)
+
+
+def test_due_query_reads_denormalized_activity_by_next_notification_at() -> None:
+    sql = str(build_due_notifications_query(NOON_UTC, limit=10).compile(dialect=postgresql.dialect()))
+
+    assert "coalesce(users.last_activity_at, users.created_at)" in sql
+    assert "users.next_notification_at <=" in sql
+    assert "lesson_results" in sql  # EXISTS по экзамену, без выборки уроков
+    assert "JOIN" not in sql
+
+
+def test_target_stage_thresholds() -> None:
+    assert [resolve_target_stage(timedelta(days=days)) for days in (1, 2, 6, 10, 30)] == [0, 1, 2, 3, 4]
+
+
+def test_next_due_is_the_next_threshold() -> None:
+    activity = datetime(2026, 8, 1)
+    assert resolve_next_due_at(activity, None, 0) == activity + timedelta(days=2)
+    assert resolve_next_due_at(activity, 2, 2) == activity + timedelta(days=10)
+    assert resolve_next_due_at(activity, 4, 4) is None
+
+
+def test_night_due_times_are_spread_over_the_send_window() -> None:
+    night = datetime(2026, 8, 3, 20, 0)  # 23:00 по Москве
+    shifted = {shift_into_send_window(night, user_id) for user_id in range(1, 50)}
+
+    assert all(in_send_window(moment) and moment > night for moment in shifted)
+    assert len(shifted) > 40
+    assert shift_into_send_window(NOON_UTC, 1) == NOON_UTC
+
+
+def test_queue_pops_due_users_in_order_and_skips_rescheduled() -> None:
+    queue = NotificationQueue()
+    queue.push(NOON_UTC + timedelta(minutes=5), 1)
+    queue.push(NOON_UTC - timedelta(minutes=1), 2)
+    queue.push(NOON_UTC - timedelta(minutes=2), 3)
+    queue.push(NOON_UTC + timedelta(hours=1), 3)  # пользователь вернулся - срок сдвинулся
+
+    assert queue.pop_due(NOON_UTC, limit=10) == [2]
+    assert queue.next_due_at() == NOON_UTC + timedelta(minutes=5)
+    assert len(queue) == 2
+
+
+def run_patched(candidates, **kwargs):
+    session = MagicMock(commit=AsyncMock())
+
+    @asynccontextmanager
+    async def factory():
+        yield session
+
+    written: list[dict] = []
+
+    async def update_schedule(_session, schedule) -> None:
+        written.append(dict(schedule))
+
+    async def run(bot):
+        with (
+            patch.object(runner, "async_session_factory", factory),
+            patch.object(runner, "get_due_notifications", AsyncMock(return_value=candidates)),
+            patch.object(runner, "update_notification_schedule", update_schedule),
+            patch.object(runner, "get_background_message", lambda stage: f"stage {stage}"),
+        ):
+            return await runner.run_inactivity_notifications_once(bot, **kwargs)
+
+    return run, written
+
+
+@pytest.mark.asyncio
+async def test_run_sends_due_messages_and_schedules_next_threshold() -> None:
+    activity_1 = NOON_UTC - timedelta(days=3)
+    activity_3 = NOON_UTC - timedelta(hours=1)
+    candidates = [
+        NotificationCandidate(1, 101, None, activity_1, 1),
+        NotificationCandidate(2, 102, 1, NOON_UTC - timedelta(days=6), 2),
+        NotificationCandidate(3, 103, 3, activity_3, 0),
+        NotificationCandidate(4, 104, None, activity_1, 1, exam_completed=True),
+    ]
+    bot = AsyncMock()
+    run, written = run_patched(candidates, now=NOON_UTC)
+
+    stats = await run(bot)
+
+    assert [call.kwargs["chat_id"] for call in bot.send_message.await_args_list] == [101, 102]
+    [schedule] = written
+    assert schedule[1] == (1, shift_into_send_window(activity_1 + timedelta(days=5), 1))
+    assert schedule[2][0] == 2
+    assert schedule[3] == (None, shift_into_send_window(activity_3 + timedelta(days=2), 3))
+    assert schedule[4] == (None, None)
+    assert stats == {"processed": 4, "skipped": 2, "postponed": 0, "sent": 2, "errors": 0, "retries": 0}
+
+
+@pytest.mark.asyncio
+async def test_run_outside_send_window_postpones_without_sending() -> None:
+    night = datetime(2026, 8, 3, 20, 0)
+    bot = AsyncMock()
+    run, written = run_patched(
+        [NotificationCandidate(1, 101, None, night - timedelta(days=3), 1)],
+        now=night,
+    )
+
+    stats = await run(bot)
+
+    bot.send_message.assert_not_awaited()
+    assert written == [{1: (None, shift_into_send_window(night, 1))}]
+    assert stats["postponed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_retries_after_flood_control_and_pauses_senders() -> None:
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import SendMessage
+
+    candidates = [
+        NotificationCandidate(user_id, 100 + user_id, None, NOON_UTC - timedelta(days=3), 1)
+        for user_id in range(1, 6)
+    ]
+    bot = AsyncMock()
+    bot.send_message.side_effect = [
+        TelegramRetryAfter(method=SendMessage(chat_id=101, text="x"), message="flood", retry_after=0),
+        None, None, None, None, None,
+    ]
+    run, written = run_patched(candidates, now=NOON_UTC, concurrency=3, rate=1000)
+
+    stats = await run(bot)
+
+    assert stats == {"processed": 5, "skipped": 0, "postponed": 0, "sent": 5, "errors": 0, "retries": 1}
+    assert bot.send_message.await_count == 6
+    assert [sorted(batch) for batch in written] == [[1, 2, 3, 4, 5]]
+
+
+@pytest.mark.asyncio
+async def test_runs_share_the_bucket_passed_by_scheduler() -> None:
+    from service.rate_limit import TokenBucket
+
+    bucket = TokenBucket(1000)
+    candidates = [NotificationCandidate(1, 101, None, NOON_UTC - timedelta(days=3), 1)]
+    bot = AsyncMock()
+    run, _ = run_patched(candidates, now=NOON_UTC, bucket=bucket)
+
+    with patch.object(bucket, "acquire", AsyncMock(wraps=bucket.acquire)) as acquire:
+        await run(bot)
+        await run(bot)
+
+    # Второй запуск берёт токены из того же бакета, а не из нового полного
+    assert acquire.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_admin_reset_reschedules_every_user_in_one_update() -> None:
+    from dialogs.admin_dialog import delete_notification
+
+    session = MagicMock(commit=AsyncMock())
+    session.execute = AsyncMock(return_value=MagicMock(rowcount=3))
+    callback = MagicMock()
+    callback.message.answer = AsyncMock()
+    manager = MagicMock(middleware_data={"session": session})
+
+    await delete_notification(callback, MagicMock(), manager)
+
+    [statement] = [call.args[0] for call in session.execute.await_args_list]
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("UPDATE users SET notification_stage=")
+    assert "next_notification_at=" in sql
+    callback.message.answer.assert_awaited_once_with("Обработано записей: 3")
+
+
+@pytest.mark.asyncio
+async def test_unexpected_error_schedules_retry_instead_of_leaving_user_due() -> None:
+    from service.background_notifications.rules import RETRY_DELAY
+
+    candidates = [NotificationCandidate(1, 101, None, NOON_UTC - timedelta(days=3), 1)]
+    run, written = run_patched(candidates, now=NOON_UTC)
+
+    with patch.object(runner, "should_send", side_effect=RuntimeError("boom")):
+        stats = await run(AsyncMock())
+
+    assert stats["errors"] == 1
+    assert written == [{1: (None, shift_into_send_window(NOON_UTC + RETRY_DELAY, 1))}]
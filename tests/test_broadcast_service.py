@@ -5,10 +5,28 @@ import re
 import pytest
 
 from db.models import Broadcast, BroadcastButton, BroadcastDelivery, BroadcastRecipient
+from web_admin.repository import DeliveryResult
 from web_admin.service import BroadcastService
 from web_admin.max_client import MaxServiceUnavailable
 
 
+def claim_from(deliveries: list[BroadcastDelivery]):
+    remaining = list(deliveries)
+
+    async def claim_deliveries(broadcast_id: int, platform: str, limit: int) -> list[BroadcastDelivery]:
+        wave = [item for item in remaining if item.platform == platform][:limit]
+        for item in wave:
+            remaining.remove(item)
+            item.status = "sending"
+        return wave
+
+    return claim_deliveries
+
+
+def recorded_results(repository) -> list[DeliveryResult]:
+    return [item for call in repository.record_results.await_args_list for item in call.args[1]]
+
+
 @pytest.mark.asyncio
 async def test_sends_personalized_html_with_action_buttons(tmp_path) -> None:
     bot = AsyncMock()
@@ -241,7 +259,6 @@ async def test_max_media_is_uploaded_once_for_multiple_deliveries(tmp_path) -> N
     max_client = AsyncMock()
     max_client.upload_media.return_value = {"media_type": "image", "token": "token"}
     repository = AsyncMock()
-    repository.mark_sending.return_value = True
     service = BroadcastService(repository, AsyncMock(), tmp_path, max_client=max_client)
     broadcast = Broadcast(
         id=3,
@@ -267,13 +284,18 @@ async def test_max_media_is_uploaded_once_for_multiple_deliveries(tmp_path) -> N
         )
         delivery.recipient = recipient
         deliveries.append(delivery)
+    repository.claim_deliveries.side_effect = claim_from(deliveries)
 
     with patch("web_admin.service.asyncio.sleep", new=AsyncMock()):
-        await service._process_max(broadcast, deliveries)
+        await service._process_max(broadcast)
 
     max_client.upload_media.assert_awaited_once_with(str(media_path))
     assert max_client.send_message.await_count == 2
     repository.set_max_media.assert_awaited_once_with(3, media_type="image", token="token")
+    # Результаты обеих доставок записаны одной пачкой
+    repository.record_results.assert_awaited_once_with(
+        3, [DeliveryResult(1, True), DeliveryResult(2, True)]
+    )
 
 
 @pytest.mark.asyncio
@@ -281,7 +303,6 @@ async def test_max_outage_marks_remaining_max_deliveries_without_raising(tmp_pat
     max_client = AsyncMock()
     max_client.send_message.side_effect = MaxServiceUnavailable("MAX offline")
     repository = AsyncMock()
-    repository.mark_sending.return_value = True
     service = BroadcastService(repository, AsyncMock(), tmp_path, max_client=max_client)
     broadcast = Broadcast(
         id=4,
@@ -297,7 +318,206 @@ async def test_max_outage_marks_remaining_max_deliveries_without_raising(tmp_pat
     delivery = BroadcastDelivery(id=1, target_id=9001, platform="max", status="pending")
     delivery.recipient = BroadcastRecipient(name="Анна", row_number=2, broadcast_id=4)
 
-    await service._process_max(broadcast, [delivery])
+    pending = BroadcastDelivery(id=2, target_id=9002, platform="max", status="pending")
+    repository.claim_deliveries.side_effect = claim_from([delivery, pending])
+    service.concurrency = 1
 
-    repository.mark_result.assert_awaited_once_with(1, success=False, error="MAX offline")
+    await service._process_max(broadcast)
+
+    assert recorded_results(repository) == [DeliveryResult(1, False, "MAX offline")]
+    assert pending.status == "pending"
     repository.fail_pending_platform.assert_awaited_once_with(4, "max", "MAX offline")
+
+
+@pytest.mark.asyncio
+async def test_telegram_and_max_deliveries_run_concurrently(tmp_path) -> None:
+    import asyncio
+
+    in_flight = {"telegram": 0, "max": 0}
+    peak = {"telegram": 0, "max": 0}
+    overlap = False
+
+    async def sending(platform: str) -> None:
+        nonlocal overlap
+        in_flight[platform] += 1
+        peak[platform] = max(peak[platform], in_flight[platform])
+        overlap = overlap or all(in_flight.values())
+        await asyncio.sleep(0.02)
+        in_flight[platform] -= 1
+
+    async def send_telegram(**_) -> None:
+        await sending("telegram")
+
+    async def send_max(**_) -> None:
+        await sending("max")
+
+    bot = AsyncMock()
+    bot.send_message.side_effect = send_telegram
+    max_client = AsyncMock()
+    max_client.send_message.side_effect = send_max
+    repository = AsyncMock()
+    service = BroadcastService(repository, bot, tmp_path, max_client=max_client, concurrency=4)
+    broadcast = Broadcast(
+        id=5,
+        message="Сообщение",
+        source_filename="users.xlsx",
+        status="running",
+        scheduled_at=None,
+        created_at=None,
+    )
+    broadcast.buttons = []
+    broadcast.max_media_type = None
+    broadcast.max_media_token = None
+    deliveries = []
+    for delivery_id in range(1, 17):
+        platform = "telegram" if delivery_id % 2 else "max"
+        delivery = BroadcastDelivery(id=delivery_id, target_id=delivery_id, platform=platform, status="pending")
+        delivery.recipient = BroadcastRecipient(name="Анна", row_number=delivery_id, broadcast_id=5)
+        deliveries.append(delivery)
+    repository.claim_next_due.return_value = broadcast
+    repository.claim_deliveries.side_effect = claim_from(deliveries)
+    repository.get.return_value = None
+
+    assert await service.process_next_due() is True
+
+    assert bot.send_message.await_count == 8
+    assert max_client.send_message.await_count == 8
+    assert peak == {"telegram": 4, "max": 4}
+    assert overlap
+    repository.finish.assert_awaited_once_with(5)
+    results = recorded_results(repository)
+    assert sorted(item.delivery_id for item in results) == list(range(1, 17))
+    assert all(item.success for item in results)
+    # Очередь пополняется пачками по concurrency: 2 на платформу плюс пустой запрос в конце
+    assert repository.claim_deliveries.await_count == 6
+
+
+@pytest.mark.asyncio
+async def test_result_buffer_flushes_by_batch_size() -> None:
+    from web_admin.service import DeliveryResultBuffer
+
+    repository = AsyncMock()
+    buffer = DeliveryResultBuffer(repository, 7, batch_size=2, flush_interval=3600)
+
+    await buffer.add(1, success=True)
+    repository.record_results.assert_not_awaited()
+    await buffer.add(2, success=False, error="blocked")
+    await buffer.add(3, success=True)
+    await buffer.flush()
+
+    assert [call.args for call in repository.record_results.await_args_list] == [
+        (7, [DeliveryResult(1, True), DeliveryResult(2, False, "blocked")]),
+        (7, [DeliveryResult(3, True)]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_telegram_media_is_uploaded_once_and_file_id_reused(tmp_path) -> None:
+    from aiogram.types import FSInputFile
+
+    media_path = tmp_path / "video.mp4"
+    media_path.write_bytes(b"video")
+    bot = AsyncMock()
+    bot.send_video.return_value = SimpleNamespace(photo=None, video=SimpleNamespace(file_id="file-id"))
+    repository = AsyncMock()
+    service = BroadcastService(repository, bot, tmp_path, concurrency=4)
+    broadcast = Broadcast(
+        id=6,
+        message="Привет, [Имя]!",
+        source_filename="users.xlsx",
+        media_kind="video",
+        media_path=str(media_path),
+        status="running",
+        scheduled_at=None,
+        created_at=None,
+    )
+    broadcast.buttons = []
+    deliveries = []
+    for delivery_id in range(1, 6):
+        delivery = BroadcastDelivery(id=delivery_id, target_id=delivery_id, platform="telegram", status="pending")
+        delivery.recipient = BroadcastRecipient(name="Анна", row_number=delivery_id, broadcast_id=6)
+        deliveries.append(delivery)
+    repository.claim_deliveries.side_effect = claim_from(deliveries)
+
+    await service._process_telegram(broadcast)
+
+    videos = [call.kwargs["video"] for call in bot.send_video.await_args_list]
+    assert isinstance(videos[0], FSInputFile)
+    assert videos[1:] == ["file-id"] * 4
+    repository.set_telegram_file_id.assert_awaited_once_with(6, "file-id")
+    # Первая доставка уходит отдельно, остальные - через пул воркеров
+    assert [call.args[2] for call in repository.claim_deliveries.await_args_list] == [1, 4, 4]
+
+
+@pytest.mark.asyncio
+async def test_slow_delivery_does_not_hold_free_workers(tmp_path) -> None:
+    import asyncio
+
+    slow_started = asyncio.Event()
+    release_slow = asyncio.Event()
+    sent: list[int] = []
+
+    async def send_message(chat_id: int, **_) -> None:
+        if chat_id == 1:
+            slow_started.set()
+            await release_slow.wait()
+        sent.append(chat_id)
+
+    bot = AsyncMock()
+    bot.send_message.side_effect = send_message
+    repository = AsyncMock()
+    service = BroadcastService(repository, bot, tmp_path, concurrency=2)
+    broadcast = Broadcast(
+        id=8,
+        message="Сообщение",
+        source_filename="users.xlsx",
+        status="running",
+        scheduled_at=None,
+        created_at=None,
+    )
+    broadcast.buttons = []
+    deliveries = []
+    for delivery_id in range(1, 7):
+        delivery = BroadcastDelivery(id=delivery_id, target_id=delivery_id, platform="telegram", status="pending")
+        delivery.recipient = BroadcastRecipient(name="Анна", row_number=delivery_id, broadcast_id=8)
+        deliveries.append(delivery)
+    repository.claim_deliveries.side_effect = claim_from(deliveries)
+
+    task = asyncio.create_task(service._process_telegram(broadcast))
+    await slow_started.wait()
+    for _ in range(50):
+        if len(sent) == 5:
+            break
+        await asyncio.sleep(0.01)
+
+    # Пока первая доставка висит, второй слот успевает отправить все остальные
+    assert sent == [2, 3, 4, 5, 6]
+    release_slow.set()
+    await task
+    assert sent[-1] == 1
+
+
+def test_amo_metrics_route_returns_snapshot_to_admin(tmp_path) -> None:
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from starlette.middleware.sessions import SessionMiddleware
+
+    from config.config import AdminWebConfig
+    from web_admin.auth import LoginRateLimiter
+    from web_admin.routes import create_admin_router
+
+    config = AdminWebConfig("password", "session-secret" * 3, tmp_path)
+    app = FastAPI()
+    app.state.admin_config = config
+    app.state.admin_rate_limiter = LoginRateLimiter()
+    app.state.amo_api = SimpleNamespace(metrics_snapshot=lambda: {"requests": 3, "throttled": 1})
+    app.add_middleware(SessionMiddleware, secret_key=config.session_secret, https_only=True, path=config.prefix)
+    app.include_router(create_admin_router(config.prefix))
+
+    with TestClient(app, base_url="https://testserver") as client:
+        assert client.get("/tg_education/admin/metrics/amo").status_code == 401
+        client.post("/tg_education/admin/login", data={"password": "password"}, follow_redirects=False)
+        response = client.get("/tg_education/admin/metrics/amo")
+
+    assert response.status_code == 200
+    assert response.json() == {"requests": 3, "throttled": 1}
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy.dialects import postgresql
+
+from fsm_forms.storage import SqlAlchemyStorage, dump_data, load_data
+
+
+class FakeResult:
+    def scalar_one_or_none(self):
+        return None
+
+
+class FakeSession:
+    def __init__(self, statements: list) -> None:
+        self.statements = statements
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return FakeResult()
+
+    async def commit(self) -> None:
+        pass
+
+
+class Form(StatesGroup):
+    step = State()
+
+
+def make_storage(statements: list) -> SqlAlchemyStorage:
+    return SqlAlchemyStorage(lambda: FakeSession(statements), ttl=timedelta(days=1), purge_interval=10**9)
+
+
+def test_data_is_serialized_compactly() -> None:
+    data = {"answers": {"q1": {"Вариант": True}}, "q1_items": [("Вариант", "1", True)]}
+
+    raw = dump_data(data)
+
+    assert raw == '{"answers":{"q1":{"Вариант":true}},"q1_items":[["Вариант","1",true]]}'
+    assert load_data(raw)["answers"] == data["answers"]
+    assert dump_data({}) is None
+    assert load_data(None) == {}
+
+
+@pytest.mark.asyncio
+async def test_set_state_upserts_by_destiny_key() -> None:
+    statements: list = []
+    storage = make_storage(statements)
+    key = StorageKey(bot_id=1, chat_id=2, user_id=2, destiny="aiogd:stack:")
+
+    await storage.set_state(key, Form.step)
+    sql = str(statements[0].compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT (key) DO UPDATE" in sql
+    assert "CASE WHEN" in sql
+    assert statements[0].compile().params["key"] == "fsm:2:2:aiogd:stack:"
+    assert statements[0].compile().params["state"] == "Form:step"
+    assert await storage.get_data(key) == {}
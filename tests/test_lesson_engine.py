@@ -0,0 +1,38 @@
+from aiogram_dialog.widgets.kbd import Multiselect, Radio
+
+from dialogs.lesson_engine import build_lesson_dialog
+from dialogs.lessons import LESSONS
+
+
+def _selectors(widget) -> list:
+    found = [widget] if isinstance(widget, (Radio, Multiselect)) else []
+    for child in getattr(widget, 'buttons', ()):
+        found.extend(_selectors(child))
+    return found
+
+
+def test_lesson_dialog_windows_follow_quiz_order() -> None:
+    for spec in LESSONS:
+        dialog = build_lesson_dialog(spec)
+        states = [state.state for state in dialog.windows]
+
+        assert states == [
+            spec.video_state.state,
+            *(question.state for question in spec.quiz.questions),
+            spec.states.confirm_answers.state,
+            spec.result_state.state,
+        ]
+        # Каждое состояние StatesGroup отрисовывается своим окном
+        assert set(states) == {state.state for state in spec.states.__all_states__}
+
+
+def test_question_widget_matches_correct_options() -> None:
+    for spec in LESSONS:
+        dialog = build_lesson_dialog(spec)
+        for question in spec.quiz.questions:
+            state_name = question.state.split(':')[1]
+            (selector,) = _selectors(dialog.windows[getattr(spec.states, state_name)].keyboard)
+
+            assert isinstance(selector, Multiselect if question.multi else Radio)
+            # Прежний id виджета: отмеченные варианты начатых диалогов не теряются
+            assert selector.widget_id == f'{state_name}_answers_checked'
@@ -0,0 +1,97 @@
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import ContentType
+from aiogram_dialog import Dialog, Window
+from aiogram_dialog.api.entities import MediaId
+from aiogram_dialog.widgets.media import StaticMedia
+from aiogram_dialog.widgets.text import Const
+
+from fsm_forms.media_storage import SqlAlchemyMediaIdStorage, warm_up_media
+
+
+def make_storage(record=None):
+    session = MagicMock()
+    session.get = AsyncMock(return_value=record)
+    session.execute = AsyncMock()
+    session.commit = AsyncMock()
+
+    @asynccontextmanager
+    async def factory():
+        yield session
+
+    return SqlAlchemyMediaIdStorage(factory), session
+
+
+@pytest.mark.asyncio
+async def test_saved_media_id_is_reused_until_file_changes(tmp_path) -> None:
+    import os
+
+    video = tmp_path / "lesson.mp4"
+    video.write_bytes(b"video")
+    storage, session = make_storage()
+
+    await storage.save_media_id(video, None, ContentType.VIDEO, MediaId("file-1", "uniq-1"))
+    await storage.save_media_id(video, None, ContentType.VIDEO, MediaId("file-1", "uniq-1"))
+
+    assert session.execute.await_count == 1
+    assert await storage.get_media_id(video, None, ContentType.VIDEO) == MediaId("file-1", "uniq-1")
+
+    os.utime(video, (1, 1))
+    assert await storage.get_media_id(video, None, ContentType.VIDEO) is None
+
+
+@pytest.mark.asyncio
+async def test_missing_media_id_is_not_reread_until_saved(tmp_path) -> None:
+    video = tmp_path / "lesson.mp4"
+    video.write_bytes(b"video")
+    storage, session = make_storage()
+
+    assert await storage.get_media_id(video, None, ContentType.VIDEO) is None
+    assert await storage.get_media_id(video, None, ContentType.VIDEO) is None
+    session.get.assert_awaited_once()
+
+    await storage.save_media_id(video, None, ContentType.VIDEO, MediaId("file-1", "uniq-1"))
+    assert await storage.get_media_id(video, None, ContentType.VIDEO) == MediaId("file-1", "uniq-1")
+
+    # По истечении TTL промах перечитывается: file_id мог сохранить другой процесс
+    storage.miss_ttl = 0
+    other = tmp_path / "other.mp4"
+    assert await storage.get_media_id(other, None, ContentType.VIDEO) is None
+    assert await storage.get_media_id(other, None, ContentType.VIDEO) is None
+    assert session.get.await_count == 3
+
+
+class WarmUpSG(StatesGroup):
+    video = State()
+    text = State()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_uploads_only_missing_media(tmp_path) -> None:
+    video = tmp_path / "lesson.mp4"
+    video.write_bytes(b"video")
+    dialog = Dialog(
+        Window(
+            Const("Урок"),
+            StaticMedia(path=video, type=ContentType.VIDEO, media_params={"supports_streaming": True}),
+            state=WarmUpSG.video,
+        ),
+        Window(Const("Без медиа"), state=WarmUpSG.text),
+    )
+    storage, _ = make_storage()
+    bot = AsyncMock()
+    bot.send_video.return_value = MagicMock(
+        audio=None, animation=None, document=None, photo=None,
+        video=MagicMock(file_id="file-1", file_unique_id="uniq-1"), voice=None, message_id=5,
+    )
+
+    assert await warm_up_media(bot, storage, [dialog], chat_id=1) == 1
+    assert await warm_up_media(bot, storage, [dialog], chat_id=1) == 0
+
+    bot.send_video.assert_awaited_once()
+    assert bot.send_video.await_args.kwargs["supports_streaming"] is True
+    bot.delete_message.assert_awaited_once_with(chat_id=1, message_id=5)
+    assert await storage.get_media_id(str(video), None, ContentType.VIDEO) == MediaId("file-1", "uniq-1")
@@ -0,0 +1,77 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from db.models import HpLessonResult, User
+from sqlalchemy.orm import Session
+
+from service.progress import (
+    LESSON_BITS,
+    ProgressCache,
+    _apply_staged_bits,
+    _drop_staged_bits,
+    _record_completed_lesson,
+    progress_cache,
+)
+from service.service import get_lessons_buttons, lesson_access
+
+
+def test_cache_adds_bits_only_to_cached_users() -> None:
+    cache = ProgressCache(ttl=60)
+    cache.set(1, LESSON_BITS["lesson_1"])
+
+    cache.add_bits(1, LESSON_BITS["lesson_2"])
+    cache.add_bits(2, LESSON_BITS["lesson_2"])
+
+    assert cache.get(1) == LESSON_BITS["lesson_1"] | LESSON_BITS["lesson_2"]
+    assert cache.get(2) is None
+
+
+@pytest.mark.asyncio
+async def test_menu_and_access_use_single_cached_lookup() -> None:
+    progress_cache.invalidate(7)
+    session = MagicMock()
+    session.scalar = AsyncMock(return_value=LESSON_BITS["lesson_1"] | LESSON_BITS["lesson_2"])
+    user = User(id=7)
+
+    buttons = await get_lessons_buttons(user, session)
+
+    assert buttons["lesson_1"].startswith("✅")
+    assert buttons["lesson_2"].startswith("✅")
+    assert buttons["lesson_3"].startswith("▶️")
+    assert buttons["lesson_4"].startswith("🔒")
+    assert await lesson_access(user, session, "lesson_3") is True
+    assert await lesson_access(user, session, "lesson_4") is False
+    session.scalar.assert_awaited_once()
+
+
+def test_completed_result_updates_cache_only_after_commit() -> None:
+    progress_cache.set(8, 0)
+    connection = MagicMock()
+    session = Session()
+    pending = HpLessonResult(user_id=8, lesson_key="lesson_3", compleat=False)
+    completed = HpLessonResult(user_id=8, lesson_key="lesson_3", compleat=True)
+    session.add_all([pending, completed])
+
+    _record_completed_lesson(None, connection, pending)
+    connection.execute.assert_not_called()
+
+    _record_completed_lesson(None, connection, completed)
+    connection.execute.assert_called_once()
+    assert progress_cache.get(8) == 0
+
+    _apply_staged_bits(session)
+    assert progress_cache.get(8) == LESSON_BITS["lesson_3"]
+
+
+def test_rolled_back_result_does_not_reach_cache() -> None:
+    progress_cache.set(9, 0)
+    session = Session()
+    completed = HpLessonResult(user_id=9, lesson_key="lesson_3", compleat=True)
+    session.add(completed)
+
+    _record_completed_lesson(None, MagicMock(), completed)
+    _drop_staged_bits(session)
+    _apply_staged_bits(session)
+
+    assert progress_cache.get(9) == 0
@@ -0,0 +1,76 @@
+import pytest
+
+from service.quiz import compile_quiz, quizzes
+from service.service import checking_result, count_missed_answers, format_progress, format_results
+
+QUESTIONS = {
+    'Lesson:first_question': {'title': 'Один ответ',
+                              'answers': [('Да', '1', True), ('Нет', '2', False)],
+                              'key': 'q1'},
+    'Lesson:second_question': {'title': 'Несколько ответов',
+                               'answers': [('A', '1', True), ('B', '2', False), ('C', '3', True)],
+                               'key': 'q2'},
+}
+
+
+def test_question_is_compiled_into_bitmasks_and_render_data() -> None:
+    quiz = compile_quiz(QUESTIONS)
+    question = quiz.question('Lesson:second_question')
+
+    assert quiz.total == 2
+    assert question.correct_mask == 0b101
+    assert question.is_correct(question.selected_mask(['3', '1']))
+    assert not question.is_correct(question.selected_mask(['1']))
+
+    render = question.render[False]
+    assert render['quest_number'] == '2'
+    assert render['count_quest'] == '2'
+    assert render['text_answers'] == '<b>Варианты ответов:</b>\n1) A\n\n2) B\n\n3) C\n\n'
+    assert render['dont_first_question'] is True
+    assert question.render[True]['confirm_stage'] is True
+    # Данные окна собираются один раз и не меняются между запросами
+    with pytest.raises(TypeError):
+        render['title'] = 'другой'
+    with pytest.raises(AttributeError):
+        question.key = 'q3'
+
+
+@pytest.mark.asyncio
+async def test_grading_walks_compiled_questions() -> None:
+    quiz = compile_quiz(QUESTIONS)
+    first, second = quiz.questions
+    answers = {'q1': first.selected_mask(['1'])}
+
+    assert await count_missed_answers(answers, quiz) == 1
+    assert 'Пропущенные вопросы: 2' in format_progress(answers, quiz)
+
+    answers['q2'] = second.selected_mask(['1'])
+
+    assert checking_result(answers, quiz) == {'score': 50, 'passed': False}
+    assert format_results(answers, quiz).splitlines()[:2] == ['Вопрос 1 - ✅ Верно;', 'Вопрос 2 - ❌ Не верно;']
+
+
+def test_legacy_per_option_answers_are_still_graded() -> None:
+    quiz = compile_quiz(QUESTIONS)
+    # Диалоги, начатые до перехода на маски, хранят {вариант: верно}
+    answers = {'q1': {'Да': True, 'Нет': True}, 'q2': {'A': True, 'B': False, 'C': True}}
+
+    assert checking_result(answers, quiz) == {'score': 50, 'passed': False}
+
+    answers['q2'] = 0b101
+
+    assert checking_result(answers, quiz) == {'score': 100, 'passed': True}
+
+
+def test_empty_selection_counts_as_answered() -> None:
+    question = compile_quiz(QUESTIONS).question('Lesson:second_question')
+
+    assert question.is_answered(0)
+    assert not question.grade(0)
+    assert not question.is_answered({})
+    assert not question.is_answered(None)
+
+
+def test_every_lesson_quiz_is_numbered_without_gaps() -> None:
+    for quiz in quizzes.values():
+        assert [question.number for question in quiz.questions] == list(range(1, quiz.total + 1))
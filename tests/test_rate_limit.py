@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from service.rate_limit import TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_bucket_spaces_requests_after_burst() -> None:
+    bucket = TokenBucket(rate=20, capacity=2)
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+    elapsed = time.monotonic() - started
+
+    # Два токена сразу, остальные четыре - по одному каждые 50 мс
+    assert 0.18 <= elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_pause_delays_next_acquire() -> None:
+    bucket = TokenBucket(rate=100)
+    bucket.pause(0.1)
+    waited = await bucket.acquire()
+
+    assert waited >= 0.1
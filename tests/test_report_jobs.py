@@ -0,0 +1,115 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+import service.report_jobs as report_jobs
+from service.report_jobs import STATUS_DONE, STATUS_EMPTY, ReportJobManager
+from service.reports import EMPLOYMENT_TYPE, USERS_RESULTS
+
+
+class FakeSessionFactory:
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return MagicMock()
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+@pytest.fixture
+def export(monkeypatch):
+    state = {"version": (1,), "rows": 3, "calls": 0}
+    release = asyncio.Event()
+    release.set()
+
+    async def data_version(session):
+        return state["version"]
+
+    async def write_report(session, report, path, *, progress=None):
+        state["calls"] += 1
+        await release.wait()
+        if state["rows"]:
+            path.write_bytes(b"xlsx")
+            progress(state["rows"])
+        return state["rows"]
+
+    monkeypatch.setattr(report_jobs, "data_version", data_version)
+    monkeypatch.setattr(report_jobs, "write_report", write_report)
+    state["release"] = release
+    return state
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_job(tmp_path, export) -> None:
+    manager = ReportJobManager(FakeSessionFactory(), tmp_path)
+    export["release"].clear()
+    delivered = []
+
+    async def deliver(job):
+        delivered.append(job.id)
+
+    first = manager.submit(USERS_RESULTS, subscriber=deliver)
+    second = manager.submit(USERS_RESULTS, subscriber=deliver)
+    other = manager.submit(EMPLOYMENT_TYPE)
+    export["release"].set()
+    await manager.wait(first)
+    await manager.wait(other)
+
+    assert second is first
+    assert other is not first
+    assert export["calls"] == 2
+    assert first.status == STATUS_DONE and first.rows == 3
+    assert delivered == [first.id, first.id]
+    await manager.close()
+    assert not first.path.exists()
+
+
+@pytest.mark.asyncio
+async def test_finished_report_is_reused_until_data_changes(tmp_path, export) -> None:
+    manager = ReportJobManager(FakeSessionFactory(), tmp_path, ttl=60)
+    first = await manager.wait(manager.submit(USERS_RESULTS))
+    cached = await manager.wait(manager.submit(USERS_RESULTS))
+
+    assert cached.id != first.id
+    assert cached.cached and cached.path == first.path
+    assert export["calls"] == 1
+
+    # Запись другого процесса или Core UPDATE: меняется только водяной знак в БД
+    export["version"] = (2,)
+    rebuilt = await manager.wait(manager.submit(USERS_RESULTS))
+
+    assert not rebuilt.cached and rebuilt.path != first.path
+    assert export["calls"] == 2
+
+    # Правка через ORM в этом процессе
+    report_jobs._bump_local_version(None, None, None)
+    local = await manager.wait(manager.submit(USERS_RESULTS))
+
+    assert not local.cached
+    assert export["calls"] == 3
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_expires_after_ttl(tmp_path, export) -> None:
+    manager = ReportJobManager(FakeSessionFactory(), tmp_path, ttl=0)
+    await manager.wait(manager.submit(USERS_RESULTS))
+    second = await manager.wait(manager.submit(USERS_RESULTS))
+
+    assert not second.cached
+    assert export["calls"] == 2
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_empty_report_has_no_file(tmp_path, export) -> None:
+    export["rows"] = 0
+    manager = ReportJobManager(FakeSessionFactory(), tmp_path)
+    job = await manager.wait(manager.submit(EMPLOYMENT_TYPE))
+
+    assert job.status == STATUS_EMPTY
+    assert job.path is None
+    await manager.close()
@@ -0,0 +1,90 @@
+import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy.dialects import postgresql
+
+from db.models import HpLessonResult, User
+from service.reports import EMPLOYMENT_TYPE, USERS_RESULTS, data_version, write_report
+
+
+class FakeStreamResult:
+    def __init__(self, rows: list, batch_size: int):
+        self.rows = rows
+        self.batch_size = batch_size
+
+    async def partitions(self):
+        for start in range(0, len(self.rows), self.batch_size):
+            yield self.rows[start:start + self.batch_size]
+
+
+def make_session(rows: list, batch_size: int = 2) -> MagicMock:
+    session = MagicMock()
+    session.stream = AsyncMock(return_value=FakeStreamResult(rows, batch_size))
+    return session
+
+
+def user_row(user_id: int, **lesson) -> SimpleNamespace:
+    values = dict(
+        id=user_id, tg_user_id=user_id * 10, max_user_id=None, notification_stage=None,
+        username=None, first_name="Иван", last_name=None, phone_number=None,
+        amo_contact_id=None, amo_deal_id=None, lesson_id=None, lesson_key=None,
+        score=None, compleat=None, started_at=None, completed_at=None,
+    )
+    values.update(lesson)
+    return SimpleNamespace(**values)
+
+
+@pytest.mark.asyncio
+async def test_report_is_streamed_in_batches_into_xlsx(tmp_path) -> None:
+    completed_at = datetime.datetime(2026, 9, 1, 12, 30)
+    rows = [
+        user_row(1, lesson_id=5, lesson_key="lesson_1", score=100, compleat=True, completed_at=completed_at),
+        user_row(1, lesson_id=6, lesson_key="lesson_2", score=50, compleat=False, completed_at=completed_at),
+        user_row(2),
+    ]
+    session = make_session(rows)
+    path = tmp_path / "report.xlsx"
+
+    assert await write_report(session, USERS_RESULTS, path, batch_size=2) == 3
+
+    statement = session.stream.await_args.args[0]
+    assert statement.get_execution_options()["yield_per"] == 2
+    sheet = load_workbook(path, read_only=True)["users_results"]
+    values = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert values[0] == list(USERS_RESULTS.headers)
+    assert values[1][10:16] == [5, "lesson_1", 100, True, None, "2026-09-01 12:30:00"]
+    # Пустые поля урока у пользователя без результатов
+    assert values[3][:2] == [2, 20]
+    assert values[3][10:] == [None] * 6
+
+
+@pytest.mark.asyncio
+async def test_empty_report_does_not_create_file(tmp_path) -> None:
+    path = tmp_path / "report.xlsx"
+
+    assert await write_report(make_session([]), EMPLOYMENT_TYPE, path) == 0
+    assert not path.exists()
+
+
+def test_report_statements_select_columns_only() -> None:
+    # Без ORM-объектов: строки курсора не копятся в identity map сессии
+    for report in (USERS_RESULTS, EMPLOYMENT_TYPE):
+        statement = report.statement()
+        assert len(statement.selected_columns) == len(report.headers)
+        assert all(desc["type"] not in (User, HpLessonResult) for desc in statement.column_descriptions)
+        statement.compile(dialect=postgresql.dialect())
+
+
+@pytest.mark.asyncio
+async def test_data_version_reads_indexed_maxima_only() -> None:
+    session = MagicMock()
+    session.execute = AsyncMock(return_value=MagicMock(one=lambda: (1, None, 2, None)))
+
+    assert await data_version(session) == (1, None, 2, None)
+
+    sql = str(session.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "count(" not in sql
+    assert "max(users.updated_at)" in sql and "max(lesson_results.updated_at)" in sql
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from aiogram.types import Update
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from service.telegram_webhook import UpdateWorkerPool, create_webhook_router
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": str(update_id),
+        },
+    })
+
+
+class RecordingDispatcher:
+    def __init__(self) -> None:
+        self.handled: list[tuple[int, int]] = []
+        self.active = 0
+        self.max_active = 0
+
+    async def feed_update(self, bot, update: Update) -> None:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        # Первый апдейт каждого чата обрабатывается дольше следующих
+        await asyncio.sleep(0.05 if update.update_id % 10 == 0 else 0)
+        self.handled.append((update.message.chat.id, update.update_id))
+        self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_pool_keeps_chat_order_and_runs_chats_in_parallel() -> None:
+    dp = RecordingDispatcher()
+    pool = UpdateWorkerPool(dp, bot=None, workers=4, queue_size=40)
+    pool.start()
+    for chat_id in (1, 2):
+        for offset in range(3):
+            await pool.put(make_update(chat_id * 10 + offset, chat_id))
+    await pool.stop()
+
+    for chat_id in (1, 2):
+        assert [update_id for chat, update_id in dp.handled if chat == chat_id] == [
+            chat_id * 10,
+            chat_id * 10 + 1,
+            chat_id * 10 + 2,
+        ]
+    assert dp.max_active == 2
+
+
+def test_webhook_rejects_wrong_secret_and_queues_update() -> None:
+    pool = UpdateWorkerPool(RecordingDispatcher(), bot=None, workers=2)
+    app = FastAPI()
+    app.include_router(create_webhook_router(pool, "/hook", "s3cret"))
+    client = TestClient(app)
+    payload = make_update(1, 5).model_dump(mode="json", exclude_none=True)
+
+    denied = client.post("/hook", json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    accepted = client.post("/hook", json=payload, headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+
+    assert denied.status_code == 401
+    assert accepted.status_code == 200
+    assert pool.qsize() == 1
@@ -0,0 +1,92 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy import inspect
+
+from db.models import HpLessonResult, User
+from middlewares.user import DbUserMiddleware
+from service.users import UserCache, _invalidate_lesson_user, _invalidate_user, get_user, user_cache
+
+
+def make_session(user: User | None) -> MagicMock:
+    session = MagicMock()
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = user
+    session.execute = AsyncMock(return_value=result)
+    session.merge = AsyncMock(side_effect=lambda instance, load: instance)
+    return session
+
+
+def test_cache_indexes_user_by_both_ids() -> None:
+    cache = UserCache(ttl=60)
+    cache.set(User(id=1, tg_user_id=10, max_user_id=20, first_name="Иван"))
+
+    assert cache.get(("tg", 10))["first_name"] == "Иван"
+    assert cache.get(("max", 20))["id"] == 1
+
+    cache.invalidate(1)
+
+    assert cache.get(("tg", 10)) is None
+    assert cache.get(("max", 20)) is None
+
+
+def test_expired_snapshot_is_dropped() -> None:
+    cache = UserCache(ttl=-1)
+    cache.set(User(id=1, tg_user_id=10))
+
+    assert cache.get(("tg", 10)) is None
+
+
+@pytest.mark.asyncio
+async def test_second_lookup_is_served_from_cache() -> None:
+    user_cache.clear()
+    session = make_session(User(id=3, tg_user_id=30, client_type="Монтажник"))
+
+    first = await get_user(session, tg_user_id=30)
+    second = await get_user(make_session(None), tg_user_id=30)
+
+    session.execute.assert_awaited_once()
+    assert second is not first
+    assert second.id == 3
+    assert second.client_type == "Монтажник"
+    # Объект из снимка считается сохранённым и не несёт изменений
+    assert inspect(second).detached
+    assert not inspect(second).modified
+
+
+@pytest.mark.asyncio
+async def test_writes_invalidate_cached_user() -> None:
+    user_cache.clear()
+    user = User(id=4, tg_user_id=40)
+    user_cache.set(user)
+
+    _invalidate_user(None, None, user)
+    assert user_cache.get(("tg", 40)) is None
+
+    user_cache.set(user)
+    _invalidate_lesson_user(None, None, HpLessonResult(user_id=4, lesson_key="lesson_1"))
+    assert user_cache.get(("tg", 40)) is None
+
+
+@pytest.mark.asyncio
+async def test_middleware_injects_user_once_per_update() -> None:
+    user_cache.clear()
+    user = User(id=5, tg_user_id=50)
+    session = make_session(user)
+    handler = AsyncMock(return_value="ok")
+    data = {"session": session, "event_from_user": MagicMock(id=50)}
+
+    assert await DbUserMiddleware()(handler, MagicMock(), data) == "ok"
+
+    assert data["db_user"] is user
+    session.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_middleware_without_user_context_sets_none() -> None:
+    handler = AsyncMock()
+    data = {"session": make_session(None)}
+
+    await DbUserMiddleware()(handler, MagicMock(), data)
+
+    assert data["db_user"] is None
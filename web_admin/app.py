@@ -8,8 +8,10 @@ from fastapi import FastAPI
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.staticfiles import StaticFiles
 
+from amo_api.amo_api import AmoCRMWrapper
 from config.config import AdminWebConfig
 from db import async_session_factory
+from service.report_jobs import ReportJobManager
 from web_admin.auth import LoginRateLimiter
 from web_admin.repository import BroadcastRepository
 from web_admin.routes import create_admin_router
@@ -17,25 +19,60 @@ from web_admin.service import BroadcastService
 from web_admin.max_client import MaxBroadcastClient
 
 
-def create_admin_app(bot: Bot, config: AdminWebConfig) -> FastAPI:
+def create_broadcast_service(bot: Bot, config: AdminWebConfig) -> BroadcastService:
     repository = BroadcastRepository(async_session_factory)
     max_client = (
         MaxBroadcastClient(config.max_bot_api_url, config.max_bot_api_secret)
         if config.max_enabled
         else None
     )
-    service = BroadcastService(repository, bot, config.data_dir, max_client=max_client)
+    return BroadcastService(
+        repository,
+        bot,
+        config.data_dir,
+        max_client=max_client,
+        concurrency=config.broadcast_concurrency,
+        telegram_rate=config.broadcast_telegram_rate,
+        max_rate=config.broadcast_max_rate,
+    )
+
+
+def create_admin_app(
+    bot: Bot,
+    config: AdminWebConfig,
+    *,
+    run_worker: bool = True,
+    report_jobs: ReportJobManager | None = None,
+    amo_api: AmoCRMWrapper | None = None,
+) -> FastAPI:
+    service = create_broadcast_service(bot, config)
+    # Без общего с ботом менеджера админка держит свой и закрывает его сама
+    own_report_jobs = report_jobs is None
+    if own_report_jobs:
+        report_jobs = ReportJobManager(
+            async_session_factory,
+            config.data_dir / "reports",
+            ttl=config.report_cache_ttl,
+        )
 
     @asynccontextmanager
     async def lifespan(_: FastAPI):
-        await service.initialize()
-        service.start()
+        # Без run_worker рассылки отправляет отдельный процесс broadcast-worker,
+        # админка только создаёт их в БД
+        await service.initialize(recover_interrupted=run_worker)
+        if run_worker:
+            service.start()
         yield
         await service.stop()
+        if own_report_jobs:
+            await report_jobs.close()
 
     app = FastAPI(title="HiTE PRO education admin", lifespan=lifespan)
     app.state.admin_config = config
     app.state.admin_service = service
+    app.state.report_jobs = report_jobs
+    # Метрики amoCRM считаются в процессе бота: без общего клиента маршрут отдаёт 404
+    app.state.amo_api = amo_api
     app.state.admin_rate_limiter = LoginRateLimiter()
     app.add_middleware(
         SessionMiddleware,
@@ -1,15 +1,26 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Sequence
 
-from sqlalchemy import func, select, update
+from sqlalchemy import func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import selectinload
 
 from db.models import Broadcast, BroadcastButton, BroadcastDelivery, BroadcastRecipient, User
 
 
+INSERT_CHUNK_SIZE = 1000
+
+
+@dataclass(frozen=True, slots=True)
+class DeliveryResult:
+    delivery_id: int
+    success: bool
+    error: str | None = None
+
+
 class BroadcastRepository:
     def __init__(self, session_factory: async_sessionmaker[AsyncSession]):
         self.session_factory = session_factory
@@ -67,37 +78,56 @@ class BroadcastRepository:
             )
             session.add(broadcast)
             await session.flush()
-            for position, item in enumerate(buttons):
-                session.add(BroadcastButton(
-                    broadcast_id=broadcast.id,
-                    position=position,
-                    text=item["text"],
-                    action_key=item["action_key"],
-                ))
-            for item in recipients:
-                recipient = BroadcastRecipient(
-                    broadcast_id=broadcast.id,
-                    row_number=item["row_number"],
-                    telegram_id=item["telegram_id"],
-                    raw_telegram_id=item["raw_telegram_id"],
-                    max_id=item["max_id"],
-                    raw_max_id=item["raw_max_id"],
-                    amo_deal_id=item["amo_deal_id"],
-                    raw_amo_deal_id=item["raw_amo_deal_id"],
-                    name=item["name"],
+            if buttons:
+                await session.execute(
+                    insert(BroadcastButton),
+                    [
+                        {
+                            "broadcast_id": broadcast.id,
+                            "position": position,
+                            "text": item["text"],
+                            "action_key": item["action_key"],
+                        }
+                        for position, item in enumerate(buttons)
+                    ],
                 )
-                session.add(recipient)
-                await session.flush()
-                for platform, delivery in item["deliveries"].items():
-                    session.add(BroadcastDelivery(
-                        broadcast_id=broadcast.id,
-                        recipient_id=recipient.id,
-                        platform=platform,
-                        target_id=delivery["target_id"],
-                        raw_target_id=delivery["raw_target_id"],
-                        status=delivery["status"],
-                        error=delivery["error"],
-                    ))
+            # Получателей и доставки пишем многострочными INSERT пачками, а не flush на каждую строку
+            for start in range(0, len(recipients), INSERT_CHUNK_SIZE):
+                chunk = recipients[start:start + INSERT_CHUNK_SIZE]
+                result = await session.execute(
+                    insert(BroadcastRecipient).returning(
+                        BroadcastRecipient.id, sort_by_parameter_order=True
+                    ),
+                    [
+                        {
+                            "broadcast_id": broadcast.id,
+                            "row_number": item["row_number"],
+                            "telegram_id": item["telegram_id"],
+                            "raw_telegram_id": item["raw_telegram_id"],
+                            "max_id": item["max_id"],
+                            "raw_max_id": item["raw_max_id"],
+                            "amo_deal_id": item["amo_deal_id"],
+                            "raw_amo_deal_id": item["raw_amo_deal_id"],
+                            "name": item["name"],
+                        }
+                        for item in chunk
+                    ],
+                )
+                deliveries = [
+                    {
+                        "broadcast_id": broadcast.id,
+                        "recipient_id": recipient_id,
+                        "platform": platform,
+                        "target_id": delivery["target_id"],
+                        "raw_target_id": delivery["raw_target_id"],
+                        "status": delivery["status"],
+                        "error": delivery["error"],
+                    }
+                    for recipient_id, item in zip(result.scalars().all(), chunk)
+                    for platform, delivery in item["deliveries"].items()
+                ]
+                if deliveries:
+                    await session.execute(insert(BroadcastDelivery), deliveries)
             await session.commit()
             return broadcast.id
 
@@ -212,14 +242,52 @@ class BroadcastRepository:
                 broadcast_id = broadcast.id
         return await self.get(broadcast_id)
 
-    async def pending_deliveries(self, broadcast_id: int) -> list[BroadcastDelivery]:
+    async def has_pending(self, broadcast_id: int, platform: str) -> bool:
         async with self.session_factory() as session:
-            result = await session.execute(
-                select(BroadcastDelivery)
+            delivery_id = await session.scalar(
+                select(BroadcastDelivery.id)
+                .where(
+                    BroadcastDelivery.broadcast_id == broadcast_id,
+                    BroadcastDelivery.platform == platform,
+                    BroadcastDelivery.status == "pending",
+                )
+                .limit(1)
+            )
+            return delivery_id is not None
+
+    async def claim_deliveries(
+        self,
+        broadcast_id: int,
+        platform: str,
+        limit: int,
+    ) -> list[BroadcastDelivery]:
+        """Переводит следующую пачку pending-доставок в sending одним UPDATE ... RETURNING."""
+        async with self.session_factory() as session:
+            chunk = (
+                select(BroadcastDelivery.id)
                 .where(
                     BroadcastDelivery.broadcast_id == broadcast_id,
+                    BroadcastDelivery.platform == platform,
                     BroadcastDelivery.status == "pending",
                 )
+                .order_by(BroadcastDelivery.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            result = await session.execute(
+                update(BroadcastDelivery)
+                .where(BroadcastDelivery.id.in_(chunk))
+                .values(status="sending", started_at=datetime.now(timezone.utc))
+                .returning(BroadcastDelivery.id)
+            )
+            claimed = list(result.scalars())
+            await session.commit()
+            if not claimed:
+                return []
+            result = await session.execute(
+                select(BroadcastDelivery)
+                .where(BroadcastDelivery.id.in_(claimed))
                 .options(selectinload(BroadcastDelivery.recipient))
                 .order_by(BroadcastDelivery.id)
             )
@@ -271,6 +339,15 @@ class BroadcastRepository:
             )
             await session.commit()
 
+    async def set_telegram_file_id(self, broadcast_id: int, file_id: str) -> None:
+        async with self.session_factory() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id)
+                .values(telegram_file_id=file_id)
+            )
+            await session.commit()
+
     async def clear_max_media(self, broadcast_id: int) -> None:
         async with self.session_factory() as session:
             await session.execute(
@@ -299,31 +376,51 @@ class BroadcastRepository:
             await session.commit()
             return count
 
-    async def mark_sending(self, delivery_id: int) -> bool:
-        async with self.session_factory() as session:
-            result = await session.execute(
-                update(BroadcastDelivery)
-                .where(BroadcastDelivery.id == delivery_id, BroadcastDelivery.status == "pending")
-                .values(status="sending", started_at=datetime.now(timezone.utc))
-            )
-            await session.commit()
-            return bool(result.rowcount)
+    async def record_results(self, broadcast_id: int, results: Sequence[DeliveryResult]) -> None:
+        """Записывает пачку результатов и счётчики рассылки в одной транзакции.
 
-    async def mark_result(self, delivery_id: int, *, success: bool, error: str | None = None) -> None:
+        Обновляются только строки в статусе sending, поэтому повторная запись
+        не задваивает счётчики.
+        """
+        if not results:
+            return
+        now = datetime.now(timezone.utc)
+        groups: dict[tuple[bool, str | None], list[int]] = {}
+        for item in results:
+            key = (True, None) if item.success else (False, item.error)
+            groups.setdefault(key, []).append(item.delivery_id)
+        success_count = error_count = 0
+        last_error: str | None = None
         async with self.session_factory() as session:
-            delivery = await session.get(BroadcastDelivery, delivery_id)
-            if delivery is None or delivery.status != "sending":
-                return
-            delivery.status = "success" if success else "error"
-            delivery.error = error
-            delivery.finished_at = datetime.now(timezone.utc)
-            broadcast = await session.get(Broadcast, delivery.broadcast_id)
-            if broadcast is not None:
+            for (success, error), delivery_ids in groups.items():
+                result = await session.execute(
+                    update(BroadcastDelivery)
+                    .where(
+                        BroadcastDelivery.id.in_(delivery_ids),
+                        BroadcastDelivery.status == "sending",
+                    )
+                    .values(
+                        status="success" if success else "error",
+                        error=error,
+                        finished_at=now,
+                    )
+                )
+                count = int(result.rowcount or 0)
                 if success:
-                    broadcast.success_count += 1
-                else:
-                    broadcast.error_count += 1
-                    broadcast.last_error = error
+                    success_count += count
+                elif count:
+                    error_count += count
+                    last_error = error or last_error
+            if success_count or error_count:
+                values: dict[str, Any] = {
+                    "success_count": Broadcast.success_count + success_count,
+                    "error_count": Broadcast.error_count + error_count,
+                }
+                if last_error is not None:
+                    values["last_error"] = last_error
+                await session.execute(
+                    update(Broadcast).where(Broadcast.id == broadcast_id).values(**values)
+                )
             await session.commit()
 
     async def finish(self, broadcast_id: int) -> None:
@@ -10,11 +10,12 @@ from typing import Any
 from zoneinfo import ZoneInfo
 
 from fastapi import APIRouter, HTTPException, Request, status
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from markupsafe import Markup
 from starlette.datastructures import UploadFile
 
+from service.reports import REPORTS
 from web_admin.auth import client_key, get_csrf_token, is_authenticated, valid_csrf
 from web_admin.validation import (
     ALLOWED_ACTIONS,
@@ -51,7 +52,10 @@ STATUS_LABELS = {
     "error": "Ошибка",
     "skipped": "Пропущено",
     "unknown": "Результат неизвестен",
+    "done": "Готов",
+    "empty": "Нет данных",
 }
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 
 def _format_moscow(value: datetime | None) -> str:
@@ -394,4 +398,59 @@ def create_admin_router(prefix: str) -> APIRouter:
             "platforms": platform_stats,
         }
 
+    @router.get("/reports", response_class=HTMLResponse)
+    async def reports(request: Request):
+        if (redirect := require_admin(request)):
+            return redirect
+        jobs = request.app.state.report_jobs.jobs()
+        return templates.TemplateResponse(
+            request=request,
+            name="reports.html",
+            context=context(request, reports=REPORTS.values(), jobs=jobs),
+        )
+
+    @router.post("/reports/{report_name}")
+    async def submit_report(request: Request, report_name: str):
+        if (redirect := require_admin(request)):
+            return redirect
+        form = await request.form()
+        require_csrf(request, str(form.get("csrf_token", "")))
+        report = REPORTS.get(report_name)
+        if report is None:
+            raise HTTPException(status_code=404)
+        request.app.state.report_jobs.submit(report)
+        return RedirectResponse(f"{prefix}/reports", status_code=303)
+
+    @router.get("/reports/jobs/{job_id}/status")
+    async def report_status(request: Request, job_id: str):
+        if not is_authenticated(request):
+            return JSONResponse({"detail": "unauthorized"}, status_code=401)
+        job = request.app.state.report_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404)
+        return {
+            "status": job.status,
+            "status_label": STATUS_LABELS.get(job.status, job.status),
+            "rows": job.rows,
+            "finished": job.finished,
+        }
+
+    @router.get("/reports/jobs/{job_id}/file")
+    async def report_file(request: Request, job_id: str):
+        if (redirect := require_admin(request)):
+            return redirect
+        job = request.app.state.report_jobs.get(job_id)
+        if job is None or job.path is None or not job.path.exists():
+            raise HTTPException(status_code=404)
+        return FileResponse(job.path, filename=job.report.filename(), media_type=XLSX_MEDIA_TYPE)
+
+    @router.get("/metrics/amo")
+    async def amo_metrics(request: Request):
+        if not is_authenticated(request):
+            return JSONResponse({"detail": "unauthorized"}, status_code=401)
+        amo_api = getattr(request.app.state, "amo_api", None)
+        if amo_api is None:
+            raise HTTPException(status_code=404)
+        return amo_api.metrics_snapshot()
+
     return router
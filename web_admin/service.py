@@ -2,15 +2,19 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
+from collections import deque
 from pathlib import Path
+from typing import Awaitable, Callable
 
 from aiogram import Bot
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
-from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from db.models import Broadcast, BroadcastDelivery
-from web_admin.repository import BroadcastRepository
+from service.rate_limit import TokenBucket
+from web_admin.repository import BroadcastRepository, DeliveryResult
 from web_admin.max_client import MaxBroadcastClient, MaxDeliveryError, MaxServiceUnavailable
 from web_admin.validation import adapt_telegram_html_for_max, render_message
 
@@ -18,6 +22,46 @@ from web_admin.validation import adapt_telegram_html_for_max, render_message
 logger = logging.getLogger(__name__)
 
 
+class DeliveryResultBuffer:
+    """Копит результаты доставок и пишет их пачками вместе со счётчиками рассылки.
+
+    Пока результат не записан, строка остаётся в sending: после падения процесса
+    recover_interrupted честно пометит её как unknown.
+    """
+
+    def __init__(
+        self,
+        repository: BroadcastRepository,
+        broadcast_id: int,
+        *,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.repository = repository
+        self.broadcast_id = broadcast_id
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self._items: list[DeliveryResult] = []
+        self._flushed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def add(self, delivery_id: int, *, success: bool, error: str | None = None) -> None:
+        self._items.append(DeliveryResult(delivery_id, success, error))
+        if (
+            len(self._items) >= self.batch_size
+            or time.monotonic() - self._flushed_at >= self.flush_interval
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            self._flushed_at = time.monotonic()
+            if not self._items:
+                return
+            items, self._items = self._items, []
+            await self.repository.record_results(self.broadcast_id, items)
+
+
 class BroadcastService:
     def __init__(
         self,
@@ -25,18 +69,31 @@ class BroadcastService:
         bot: Bot,
         data_dir: Path,
         max_client: MaxBroadcastClient | None = None,
+        *,
+        concurrency: int = 16,
+        telegram_rate: float = 25,
+        max_rate: float = 20,
+        result_batch_size: int = 100,
+        result_flush_interval: float = 1.0,
     ):
         self.repository = repository
         self.bot = bot
         self.data_dir = data_dir
         self.media_dir = data_dir / "media"
         self.max_client = max_client
+        self.concurrency = max(concurrency, 1)
+        # У каждой платформы свой бюджет: Telegram допускает ~30 сообщений в секунду на бота
+        self.telegram_bucket = TokenBucket(telegram_rate)
+        self.max_bucket = TokenBucket(max_rate)
+        self.result_batch_size = result_batch_size
+        self.result_flush_interval = result_flush_interval
         self._worker_task: asyncio.Task | None = None
         self._wake_event = asyncio.Event()
 
-    async def initialize(self) -> None:
+    async def initialize(self, *, recover_interrupted: bool = True) -> None:
         self.media_dir.mkdir(parents=True, exist_ok=True)
-        await self.repository.recover_interrupted()
+        if recover_interrupted:
+            await self.repository.recover_interrupted()
 
     def start(self) -> None:
         if self._worker_task is None or self._worker_task.done():
@@ -72,11 +129,15 @@ class BroadcastService:
         if broadcast is None:
             return False
         try:
-            deliveries = await self.repository.pending_deliveries(broadcast.id)
-            telegram_deliveries = [item for item in deliveries if item.platform == "telegram"]
-            max_deliveries = [item for item in deliveries if item.platform == "max"]
-            await self._process_telegram(broadcast, telegram_deliveries)
-            await self._process_max(broadcast, max_deliveries)
+            # Telegram и MAX отправляются параллельно, каждая платформа в своём темпе
+            results = await asyncio.gather(
+                self._process_telegram(broadcast),
+                self._process_max(broadcast),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
             await self.repository.finish(broadcast.id)
         except Exception as error:
             logger.exception("Broadcast %s failed", broadcast.id)
@@ -91,27 +152,96 @@ class BroadcastService:
                 self.delete_media(latest.media_path)
         return True
 
-    async def _process_telegram(
-        self, broadcast: Broadcast, deliveries: list[BroadcastDelivery]
-    ) -> None:
-        for delivery in deliveries:
-            if not await self.repository.mark_sending(delivery.id):
-                continue
+    async def _run_pool(
+        self,
+        broadcast: Broadcast,
+        platform: str,
+        bucket: TokenBucket,
+        send: Callable[[Broadcast, BroadcastDelivery], Awaitable[None]],
+        *,
+        fatal: tuple[type[Exception], ...] = (),
+        warm_up: Callable[[], bool] | None = None,
+    ) -> str | None:
+        """Отправляет доставки платформы пулом из concurrency долгоживущих воркеров.
+
+        Воркеры берут доставки из общей очереди и освобождают слот сразу после своей
+        отправки, не дожидаясь соседей. Опустевшую очередь пополняет один воркер
+        через claim_deliveries пачкой по concurrency строк, так что в sending лежит
+        не больше двух пачек. Ошибка из fatal останавливает платформу; её текст
+        возвращается вызывающему. Пока warm_up() истинно, доставки уходят по одной.
+        """
+        results = DeliveryResultBuffer(
+            self.repository,
+            broadcast.id,
+            batch_size=self.result_batch_size,
+            flush_interval=self.result_flush_interval,
+        )
+        stop_error: str | None = None
+        queue: deque[BroadcastDelivery] = deque()
+        claim_lock = asyncio.Lock()
+        exhausted = False
+
+        async def deliver(delivery: BroadcastDelivery) -> None:
+            nonlocal stop_error
+            if stop_error is None:
+                await bucket.acquire()
+            if stop_error is not None:
+                await results.add(delivery.id, success=False, error=stop_error)
+                return
             try:
-                await self._send_telegram(broadcast, delivery)
+                await send(broadcast, delivery)
+            except fatal as error:
+                stop_error = stop_error or str(error)[:500]
+                await results.add(delivery.id, success=False, error=str(error)[:500])
             except Exception as error:
                 logger.exception(
-                    "Broadcast %s failed for telegram_id=%s", broadcast.id, delivery.target_id
+                    "Broadcast %s failed for %s_id=%s", broadcast.id, platform, delivery.target_id
                 )
-                await self.repository.mark_result(delivery.id, success=False, error=str(error)[:500])
+                await results.add(delivery.id, success=False, error=str(error)[:500])
             else:
-                await self.repository.mark_result(delivery.id, success=True)
-            await asyncio.sleep(0.05)
+                await results.add(delivery.id, success=True)
 
-    async def _process_max(
-        self, broadcast: Broadcast, deliveries: list[BroadcastDelivery]
-    ) -> None:
-        if not deliveries:
+        async def next_delivery() -> BroadcastDelivery | None:
+            nonlocal exhausted
+            async with claim_lock:
+                # Пока ждали замок, очередь мог пополнить другой воркер
+                if not queue and not exhausted and stop_error is None:
+                    claimed = await self.repository.claim_deliveries(
+                        broadcast.id, platform, self.concurrency
+                    )
+                    queue.extend(claimed)
+                    exhausted = not claimed
+            return queue.popleft() if queue else None
+
+        async def worker() -> None:
+            while (delivery := await next_delivery()) is not None:
+                await deliver(delivery)
+
+        try:
+            # Прогрев идёт до запуска пула: первая отправка даёт данные для остальных
+            while stop_error is None and warm_up is not None and warm_up():
+                claimed = await self.repository.claim_deliveries(broadcast.id, platform, 1)
+                if not claimed:
+                    return stop_error
+                await deliver(claimed[0])
+            if stop_error is None:
+                await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            await results.flush()
+        return stop_error
+
+    async def _process_telegram(self, broadcast: Broadcast) -> None:
+        # Первая успешная отправка загружает файл и даёт file_id для всех остальных
+        await self._run_pool(
+            broadcast,
+            "telegram",
+            self.telegram_bucket,
+            self._send_telegram,
+            warm_up=lambda: bool(broadcast.media_kind) and not broadcast.telegram_file_id,
+        )
+
+    async def _process_max(self, broadcast: Broadcast) -> None:
+        if not await self.repository.has_pending(broadcast.id, "max"):
             return
         if self.max_client is None:
             await self.repository.fail_pending_platform(
@@ -125,21 +255,12 @@ class BroadcastService:
             await self.repository.fail_pending_platform(broadcast.id, "max", str(error)[:500])
             return
 
-        for delivery in deliveries:
-            if not await self.repository.mark_sending(delivery.id):
-                continue
-            try:
-                await self._send_max(broadcast, delivery)
-            except MaxServiceUnavailable as error:
-                await self.repository.mark_result(delivery.id, success=False, error=str(error)[:500])
-                await self.repository.fail_pending_platform(broadcast.id, "max", str(error)[:500])
-                break
-            except Exception as error:
-                logger.exception("Broadcast %s failed for max_id=%s", broadcast.id, delivery.target_id)
-                await self.repository.mark_result(delivery.id, success=False, error=str(error)[:500])
-            else:
-                await self.repository.mark_result(delivery.id, success=True)
-            await asyncio.sleep(0.05)
+        outage = await self._run_pool(
+            broadcast, "max", self.max_bucket, self._send_max, fatal=(MaxServiceUnavailable,)
+        )
+        if outage is not None:
+            # Остальные доставки MAX ещё pending: помечаем их разом, как и раньше
+            await self.repository.fail_pending_platform(broadcast.id, "max", outage)
 
     async def _ensure_max_media(self, broadcast: Broadcast) -> None:
         if not broadcast.media_kind or broadcast.max_media_token:
@@ -171,27 +292,30 @@ class BroadcastService:
             raise ValueError("Missing telegram_id")
         message = render_message(broadcast.message, delivery.recipient.name)
         keyboard = self._build_keyboard(broadcast)
+        media: str | FSInputFile | None = None
+        if broadcast.media_kind:
+            media = broadcast.telegram_file_id or FSInputFile(broadcast.media_path)
 
-        async def send() -> None:
+        async def send() -> Message:
             if broadcast.media_kind == "photo":
-                await self.bot.send_photo(
+                return await self.bot.send_photo(
                     chat_id=delivery.target_id,
-                    photo=FSInputFile(broadcast.media_path),
+                    photo=media,
                     caption=message,
                     reply_markup=keyboard,
                     parse_mode=ParseMode.HTML,
                 )
             elif broadcast.media_kind == "video":
-                await self.bot.send_video(
+                return await self.bot.send_video(
                     chat_id=delivery.target_id,
-                    video=FSInputFile(broadcast.media_path),
+                    video=media,
                     caption=message,
                     reply_markup=keyboard,
                     parse_mode=ParseMode.HTML,
                     supports_streaming=True,
                 )
             else:
-                await self.bot.send_message(
+                return await self.bot.send_message(
                     chat_id=delivery.target_id,
                     text=message,
                     reply_markup=keyboard,
@@ -200,16 +324,35 @@ class BroadcastService:
 
         for attempt in range(3):
             try:
-                await send()
-                return
+                sent = await send()
             except TelegramRetryAfter as error:
                 if attempt == 2:
                     raise
+                # Флуд-контроль касается всего бота: притормаживаем всех отправителей
+                self.telegram_bucket.pause(float(error.retry_after))
                 await asyncio.sleep(float(error.retry_after))
             except (TelegramNetworkError, TelegramServerError):
                 if attempt == 2:
                     raise
                 await asyncio.sleep(2 ** attempt)
+            else:
+                if broadcast.media_kind and not broadcast.telegram_file_id:
+                    await self._remember_telegram_file_id(broadcast, sent)
+                return
+
+    async def _remember_telegram_file_id(self, broadcast: Broadcast, message: Message) -> None:
+        if message.photo:
+            file_id = message.photo[-1].file_id
+        elif message.video is not None:
+            file_id = message.video.file_id
+        else:
+            return
+        broadcast.telegram_file_id = file_id
+        # Сохраняем в БД, чтобы прерванная рассылка после рестарта не загружала файл заново
+        try:
+            await self.repository.set_telegram_file_id(broadcast.id, file_id)
+        except Exception:
+            logger.exception("Could not store Telegram file_id for broadcast %s", broadcast.id)
 
     @staticmethod
     def _build_keyboard(broadcast: Broadcast) -> InlineKeyboardMarkup | None:
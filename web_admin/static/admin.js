@@ -187,4 +187,20 @@
         };
         window.setTimeout(poll, 600);
     }
+
+    const reportJobs = document.querySelectorAll('[data-report-job]');
+    reportJobs.forEach((row) => {
+        const poll = async () => {
+            try {
+                const response = await fetch(row.dataset.statusUrl, {credentials:'same-origin', headers:{Accept:'application/json'}});
+                if (!response.ok) return;
+                const data = await response.json();
+                row.querySelector('[data-field="status-label"]').textContent = data.status_label;
+                row.querySelector('[data-field="rows"]').textContent = data.rows;
+                if (data.finished) { window.setTimeout(() => window.location.reload(), 500); return; }
+                window.setTimeout(poll, 1500);
+            } catch (_) { window.setTimeout(poll, 3000); }
+        };
+        window.setTimeout(poll, 600);
+    });
 })();